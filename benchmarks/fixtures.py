@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Generatore deterministico di dataset sintetici per benchmark VAR Processor
+"""
+
+import logging
+from pathlib import Path
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Righe dati massime per foglio Excel (1.048.576 meno l'intestazione)
+EXCEL_MAX_ROWS = 1048575
+
+DEALERS = [f"DEALER {i:03d} SRL" for i in range(40)]
+PUNTI_VENDITA = [f"PV {city} {i:02d}" for city in ('MILANO', 'ROMA', 'NAPOLI', 'TORINO', 'BARI') for i in range(12)]
+MODALITA_VENDITA = ['RATEALE', 'CONTANTI', 'FINANZIAMENTO', 'PERMUTA']
+TIPI_FINANZ = ['Classico', 'Rata Smart', 'Tasso Zero']
+STATI_PRAT = ['LIQUIDATA', 'APPROVATA', 'IN ATTESA', '']
+
+
+@dataclass
+class DatasetSpec:
+    """Parametri di generazione di un dataset sintetico."""
+    
+    rows: int = 10000  # Righe post vendita
+    seed: int = 42
+    ti_ratio: float = 0.8  # Righe TI rispetto a post vendita
+    data_ratio: float = 0.5  # Righe data.xlsx rispetto a post vendita
+    overlap_ratio: float = 0.6  # Quota IMEI TI presenti anche in post vendita
+    data_overlap_ratio: float = 0.8  # Quota IMEI data.xlsx presenti in post vendita o TI
+    invalid_imei_rate: float = 0.01  # Quota IMEI malformati per sorgente
+    ti_files: int = 2
+    causale_mix: Dict[str, float] = field(default_factory=lambda: {'TEL_INCLUSO': 0.7, 'PROMOCASH': 0.3})
+    finanziaria_mix: Dict[str, float] = field(default_factory=lambda: {'FINDOMESTIC': 0.75, 'COMPASS': 0.25})
+    
+    @property
+    def ti_rows(self) -> int:
+        return int(self.rows * self.ti_ratio)
+    
+    @property
+    def data_rows(self) -> int:
+        return int(self.rows * self.data_ratio)
+
+
+class SyntheticDatasetGenerator:
+    """
+    Genera dataset realistici post vendita, TI e data.xlsx.
+    
+    La generazione è deterministica per seed: stessa specifica, stessi dati.
+    """
+    
+    def __init__(self, spec: DatasetSpec):
+        """
+        Inizializza il generatore.
+        
+        Args:
+            spec: Specifica del dataset
+        """
+        self.spec = spec
+        self.rng = np.random.default_rng(spec.seed)
+        self._next_id = 0
+    
+    def generate(self) -> Dict[str, object]:
+        """
+        Genera i tre dataset in memoria.
+        
+        Returns:
+            Dict con 'post_vendita' (DataFrame), 'ti' (lista DataFrame per file)
+            e 'data' (DataFrame)
+        """
+        spec = self.spec
+        rng = self.rng
+        
+        n_pv, n_ti, n_data = spec.rows, spec.ti_rows, spec.data_rows
+        n_shared = min(int(n_ti * spec.overlap_ratio), n_pv)
+        
+        # Pool IMEI univoci: post vendita + TI non condivisi
+        pool = self._generate_imeis(n_pv + (n_ti - n_shared))
+        pv_imeis = pool[:n_pv]
+        ti_imeis = np.concatenate([
+            rng.choice(pv_imeis, size=n_shared, replace=False) if n_shared else pv_imeis[:0],
+            pool[n_pv:]
+        ])
+        rng.shuffle(ti_imeis)
+        
+        # data.xlsx: in parte IMEI noti, in parte sconosciuti
+        n_data_known = int(n_data * spec.data_overlap_ratio)
+        # IMEI condivisi presenti in entrambe le sorgenti: una sola volta
+        known = np.unique(np.concatenate([pv_imeis, ti_imeis]))
+        data_imeis = np.concatenate([
+            rng.choice(known, size=min(n_data_known, len(known)), replace=False),
+            self._generate_imeis(n_data - min(n_data_known, len(known)))
+        ])
+        
+        post_vendita = self._post_vendita_frame(self._corrupt(pv_imeis))
+        ti_frames = self._ti_frames(self._corrupt(ti_imeis))
+        data = self._data_frame(self._corrupt(data_imeis))
+        
+        return {'post_vendita': post_vendita, 'ti': ti_frames, 'data': data}
+    
+    def write(self, output_dir: Path, datasets: Dict[str, object] = None) -> Dict[str, List[Path]]:
+        """
+        Scrive i dataset come file Excel nella directory indicata.
+        
+        Args:
+            output_dir: Directory di destinazione
+            datasets: Dataset già generati (opzionale)
+            
+        Returns:
+            Dict con i path scritti per sorgente
+            
+        Raises:
+            ValueError: Se un file supera il limite righe di Excel
+        """
+        datasets = datasets or self.generate()
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        
+        frames = [('post_vendita', 'post_vendita_fisici.xlsx', datasets['post_vendita']),
+                  ('data', 'data.xlsx', datasets['data'])]
+        for index, ti_df in enumerate(datasets['ti'], start=1):
+            frames.append(('ti', f"telefono_incluso_{index:02d}.xlsx", ti_df))
+        
+        written = {'post_vendita': [], 'ti': [], 'data': []}
+        for source, filename, df in frames:
+            if len(df) > EXCEL_MAX_ROWS:
+                raise ValueError(f"{filename}: {len(df):,} righe superano il limite Excel ({EXCEL_MAX_ROWS:,})")
+            path = output_dir / filename
+            _write_xlsx_fast(df, path)
+            written[source].append(path)
+            logger.info(f"Scritto {path.name}: {len(df):,} righe")
+        
+        return written
+    
+    def fits_excel(self) -> bool:
+        """Verifica se tutti i file generati rientrano nel limite righe Excel."""
+        spec = self.spec
+        per_ti_file = -(-spec.ti_rows // max(spec.ti_files, 1))
+        return max(spec.rows, spec.data_rows, per_ti_file) <= EXCEL_MAX_ROWS
+    
+    def _generate_imeis(self, count: int) -> np.ndarray:
+        """Genera IMEI univoci a 15 cifre con check digit Luhn valido."""
+        if count <= 0:
+            return np.array([], dtype=object)
+        
+        # Corpo a 14 cifre (TAC + seriale) univoco per generatore
+        ids = self._next_id + self.rng.permutation(count).astype(np.int64)
+        self._next_id += count
+        body = 35000000000000 + ids * 7919
+        
+        digits = np.zeros((count, 14), dtype=np.int64)
+        remainder = body.copy()
+        for position in range(13, -1, -1):
+            digits[:, position] = remainder % 10
+            remainder //= 10
+        
+        # Luhn: raddoppia le cifre in posizione dispari (0-based) da sinistra
+        doubled = digits[:, 1::2] * 2
+        doubled = doubled - 9 * (doubled > 9)
+        total = digits[:, 0::2].sum(axis=1) + doubled.sum(axis=1)
+        check = (10 - total % 10) % 10
+        
+        return (body * 10 + check).astype(str).astype(object)
+    
+    def _corrupt(self, imeis: np.ndarray) -> np.ndarray:
+        """Rende malformata una quota di IMEI (cifra mancante, lettere, vuoto)."""
+        imeis = np.asarray(imeis, dtype=object).copy()
+        n_invalid = int(len(imeis) * self.spec.invalid_imei_rate)
+        if not n_invalid:
+            return imeis
+        
+        positions = self.rng.choice(len(imeis), size=n_invalid, replace=False)
+        kinds = self.rng.integers(0, 3, size=n_invalid)
+        for position, kind in zip(positions, kinds):
+            value = imeis[position]
+            if kind == 0:
+                imeis[position] = value[:14]
+            elif kind == 1:
+                imeis[position] = f"SN{value[:10]}"
+            else:
+                imeis[position] = ''
+        return imeis
+    
+    def _choice_mix(self, mix: Dict[str, float], size: int) -> np.ndarray:
+        """Estrae valori secondo una distribuzione {valore: peso}."""
+        values = list(mix.keys())
+        weights = np.array(list(mix.values()), dtype=float)
+        return self.rng.choice(values, size=size, p=weights / weights.sum())
+    
+    def _amounts(self, size: int, low: float, high: float) -> np.ndarray:
+        """Importi casuali a due decimali."""
+        return np.round(self.rng.uniform(low, high, size=size), 2)
+    
+    def _post_vendita_frame(self, imeis: np.ndarray) -> pd.DataFrame:
+        """Costruisce il DataFrame post_vendita_fisici."""
+        rng = self.rng
+        n = len(imeis)
+        base = np.datetime64('2025-01-01T08:00:00')
+        offsets = rng.integers(0, 180 * 24 * 3600, size=n).astype('timedelta64[s]')
+        
+        return pd.DataFrame({
+            'IMEI': imeis,
+            'Punto Vendita': rng.choice(PUNTI_VENDITA, size=n),
+            'Cliente': np.char.add('CLIENTE ', rng.integers(0, n * 2 + 1, size=n).astype(str)),
+            'Data Scarico': pd.Series(base + offsets).dt.strftime('%Y-%m-%d %H:%M:%S').values,
+            'IMPORTO CREDITO': self._amounts(n, 0, 600),
+            'ID Vendita': np.char.add('V', np.arange(1, n + 1).astype(str)),
+            'IMPORTO NDC': self._amounts(n, 0, 150),
+            'Modalita vendita': rng.choice(MODALITA_VENDITA, size=n),
+            'IMPORTO FINANZIATO': self._amounts(n, 0, 1500)
+        })
+    
+    def _ti_frames(self, imeis: np.ndarray) -> List[pd.DataFrame]:
+        """Costruisce i DataFrame telefono_incluso, uno per file."""
+        rng = self.rng
+        n = len(imeis)
+        df = pd.DataFrame({
+            'IMEI/SERIALE': imeis,
+            'RAGIONE SOCIALE DEALER': rng.choice(DEALERS, size=n),
+            'CODICE POS': np.char.add('POS', rng.integers(1000, 9999, size=n).astype(str)),
+            'NUMERO NOTA CREDITO': np.char.add('NC', np.arange(1, n + 1).astype(str)),
+            'CAUSALE': self._choice_mix(self.spec.causale_mix, n),
+            'IMPORTO ORIGINALE': -self._amounts(n, 0, 600)
+        })
+        bounds = np.linspace(0, n, max(self.spec.ti_files, 1) + 1).astype(int)
+        return [df.iloc[start:end].reset_index(drop=True) for start, end in zip(bounds[:-1], bounds[1:])]
+    
+    def _data_frame(self, imeis: np.ndarray) -> pd.DataFrame:
+        """Costruisce il DataFrame data.xlsx."""
+        rng = self.rng
+        n = len(imeis)
+        importo = self._amounts(n, 100, 1600)
+        
+        return pd.DataFrame({
+            'Codice': rng.integers(9000000000, 9009999999, size=n),
+            'Finanziaria': self._choice_mix(self.spec.finanziaria_mix, n),
+            'Importo Terminale': importo,
+            'Importo Finanziato': importo,
+            'IMEI Telefono Incluso': imeis,
+            'Id Pratica': np.char.add('P', rng.integers(0, 10 ** 9, size=n).astype(str)),
+            'Tipo Finanz': rng.choice(TIPI_FINANZ, size=n),
+            'N° L.d.C. o N° Prat. Findomestic': rng.integers(10 ** 10, 10 ** 11, size=n).astype(float),
+            'Stato Prat.': rng.choice(STATI_PRAT, size=n)
+        })
+
+
+def _write_xlsx_fast(df: pd.DataFrame, path: Path) -> None:
+    """Scrive un DataFrame in xlsx con openpyxl in modalità write-only."""
+    from openpyxl import Workbook
+    
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet('Sheet1')
+    worksheet.append(list(df.columns))
+    
+    columns = [df[col].tolist() for col in df.columns]
+    for row in zip(*columns):
+        worksheet.append(row)
+    
+    workbook.save(path)
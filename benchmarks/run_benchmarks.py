@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+Benchmark VAR Processor su dataset sintetici
+============================================
+
+Genera dataset deterministici a diverse scale, misura ogni fase
+(load, validate, match, difference, write, stats), salva i risultati in
+JSON e li confronta con una baseline per individuare regressioni.
+
+Esempi:
+  python benchmarks/run_benchmarks.py --scales 10k 100k
+  python benchmarks/run_benchmarks.py --scales 10k --save-baseline
+  python benchmarks/run_benchmarks.py --scales 1M 5M --in-memory
+  python benchmarks/run_benchmarks.py --calibrate --scales 5k 20k 50k
+"""
+
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# Rende importabili i moduli del progetto
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+import pandas as pd
+
+from config import Config
+from benchmarks.fixtures import DatasetSpec, SyntheticDatasetGenerator
+from processors.var_processor import VARProcessor
+from utils.calculators import CurrencyFormatter
+from utils.categorical import encode_categorical
+from utils.rules import get_rule_set
+from utils.profiler import StageProfiler
+from utils.validators import IMEIValidator
+from utils.planner import CostModel, inspect_inputs
+
+logger = logging.getLogger(__name__)
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+DEFAULT_BASELINE = BENCHMARK_DIR / "baseline.json"
+DEFAULT_RESULTS_DIR = BENCHMARK_DIR / "results"
+STAGES = ['load', 'validate', 'match', 'difference', 'write', 'stats']
+
+
+def parse_scale(value: str) -> int:
+    """Converte scale tipo '10k', '1M', '250000' in numero righe."""
+    text = value.strip().lower().replace('_', '')
+    multiplier = 1
+    if text.endswith('k'):
+        multiplier, text = 1000, text[:-1]
+    elif text.endswith('m'):
+        multiplier, text = 1000000, text[:-1]
+    try:
+        return int(float(text) * multiplier)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Scala non valida: {value}")
+
+
+def time_call(func, *args, **kwargs):
+    """Esegue una funzione e restituisce (risultato, secondi)."""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def benchmark_validate(datasets: Dict) -> float:
+    """Misura la validazione IMEI su tutte le sorgenti."""
+    series = [datasets['post_vendita']['IMEI'], datasets['data']['IMEI Telefono Incluso']]
+    series.extend(df['IMEI/SERIALE'] for df in datasets['ti'])
+    
+    start = time.perf_counter()
+    for imei_series in series:
+        IMEIValidator.validate_batch(imei_series)
+    return time.perf_counter() - start
+
+
+def benchmark_difference(datasets: Dict) -> float:
+    """Misura il calcolo differenze (regole vettoriali) sugli importi generati."""
+    pv = datasets['post_vendita']
+    ti = pd.concat(datasets['ti'], ignore_index=True)
+    n = min(len(pv), len(ti))
+    
+    finanziarie = (datasets['data']['Finanziaria'].tolist() * (n // max(len(datasets['data']), 1) + 1))[:n]
+    frame = pd.DataFrame({
+        'Causale': ti['CAUSALE'].iloc[:n].to_numpy(),
+        'FINANZIARIA': finanziarie,
+        'W-Importo Originale': CurrencyFormatter.series_to_cents(ti['IMPORTO ORIGINALE'].iloc[:n], absolute=True).to_numpy(),
+        'B-IMPORTO CREDITO': CurrencyFormatter.series_to_cents(pv['IMPORTO CREDITO'].iloc[:n]).to_numpy(),
+        'B-IMPORTO NDC': CurrencyFormatter.series_to_cents(pv['IMPORTO NDC'].iloc[:n]).to_numpy(),
+        'B-IMPORTO FINANZIATO': CurrencyFormatter.series_to_cents(pv['IMPORTO FINANZIATO'].iloc[:n]).to_numpy()
+    })
+    frame['W-Finanziato Wind'] = frame['B-IMPORTO FINANZIATO']
+    encode_categorical(frame, ['Causale', 'FINANZIARIA'])
+    rule_set = get_rule_set()
+    
+    start = time.perf_counter()
+    rule_set.evaluate(frame)
+    return time.perf_counter() - start
+
+
+def run_with_files(generator: SyntheticDatasetGenerator, datasets: Dict, work_dir: Path) -> Dict:
+    """Esegue la pipeline completa su file Excel generati."""
+    generator.write(work_dir, datasets)
+    
+    profiler = StageProfiler(enabled=True)
+    processor = VARProcessor(str(work_dir), profiler=profiler)
+    processor.run("benchmark_report.xlsx")
+    
+    stage = lambda name: profiler.get_stage(name).wall_seconds
+    summary, stats_seconds = time_call(processor.get_summary_statistics)
+    
+    return {
+        'mode': 'files',
+        'stages': {
+            'load': stage('discovery') + stage('load_post_vendita') + stage('load_ti') + stage('load_financial'),
+            'match': stage('matching'),
+            'write': stage('excel_output'),
+            'stats': stage('statistics') + stats_seconds
+        },
+        'rows': {
+            'post_vendita': profiler.get_stage('load_post_vendita').rows,
+            'ti': profiler.get_stage('load_ti').rows,
+            'data': profiler.get_stage('load_financial').rows,
+            'output': summary['total_records']
+        },
+        'peak_rss_mb': profiler.to_dict()['peak_rss_mb']
+    }
+
+
+def run_in_memory(datasets: Dict, work_dir: Path) -> Dict:
+    """Esegue caricamento, matching e statistiche sui DataFrame generati, senza file Excel."""
+    profiler = StageProfiler(enabled=True)
+    processor = VARProcessor(str(work_dir), profiler=profiler)
+    sources = {
+        'post_vendita': datasets['post_vendita'],
+        'ti': {f"telefono_incluso_{index:02d}.xlsx": ti_df for index, ti_df in enumerate(datasets['ti'], start=1)},
+        'data': datasets['data']
+    }
+    
+    # Stessi ingressi pubblici del workflow: preparazione sorgenti, duplicati, matching
+    processor.reconcile(*processor.load(sources))
+    
+    stage = lambda name: profiler.get_stage(name).wall_seconds
+    summary, summary_seconds = time_call(processor.get_summary_statistics)
+    
+    return {
+        'mode': 'in_memory',
+        'stages': {
+            'load': stage('load_post_vendita') + stage('load_ti') + stage('load_financial'),
+            'match': stage('matching'),
+            'stats': stage('statistics') + summary_seconds
+        },
+        'rows': {
+            'post_vendita': profiler.get_stage('load_post_vendita').rows,
+            'ti': profiler.get_stage('load_ti').rows,
+            'data': profiler.get_stage('load_financial').rows,
+            'output': summary['total_records']
+        },
+        'peak_rss_mb': profiler.to_dict()['peak_rss_mb']
+    }
+
+
+def run_scale(rows: int, args) -> Dict:
+    """Esegue il benchmark per una singola scala."""
+    spec = DatasetSpec(
+        rows=rows, seed=args.seed, overlap_ratio=args.overlap,
+        invalid_imei_rate=args.invalid_rate, ti_files=args.ti_files
+    )
+    generator = SyntheticDatasetGenerator(spec)
+    datasets, generate_seconds = time_call(generator.generate)
+    print(f"▶ Scala {rows:,} righe (generazione {generate_seconds:.2f}s)")
+    
+    work_dir = Path(tempfile.mkdtemp(prefix=f"var_bench_{rows}_", dir=args.work_dir))
+    try:
+        if args.in_memory or not generator.fits_excel():
+            if not args.in_memory:
+                print(f"  • Limite righe Excel superato: load/write saltati, modalità in memoria")
+            result = run_in_memory(datasets, work_dir)
+        else:
+            result = run_with_files(generator, datasets, work_dir)
+        
+        result['stages']['validate'] = benchmark_validate(datasets)
+        result['stages']['difference'] = benchmark_difference(datasets)
+    finally:
+        if args.keep_files:
+            print(f"  • File mantenuti in {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    
+    result['generate_seconds'] = round(generate_seconds, 4)
+    result['stages'] = {name: round(result['stages'][name], 4) for name in STAGES if name in result['stages']}
+    result['spec'] = {
+        'rows': spec.rows, 'ti_rows': spec.ti_rows, 'data_rows': spec.data_rows,
+        'overlap_ratio': spec.overlap_ratio, 'invalid_imei_rate': spec.invalid_imei_rate,
+        'ti_files': spec.ti_files, 'seed': spec.seed
+    }
+    
+    for name, seconds in result['stages'].items():
+        print(f"  • {name}: {seconds:.3f}s")
+    return result
+
+
+def calibration_sample(work_dir: str, rows: Dict[str, int]) -> Dict:
+    """
+    Esegue la pipeline su file già generati e raccoglie le misure per fase.
+    
+    Eseguita in un processo dedicato: RSS e picco non includono la
+    generazione dei dati né i run precedenti.
+    
+    Args:
+        work_dir: Directory con i file di input generati
+        rows: Righe generate per sorgente (i file write-only di openpyxl
+            non hanno l'attributo <dimension>)
+            
+    Returns:
+        Campione per CostModel.fit
+    """
+    logging.basicConfig(level=logging.WARNING, format=Config.LOG_FORMAT)
+    inputs = inspect_inputs(Path(work_dir))
+    
+    profiler = StageProfiler(enabled=True)
+    VARProcessor(work_dir, profiler=profiler).run("calibration_report.xlsx")
+    
+    return {
+        'rows': rows,
+        'bytes': {source: info['bytes'] for source, info in inputs.items()},
+        'stages': {record.name: {'seconds': record.wall_seconds, 'rss_mb': record.rss_mb}
+                   for record in profiler.records},
+        'peak_rss_mb': profiler.to_dict()['peak_rss_mb']
+    }
+
+
+def run_calibration(args) -> int:
+    """Misura la pipeline completa alle scale richieste e salva il modello di costo di --plan."""
+    samples = []
+    context = multiprocessing.get_context('spawn')
+    
+    for rows in args.scales:
+        spec = DatasetSpec(
+            rows=rows, seed=args.seed, overlap_ratio=args.overlap,
+            invalid_imei_rate=args.invalid_rate, ti_files=args.ti_files
+        )
+        generator = SyntheticDatasetGenerator(spec)
+        if not generator.fits_excel():
+            print(f"▶ Scala {rows:,} righe: limite righe Excel superato, saltata")
+            continue
+        
+        source_rows = {'post_vendita': spec.rows, 'ti': spec.ti_rows, 'data': spec.data_rows}
+        work_dir = Path(tempfile.mkdtemp(prefix=f"var_calib_{rows}_", dir=args.work_dir))
+        try:
+            generator.write(work_dir, generator.generate())
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                sample = executor.submit(calibration_sample, str(work_dir), source_rows).result()
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        
+        samples.append(sample)
+        total_seconds = sum(stage['seconds'] for stage in sample['stages'].values())
+        print(f"▶ Scala {rows:,} righe: {total_seconds:.2f}s, picco {sample['peak_rss_mb']:,.0f} MB")
+    
+    if len(samples) < 2:
+        print("❌ Servono almeno due scale valide per la calibrazione")
+        return 1
+    
+    path = CostModel.save(CostModel.fit(samples), args.calibration_file)
+    print(f"\n📐 Calibrazione --plan salvata: {path}")
+    return 0
+
+
+def compare_with_baseline(results: Dict, baseline: Dict, tolerance: float,
+                          min_delta: float) -> List[str]:
+    """
+    Confronta i risultati con la baseline.
+    
+    Args:
+        results: Risultati correnti
+        baseline: Risultati baseline
+        tolerance: Rallentamento relativo tollerato (0.2 = +20%)
+        min_delta: Differenza assoluta minima in secondi per segnalare
+        
+    Returns:
+        Lista regressioni rilevate
+    """
+    regressions = []
+    for scale, current in results['results'].items():
+        reference = baseline.get('results', {}).get(scale)
+        if not reference or reference.get('mode') != current.get('mode'):
+            continue
+        
+        for stage, seconds in current['stages'].items():
+            base_seconds = reference['stages'].get(stage)
+            if base_seconds is None:
+                continue
+            delta = seconds - base_seconds
+            if delta > min_delta and seconds > base_seconds * (1 + tolerance):
+                regressions.append(
+                    f"scala {scale}, fase {stage}: {base_seconds:.3f}s -> {seconds:.3f}s "
+                    f"(+{delta / base_seconds * 100 if base_seconds else float('inf'):.0f}%)"
+                )
+    return regressions
+
+
+def parse_arguments(argv: Optional[List[str]] = None):
+    """Parsing argomenti linea di comando."""
+    parser = argparse.ArgumentParser(description=f"Benchmark {Config.APP_NAME}")
+    parser.add_argument('--scales', nargs='+', type=parse_scale, default=[10000],
+                        help='Righe post vendita per scala (es. 10k 100k 1M 5M)')
+    parser.add_argument('--seed', type=int, default=42, help='Seed generatore')
+    parser.add_argument('--overlap', type=float, default=0.6, help='Quota IMEI TI presenti in post vendita')
+    parser.add_argument('--invalid-rate', type=float, default=0.01, help='Quota IMEI malformati')
+    parser.add_argument('--ti-files', type=int, default=2, help='Numero file telefono_incluso')
+    parser.add_argument('--in-memory', action='store_true',
+                        help='Salta scrittura/lettura Excel (misura solo fasi in memoria)')
+    parser.add_argument('--work-dir', type=str, default=None, help='Directory temporanea file generati')
+    parser.add_argument('--keep-files', action='store_true', help='Non cancella i file generati')
+    parser.add_argument('--output', type=str, help='File JSON risultati (default: benchmarks/results/)')
+    parser.add_argument('--baseline', type=str, default=str(DEFAULT_BASELINE), help='File JSON baseline')
+    parser.add_argument('--save-baseline', action='store_true', help='Salva i risultati come nuova baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Rallentamento tollerato (0.25 = +25%%)')
+    parser.add_argument('--min-delta', type=float, default=0.05, help='Differenza minima in secondi')
+    parser.add_argument('--calibrate', action='store_true',
+                        help='Calibra il modello di costo di --plan (pipeline completa, un processo per scala)')
+    parser.add_argument('--calibration-file', type=str, default=Config.PLAN_CALIBRATION_FILE,
+                        help='File JSON calibrazione (default: plan_calibration.json)')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Funzione principale."""
+    args = parse_arguments(argv)
+    logging.basicConfig(level=logging.WARNING, format=Config.LOG_FORMAT)
+    
+    if args.calibrate:
+        return run_calibration(args)
+    
+    results = {
+        'meta': {
+            'version': Config.VERSION,
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'pandas': pd.__version__
+        },
+        'results': {}
+    }
+    
+    for rows in args.scales:
+        results['results'][str(rows)] = run_scale(rows, args)
+    
+    # Salva risultati
+    if args.output:
+        output_path = Path(args.output)
+    else:
+        DEFAULT_RESULTS_DIR.mkdir(exist_ok=True)
+        output_path = DEFAULT_RESULTS_DIR / f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    output_path.write_text(json.dumps(results, indent=2), encoding='utf-8')
+    print(f"\n📁 Risultati: {output_path}")
+    
+    baseline_path = Path(args.baseline)
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps(results, indent=2), encoding='utf-8')
+        print(f"📌 Baseline aggiornata: {baseline_path}")
+        return 0
+    
+    if not baseline_path.exists():
+        print("ℹ️  Nessuna baseline trovata (usa --save-baseline)")
+        return 0
+    
+    baseline = json.loads(baseline_path.read_text(encoding='utf-8'))
+    regressions = compare_with_baseline(results, baseline, args.tolerance, args.min_delta)
+    if regressions:
+        print(f"❌ REGRESSIONI ({len(regressions)}):")
+        for regression in regressions:
+            print(f"   • {regression}")
+        return 1
+    
+    print("✅ Nessuna regressione rispetto alla baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,7 +3,10 @@
 Configurazioni per VAR Processor Production
 """
 
+import atexit
 import logging
+import logging.handlers
+import queue
 from pathlib import Path
 from typing import Dict, List
 
@@ -18,6 +21,12 @@ class Config:
     LOG_LEVEL = logging.INFO
     LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     LOG_FILE = 'var_processor.log'
+    LOG_QUEUE = True  # Scrittura log su thread in background (nessuna attesa I/O)
+    LOG_MAX_BYTES = 10 * 1024 * 1024  # Rotazione var_processor.log
+    LOG_BACKUP_COUNT = 5
+    LOG_JSON = False  # Output JSON strutturato (usa structlog se installato)
+    
+    _log_listener = None
     
     # File patterns
     POST_VENDITA_PATTERNS = [
@@ -85,34 +94,224 @@ class Config:
         'B-IMPORTO CREDITO',
         'B-IMPORTO NDC',
         'B-IMPORTO FINANZIATO',
-        'Differenza'
+        'Differenza',
+        'Chiave Match',
+        'IMEI TI',
+        'Nota Ripetuta'
+    ]
+    
+    # Chiavi secondarie per i record senza match IMEI o con IMEI scartato
+    # (opzionale, --match-keys), provate in ordine: (nome chiave, colonna
+    # post vendita, colonna TI). Chiavi con colonne assenti nei file sono
+    # ignorate; l'IMEI resta sempre la prima chiave
+    ENABLE_KEY_MATCHING = False
+    KEY_MATCHING_COLUMNS = ['Chiave Match', 'IMEI TI']  # Colonne di output solo con il match su chiavi
+    MATCH_SECONDARY_KEYS = [
+        ('ID_VENDITA', 'ID Vendita', 'ID VENDITA'),
+        ('NOTA_CREDITO', 'NUMERO NOTA CREDITO', 'NUMERO NOTA CREDITO')
     ]
     
-    # Colonne valute (per formattazione)
+    # Colonne importo in input, convertite in centesimi interi (int64)
+    # all'ingestione: i calcoli usano aritmetica intera esatta
+    AMOUNT_COLUMNS = {
+        'post_vendita': ['IMPORTO CREDITO', 'IMPORTO NDC', 'IMPORTO FINANZIATO'],
+        'ti': ['IMPORTO ORIGINALE'],
+        'data': ['Importo Finanziato']
+    }
+    
+    # Gestione IMEI duplicati per sorgente:
+    # 'last' / 'first' = tiene l'ultima / la prima riga,
+    # 'sum' = somma gli importi (campi descrittivi dall'ultima riga),
+    # 'list' = come 'sum' ed elenca i valori distinti di DUPLICATE_LIST_COLUMNS
+    DUPLICATE_POLICIES = ('last', 'first', 'sum', 'list')
+    DUPLICATE_POLICY = {
+        'post_vendita': 'last',
+        'ti': 'list',
+        'data': 'last'
+    }
+    DUPLICATE_LIST_COLUMNS = {
+        'post_vendita': ['ID Vendita'],
+        'ti': ['NUMERO NOTA CREDITO', 'SOURCE_FILE'],
+        'data': ['Id Pratica']
+    }
+    DUPLICATE_LIST_SEPARATOR = ' | '
+    
+    # Colonne valute (in centesimi fino alla scrittura, poi in euro)
     CURRENCY_COLUMNS = [
         'W-Importo Originale', 'W-Finanziato Wind', 
         'B-IMPORTO CREDITO', 'B-IMPORTO NDC', 
         'B-IMPORTO FINANZIATO', 'Differenza'
     ]
     
-    # Logiche differenza
+    # Logiche differenza (regole predefinite se il file regole non è presente)
     FINANZIARIE_PRIORITY = ['FINDOMESTIC', 'COMPASS']
     CAUSALE_TEL_INCLUSO = 'TEL_INCLUSO'
     CAUSALE_PROMOCASH = 'PROMOCASH'
+    DIFFERENCE_RULES_FILE = str(Path(__file__).resolve().parent / 'difference_rules.yaml')
     
     # Performance
-    CHUNK_SIZE = 1000  # Per file molto grandi
-    MAX_MEMORY_ROWS = 10000  # Limite righe in memoria
+    CHUNK_SIZE = 1000  # Righe per blocco nella lettura a blocchi
+    MAX_MEMORY_ROWS = None  # Soglia fissa di lettura a blocchi (None = decide il governor memoria)
+    EXCEL_LOAD_MB_PER_ROW = 0.001  # Stima memoria di pd.read_excel per riga (.xlsx)
+    VALIDATION_WORKERS = 4  # Thread per la lettura intestazioni in --validate-only --deep
+    
+    # Colonne testuali a bassa cardinalità memorizzate come categorical
+    # (ogni valore distinto una sola volta, groupby su codici interi)
+    ENABLE_CATEGORICAL = True
+    CATEGORICAL_MAX_RATIO = 0.5  # Valori distinti / righe oltre cui la colonna resta stringa
+    CATEGORICAL_COLUMNS = {
+        'post_vendita': ['Punto Vendita', 'Modalita vendita'],
+        'ti': ['RAGIONE SOCIALE DEALER', 'CODICE POS', 'CAUSALE', 'SOURCE_FILE'],
+        'data': ['Finanziaria', 'Tipo Finanz', 'Stato Prat.'],
+        'output': [
+            'Ragione sociale Dealer', 'Codice POS', 'Causale', 'Punto vendita',
+            'Modalita vendita', 'FINANZIARIA', 'Tipo Finanz', 'Stato Prat', '_TIPO', '_SOURCE_TI',
+            'Chiave Match', 'Nota Ripetuta'
+        ]
+    }
+    
+    # Budget memoria
+    ENABLE_MEMORY_GOVERNOR = True
+    MEMORY_BUDGET_MB = None  # None = MEMORY_BUDGET_RATIO della memoria disponibile
+    MEMORY_BUDGET_RATIO = 0.8
+    MEMORY_SOFT_RATIO = 0.75  # Quota del budget che attiva le strategie a basso consumo
+    MEMORY_CHECK_INTERVAL = 50000  # Record tra due controlli durante il matching
+    SPILL_DIR = None  # Directory spill su disco (None = temporanea di sistema)
+    
+    # Stima preventiva (--plan): modello lineare per fase da benchmarks/run_benchmarks.py --calibrate
+    PLAN_CALIBRATION_FILE = str(Path(__file__).resolve().parent / 'plan_calibration.json')
+    # Coefficienti di riferimento se la calibrazione manca ([costo fisso, costo per riga];
+    # misurati su VM a 1 core, scale 2k-50k righe post vendita)
+    PLAN_DEFAULT_MODEL = {
+        'stages': {
+            'load_post_vendita': {'seconds': [0.07, 0.00026], 'rss_mb': [141, 0.00089]},
+            'load_ti': {'seconds': [0.0, 0.00019], 'rss_mb': [143, 0.00065]},
+            'load_financial': {'seconds': [0.0, 0.00034], 'rss_mb': [147, 0.00067]},
+            'matching': {'seconds': [0.0, 0.000088], 'rss_mb': [146, 0.0017]},
+            'near_match': {'seconds': [0.0, 0.00003], 'rss_mb': [198, 0.0025]},
+            'anomalies': {'seconds': [0.0, 0.0000008], 'rss_mb': [198, 0.0025]},
+            'statistics': {'seconds': [0.006, 0.0], 'rss_mb': [199, 0.0025]},
+            'excel_output': {'seconds': [0.0, 0.00054], 'rss_mb': [181, 0.0064]}
+        },
+        'peak_rss_mb': [179, 0.0076],
+        'bytes_per_row': {'post_vendita': 70.4, 'ti': 41.9, 'data': 66.9}
+    }
+    
+    # Checkpoint delle fasi per la ripresa (--resume), rimossi a report completato
+    ENABLE_CHECKPOINTS = True
+    CHECKPOINT_DIR = None  # Directory checkpoint (None = CHECKPOINT_DEFAULT_DIR accanto ai file di input)
+    CHECKPOINT_DEFAULT_DIR = ".var_checkpoint"
+    
+    # Matching parallelo (partizioni per hash IMEI, un processo per partizione)
+    MATCHING_WORKERS = 1  # 1 = matching seriale
+    PARALLEL_MATCHING_MIN_ROWS = 100000  # Righe PV+TI sotto cui il costo dei processi non conviene
+    MATCHING_START_METHOD = None  # None = 'fork' dove disponibile (partizioni ereditate), altrimenti 'spawn'
+    ENABLE_SHARED_FRAMES = True  # Risultati dei worker come file Arrow IPC mappati (richiede pyarrow)
+    SHARED_FRAMES_DIR = None  # Directory di scambio (None = /dev/shm se presente, altrimenti temporanea)
+    
+    # Profiling fasi
+    ENABLE_PROFILING = False  # Misure tempo/memoria per fase
+    PROFILE_TRACEMALLOC = False  # Picco tracemalloc (overhead elevato)
+    PROFILE_RSS_SAMPLE_SECONDS = 0.05  # Intervallo campionamento RSS per il picco di fase
+    METRICS_SUFFIX = "_metrics.json"  # File metriche accanto al report
+    
+    # Metriche Prometheus (textfile collector node_exporter)
+    PROMETHEUS_TEXTFILE = None  # Path file .prom (None = disabilitato)
+    PROMETHEUS_JOB = "var_processor"
+    PROMETHEUS_PREFIX = "var_processor"
+    
+    # Audit calcoli differenza (file colonnare, scritto a blocchi)
+    AUDIT_FILE = None  # Path audit (None = disabilitato, "auto" = accanto al report)
+    AUDIT_BATCH_SIZE = 50000  # Righe per blocco
+    AUDIT_SUFFIX = "_audit"
+    
+    # Profilo qualità dati per file di input e quarantena delle righe scartate
+    QUARANTINE_FILE = None  # Path quarantena (None = disabilitata, "auto" = accanto al report)
+    QUARANTINE_SUFFIX = "_quarantena"
+    QUALITY_DATE_COLUMNS = {'post_vendita': ['Data Scarico']}
+    QUALITY_MIN_DATE = '2000-01-01'  # Date precedenti fuori intervallo
+    QUALITY_MAX_FUTURE_DAYS = 1  # Date oltre oggi + N giorni fuori intervallo
+    QUALITY_NULL_WARNING_RATE = 0.05  # Quota valori mancanti oltre cui una colonna è segnalata
+    
+    # Archivio storico multi-periodo (partizionato per periodo e run, indice IMEI ordinato)
+    ARCHIVE_DIR = None  # Directory archivio (None = disabilitato, "auto" = accanto al report)
+    ARCHIVE_DEFAULT_DIR = "archivio_var"
+    ARCHIVE_PERIOD_FORMAT = "%Y-%m"  # Periodo predefinito: mese corrente
+    ARCHIVE_INDEX_NAME = "imei_index"
+    ARCHIVE_ROW_GROUP_SIZE = 16384  # Row group piccoli: lookup IMEI legge pochi blocchi
+    ARCHIVE_LOOKUP_COLUMNS = [
+        'IMEI', 'PERIODO', 'RUN', 'TIPO', 'Causale', 'FINANZIARIA',
+        'Numero Nota di Credito', 'Data Scarico', 'W-Importo Originale', 'Differenza'
+    ]
+    
+    # Confronto tra report (comando diff): snapshot Parquet dei report Excel già letti
+    DIFF_CACHE_DIR = None  # Directory snapshot (None = DIFF_CACHE_DEFAULT_DIR accanto al report)
+    DIFF_CACHE_DEFAULT_DIR = ".var_diff_cache"
+    DIFF_SHEET_NAMES = {'added': 'Aggiunti', 'removed': 'Rimossi', 'changed': 'Modificati'}
+    
+    # Registro note credito già riconciliate (Bloom filter + archivio esatto delle chiavi)
+    SEEN_NOTES_DIR = None  # Directory registro (None = disabilitato, "auto" = accanto ai file di input)
+    SEEN_NOTES_DEFAULT_DIR = "note_credito_viste"
+    SEEN_NOTES_POLICY = 'flag'  # 'flag' = segnala le righe ripetute, 'drop' = le esclude dal report
+    SEEN_NOTES_CAPACITY = 1000000  # Chiavi previste (il filtro raddoppia se superate)
+    SEEN_NOTES_ERROR_RATE = 0.001  # Falsi positivi del Bloom filter (verificati su disco)
+    
+    # Recupero near-match IMEI (scartati dal validatore o senza controparte)
+    ENABLE_NEAR_MATCH = True
+    NEAR_MATCH_UNMATCHED = True  # Cerca candidati anche per gli IMEI solo post vendita
+    NEAR_MATCH_MIN_CONFIDENCE = 0.3
+    NEAR_MATCH_HIGH_CONFIDENCE = 0.8  # Soglia dei candidati "affidabili" nel riepilogo
+    NEAR_MATCH_MAX_CANDIDATES = 5  # Candidati massimi per riga
+    NEAR_MATCH_SHEET_NAME = "Recupero IMEI"
+    
+    # Foglio anomalie: top N differenze assolute (totale, per dealer e per finanziaria)
+    # e dealer con più note credito non abbinate
+    ENABLE_ANOMALIES = True
+    ANOMALY_TOP_N = 10  # Righe per ambito/gruppo
+    ANOMALY_TOP_GROUPS = 10  # Dealer/finanziarie per ambito, per |Differenza| totale (None = tutti)
+    ANOMALY_SHEET_NAME = "Anomalie"
     
     # Output
     DEFAULT_OUTPUT_PREFIX = "VAR_Report"
     EXCEL_SHEET_NAME = "VAR Report"
     
+    # Formattazione Excel a livello di colonna/intervallo (costo indipendente dalle righe):
+    # 'table' = tabella Excel con filtri, formati valuta/data e formattazione condizionale
+    # Differenza (formati numerici con xlsxwriter installato), 'plain' = solo intestazioni
+    EXCEL_OUTPUT_MODE = 'table'
+    EXCEL_OUTPUT_MODES = ('table', 'plain')
+    EXCEL_TABLE_STYLE = 'TableStyleMedium2'
+    EXCEL_CURRENCY_FORMAT = '#,##0.00 "€";[Red]-#,##0.00 "€"'
+    EXCEL_DATETIME_FORMAT = 'dd/mm/yyyy hh:mm'
+    EXCEL_PERCENT_FORMAT = '0.0%'
+    EXCEL_PERCENT_COLUMNS = ['CONFIDENZA']
+    EXCEL_DIFFERENCE_COLUMN = 'Differenza'
+    EXCEL_NEGATIVE_COLORS = ('9C0006', 'FFC7CE')  # (testo, sfondo) Differenza < 0
+    EXCEL_POSITIVE_COLORS = ('006100', 'C6EFCE')  # (testo, sfondo) Differenza > 0
+    EXCEL_WIDTH_SAMPLE_ROWS = 1000  # Righe lette per la larghezza colonne
+    EXCEL_MIN_COLUMN_WIDTH = 10
+    EXCEL_MAX_COLUMN_WIDTH = 50
+    
+    # Report suddiviso per periodo di Data Scarico: un file per periodo (scritti in
+    # parallelo con --workers) in <report>_periodi/, il report diventa l'indice
+    REPORT_PARTITION = None  # None = report unico, 'month' o 'week' (settimana ISO)
+    REPORT_PARTITIONS = ('month', 'week')
+    REPORT_PARTITION_DIR_SUFFIX = "_periodi"
+    REPORT_PARTITION_UNDATED = "senza_data"  # Righe senza Data Scarico (solo TI)
+    REPORT_INDEX_SHEET_NAME = "Indice"
+    
     # Backup
     ENABLE_BACKUP = True
     BACKUP_DIR = "backup"
     MAX_BACKUPS = 5
     
+    @classmethod
+    def get_output_columns(cls) -> List[str]:
+        """Colonne di output (senza quelle del match su chiavi se disattivato)."""
+        if cls.ENABLE_KEY_MATCHING:
+            return list(cls.OUTPUT_COLUMNS)
+        return [col for col in cls.OUTPUT_COLUMNS if col not in cls.KEY_MATCHING_COLUMNS]
+    
     @classmethod
     def get_output_filename(cls, timestamp: str = None) -> str:
         """Genera nome file output con timestamp."""
@@ -122,28 +321,114 @@ class Config:
         return f"{cls.DEFAULT_OUTPUT_PREFIX}_{timestamp}.xlsx"
     
     @classmethod
-    def setup_logging(cls, log_level: int = None, log_file: str = None) -> logging.Logger:
-        """Configura logging centralizzato."""
+    def setup_logging(cls, log_level: int = None, log_file: str = None,
+                      json_output: bool = None, use_queue: bool = None) -> logging.Logger:
+        """
+        Configura logging centralizzato.
+        
+        In modalità coda i logger scrivono solo su una coda in memoria; un
+        thread listener in background gestisce file (con rotazione) e console,
+        così la pipeline non attende mai l'I/O dei log.
+        
+        Args:
+            log_level: Livello di logging (default LOG_LEVEL)
+            log_file: File di log (default LOG_FILE)
+            json_output: Output JSON strutturato (default LOG_JSON)
+            use_queue: Logging non bloccante via coda (default LOG_QUEUE)
+            
+        Returns:
+            Logger applicazione
+        """
         level = log_level or cls.LOG_LEVEL
         file = log_file or cls.LOG_FILE
+        json_output = cls.LOG_JSON if json_output is None else json_output
+        use_queue = cls.LOG_QUEUE if use_queue is None else use_queue
         
-        # Rimuove handler esistenti
+        # Rimuove handler esistenti (e ferma un eventuale listener precedente)
+        cls.shutdown_logging()
         root_logger = logging.getLogger()
         for handler in root_logger.handlers[:]:
             root_logger.removeHandler(handler)
+            handler.close()
+        
+        # Handler di output
+        formatter = cls._build_log_formatter(json_output)
+        output_handlers = [
+            logging.handlers.RotatingFileHandler(
+                file, maxBytes=cls.LOG_MAX_BYTES, backupCount=cls.LOG_BACKUP_COUNT, encoding='utf-8'
+            ),
+            logging.StreamHandler()
+        ]
+        for handler in output_handlers:
+            handler.setFormatter(formatter)
+        
+        if use_queue:
+            # Coda illimitata: put() non blocca mai il thread chiamante
+            log_queue = queue.SimpleQueue()
+            root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+            cls._log_listener = logging.handlers.QueueListener(
+                log_queue, *output_handlers, respect_handler_level=True
+            )
+            cls._log_listener.start()
+        else:
+            for handler in output_handlers:
+                root_logger.addHandler(handler)
         
-        # Configura nuovo logging
-        logging.basicConfig(
-            level=level,
-            format=cls.LOG_FORMAT,
-            handlers=[
-                logging.FileHandler(file, encoding='utf-8'),
-                logging.StreamHandler()
-            ]
-        )
+        root_logger.setLevel(level)
         
         # Riduce verbosità librerie esterne
         logging.getLogger('openpyxl').setLevel(logging.WARNING)
         logging.getLogger('pandas').setLevel(logging.WARNING)
         
         return logging.getLogger(cls.APP_NAME)
+    
+    @classmethod
+    def shutdown_logging(cls) -> None:
+        """Ferma il listener dei log svuotando la coda (chiamato anche all'uscita)."""
+        listener = cls._log_listener
+        if listener is not None:
+            cls._log_listener = None
+            listener.stop()
+            for handler in listener.handlers:
+                handler.close()
+    
+    @classmethod
+    def _build_log_formatter(cls, json_output: bool) -> logging.Formatter:
+        """Crea il formatter testo o JSON (structlog se disponibile)."""
+        if not json_output:
+            return logging.Formatter(cls.LOG_FORMAT)
+        
+        try:
+            import structlog
+            return structlog.stdlib.ProcessorFormatter(
+                processor=structlog.processors.JSONRenderer(ensure_ascii=False),
+                foreign_pre_chain=[
+                    structlog.stdlib.add_log_level,
+                    structlog.stdlib.add_logger_name,
+                    structlog.processors.TimeStamper(fmt='iso'),
+                    structlog.processors.format_exc_info
+                ]
+            )
+        except ImportError:
+            return _JsonLogFormatter()
+
+
+class _JsonLogFormatter(logging.Formatter):
+    """Formatter JSON minimale usato quando structlog non è installato."""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        import json
+        from datetime import datetime
+        
+        payload = {
+            'timestamp': datetime.fromtimestamp(record.created).isoformat(),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'event': record.getMessage()
+        }
+        if record.exc_info:
+            payload['exception'] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False)
+
+
+atexit.register(Config.shutdown_logging)
@@ -14,12 +14,18 @@ import argparse
 import logging
 from pathlib import Path
 from datetime import datetime
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
-# Import moduli locali
+# Import moduli locali (solo moduli leggeri: pandas e lo stack di
+# elaborazione sono importati solo quando serve, così --help e
+# --validate-only partono in pochi millisecondi)
 from config import Config
-from processors.var_processor import VARProcessor
-from utils.calculators import StatisticsCalculator
+from utils.profiler import StageProfiler
+from utils.memory import MemoryGovernor, MemoryBudgetExceeded
+from utils.preflight import discover_input_files, validate_input_headers
+
+if TYPE_CHECKING:
+    from processors.var_processor import VARProcessor
 
 def setup_environment():
     """Configura l'ambiente di esecuzione."""
@@ -47,6 +53,13 @@ Esempi di utilizzo:
   python main.py --output custom_report   # Nome output personalizzato
   python main.py --verbose                # Output dettagliato
   python main.py --quiet                  # Solo errori
+  python main.py --validate-only --deep   # Verifica colonne leggendo solo le intestazioni
+  python main.py --plan                   # Stima tempi, memoria e strategia senza elaborare
+  python main.py --profile                # Metriche tempo/memoria per fase
+  python main.py --metrics-file /var/lib/node_exporter/var.prom  # Metriche Prometheus
+  python main.py --archive --period 2025-03  # Accoda il run all'archivio storico
+  python main.py lookup 356938035643809     # Storico IMEI da tutti i run archiviati
+  python main.py diff VAR_Report_A.xlsx VAR_Report_B.xlsx  # IMEI aggiunti, rimossi, modificati
         """
     )
     
@@ -75,6 +88,12 @@ Esempi di utilizzo:
         help='Output minimo (solo errori)'
     )
     
+    parser.add_argument(
+        '--log-json',
+        action='store_true',
+        help='Log in formato JSON strutturato (structlog se installato)'
+    )
+    
     parser.add_argument(
         '--no-backup',
         action='store_true',
@@ -87,8 +106,318 @@ Esempi di utilizzo:
         help='Solo validazione file, nessuna elaborazione'
     )
     
+    parser.add_argument(
+        '--deep',
+        action='store_true',
+        help='Con --validate-only, verifica le colonne richieste leggendo solo le intestazioni'
+    )
+    
+    parser.add_argument(
+        '--plan',
+        action='store_true',
+        help='Stima tempi e memoria per fase e strategia consigliata (legge solo i metadati dei file)'
+    )
+    
+    parser.add_argument(
+        '--rules',
+        type=str,
+        metavar='PATH',
+        help='Tabella regole differenza YAML (default: difference_rules.yaml)'
+    )
+    
+    parser.add_argument(
+        '--memory-budget',
+        type=float,
+        metavar='MB',
+        help='Budget memoria in MB (default: 80%% della memoria disponibile)'
+    )
+    
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Riprende dall\'ultima fase completata di un run interrotto con gli stessi file di input'
+    )
+    
+    parser.add_argument(
+        '--workers',
+        type=int,
+        metavar='N',
+        help=f'Processi per il matching partizionato per IMEI (default: {Config.MATCHING_WORKERS}, '
+             f'attivo oltre {Config.PARALLEL_MATCHING_MIN_ROWS:,} righe) e per la scrittura dei report per periodo'
+    )
+    
+    parser.add_argument(
+        '--audit-file',
+        nargs='?',
+        const='auto',
+        metavar='PATH',
+        help='Audit colonnare dei calcoli differenza (.parquet/.csv, default accanto al report)'
+    )
+    
+    parser.add_argument(
+        '--quarantine-file',
+        nargs='?',
+        const='auto',
+        metavar='PATH',
+        help='File colonnare delle righe scartate con motivo (.parquet/.csv, default accanto al report)'
+    )
+    
+    parser.add_argument(
+        '--archive',
+        nargs='?',
+        const='auto',
+        metavar='DIR',
+        help=f'Accoda le righe riconciliate all\'archivio storico (default {Config.ARCHIVE_DEFAULT_DIR}/ accanto al report)'
+    )
+    
+    parser.add_argument(
+        '--period',
+        type=str,
+        metavar='YYYY-MM',
+        help='Periodo di competenza del run nell\'archivio e nel registro note credito (default: mese corrente)'
+    )
+    
+    parser.add_argument(
+        '--seen-notes',
+        nargs='?',
+        const='auto',
+        metavar='DIR',
+        help=f'Registro note credito già riconciliate nei run precedenti (default {Config.SEEN_NOTES_DEFAULT_DIR}/)'
+    )
+    
+    parser.add_argument(
+        '--drop-seen-notes',
+        action='store_true',
+        help='Con --seen-notes, esclude dal report le note già riconciliate (default: solo segnalazione)'
+    )
+    
+    parser.add_argument(
+        '--match-keys',
+        action='store_true',
+        help='Abbina su ID Vendita e numero nota credito i record senza match IMEI o con IMEI scartato '
+             '(colonne \'Chiave Match\' e \'IMEI TI\')'
+    )
+    
+    parser.add_argument(
+        '--top-n',
+        type=int,
+        default=Config.ANOMALY_TOP_N,
+        metavar='N',
+        help=f"Righe per ambito nel foglio '{Config.ANOMALY_SHEET_NAME}' "
+             f"(0 = nessun foglio, default: {Config.ANOMALY_TOP_N})"
+    )
+    
+    parser.add_argument(
+        '--excel-format',
+        choices=Config.EXCEL_OUTPUT_MODES,
+        default=Config.EXCEL_OUTPUT_MODE,
+        help='Formattazione report: tabella Excel con formati valuta/data e Differenza evidenziata, '
+             f'o solo intestazioni (default: {Config.EXCEL_OUTPUT_MODE})'
+    )
+    
+    parser.add_argument(
+        '--split-by',
+        choices=Config.REPORT_PARTITIONS,
+        default=Config.REPORT_PARTITION,
+        help=f'Un report per mese o settimana ISO di Data Scarico in <report>{Config.REPORT_PARTITION_DIR_SUFFIX}/, '
+             f"il report diventa l'indice con i collegamenti (default: report unico)"
+    )
+    
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Misura tempo, CPU, memoria e righe per ogni fase (salva metriche JSON)'
+    )
+    
+    parser.add_argument(
+        '--metrics-file',
+        type=str,
+        metavar='PATH',
+        help='Scrive metriche Prometheus (.prom, textfile collector) a fine esecuzione'
+    )
+    
+    parser.add_argument(
+        '--profile-memory',
+        action='store_true',
+        help='Con --profile, misura anche il picco tracemalloc (più lento)'
+    )
+    
     return parser.parse_args()
 
+def parse_lookup_arguments(argv):
+    """Parsing argomenti del comando lookup."""
+    parser = argparse.ArgumentParser(
+        prog='main.py lookup',
+        description='Storico IMEI da tutti i run dell\'archivio'
+    )
+    
+    parser.add_argument(
+        'imei',
+        nargs='+',
+        help='IMEI da cercare'
+    )
+    
+    parser.add_argument(
+        '--archive',
+        type=str,
+        default=Config.ARCHIVE_DIR or Config.ARCHIVE_DEFAULT_DIR,
+        metavar='DIR',
+        help=f'Directory archivio (default: {Config.ARCHIVE_DIR or Config.ARCHIVE_DEFAULT_DIR})'
+    )
+    
+    parser.add_argument(
+        '--output', '-o',
+        type=str,
+        metavar='PATH',
+        help='Salva tutte le colonne dei risultati (.csv o .xlsx)'
+    )
+    
+    return parser.parse_args(argv)
+
+def run_lookup(argv) -> int:
+    """
+    Comando lookup: storico di uno o più IMEI dall'archivio.
+    
+    Args:
+        argv: Argomenti dopo 'lookup'
+        
+    Returns:
+        Exit code (0 = trovato, 1 = nessun risultato o errore)
+    """
+    import time
+    
+    args = parse_lookup_arguments(argv)
+    logger = Config.setup_logging(log_level=logging.WARNING)
+    archive_dir = Path(args.archive)
+    
+    if not archive_dir.is_dir():
+        print(f"❌ Archivio non trovato: {archive_dir}")
+        return 1
+    
+    from utils.archive import ReportArchive
+    
+    try:
+        started = time.perf_counter()
+        result = ReportArchive(archive_dir).lookup(args.imei)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+    except Exception as e:
+        logger.error(f"Errore lookup archivio: {e}")
+        print(f"❌ ERRORE: {e}")
+        return 1
+    
+    if result.empty:
+        print(f"Nessun record in archivio per: {', '.join(args.imei)} ({elapsed_ms:.0f} ms)")
+        return 1
+    
+    summary_columns = [col for col in Config.ARCHIVE_LOOKUP_COLUMNS if col in result.columns]
+    print(result[summary_columns].to_string(index=False))
+    print(f"\n{len(result):,} record, {result['RUN'].nunique():,} run ({elapsed_ms:.0f} ms)")
+    
+    if args.output:
+        output_path = Path(args.output)
+        if output_path.suffix.lower() == '.xlsx':
+            result.to_excel(output_path, index=False)
+        else:
+            result.to_csv(output_path, index=False, encoding='utf-8')
+        print(f"📁 Risultati salvati: {output_path}")
+    
+    return 0
+
+def parse_diff_arguments(argv):
+    """Parsing argomenti del comando diff."""
+    parser = argparse.ArgumentParser(
+        prog='main.py diff',
+        description='IMEI aggiunti, rimossi e modificati tra due report'
+    )
+    
+    parser.add_argument(
+        'report_a',
+        help='Report di riferimento (.xlsx, .parquet o .csv)'
+    )
+    
+    parser.add_argument(
+        'report_b',
+        help='Report aggiornato (.xlsx, .parquet o .csv)'
+    )
+    
+    parser.add_argument(
+        '--key',
+        type=str,
+        default='IMEI',
+        help='Colonna chiave (default: IMEI)'
+    )
+    
+    parser.add_argument(
+        '--output', '-o',
+        type=str,
+        metavar='PATH',
+        help='Salva le differenze (.xlsx con un foglio per sezione, .parquet o .csv)'
+    )
+    
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Non usa né crea gli snapshot Parquet dei report Excel'
+    )
+    
+    return parser.parse_args(argv)
+
+def run_diff(argv) -> int:
+    """
+    Comando diff: confronto per IMEI tra due report.
+    
+    Args:
+        argv: Argomenti dopo 'diff'
+        
+    Returns:
+        Exit code (0 = report equivalenti, 1 = differenze, 2 = errore)
+    """
+    import time
+    
+    args = parse_diff_arguments(argv)
+    logger = Config.setup_logging(log_level=logging.WARNING)
+    
+    for report in (args.report_a, args.report_b):
+        if not Path(report).is_file():
+            print(f"❌ Report non trovato: {report}")
+            return 2
+    
+    from utils.report_diff import load_report, diff_reports, write_diff
+    
+    try:
+        started = time.perf_counter()
+        report_a = load_report(args.report_a, key=args.key, use_cache=not args.no_cache)
+        report_b = load_report(args.report_b, key=args.key, use_cache=not args.no_cache)
+        result = diff_reports(report_a, report_b, key=args.key)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+    except Exception as e:
+        logger.error(f"Errore confronto report: {e}")
+        print(f"❌ ERRORE: {e}")
+        return 2
+    
+    print(f"A: {args.report_a} ({len(report_a):,} righe)")
+    print(f"B: {args.report_b} ({len(report_b):,} righe)")
+    print(f"   • {args.key} aggiunti: {len(result['added']):,}")
+    print(f"   • {args.key} rimossi: {len(result['removed']):,}")
+    print(f"   • {args.key} modificati: {result['changed_keys']:,}")
+    if result['columns_added'] or result['columns_removed']:
+        print(f"   • Colonne aggiunte: {', '.join(result['columns_added']) or '-'}; "
+              f"rimosse: {', '.join(result['columns_removed']) or '-'}")
+    
+    if not result['changed'].empty:
+        by_column = result['changed'].groupby('Colonna', sort=False).size().sort_values(ascending=False)
+        print("\nModifiche per colonna:")
+        for column, count in by_column.items():
+            print(f"   • {column}: {count:,}")
+    print(f"\n({elapsed_ms:.0f} ms)")
+    
+    if args.output:
+        output_path = write_diff(result, args.output)
+        print(f"📁 Differenze salvate: {output_path}")
+    
+    differences = len(result['added']) + len(result['removed']) + result['changed_keys']
+    return 1 if differences else 0
+
 def configure_logging_level(args):
     """Configura il livello di logging in base agli argomenti."""
     if args.verbose:
@@ -99,15 +428,19 @@ def configure_logging_level(args):
         level = logging.INFO
     
     # Riconfigura logging con nuovo livello
-    return Config.setup_logging(log_level=level)
+    return Config.setup_logging(log_level=level, json_output=args.log_json or None)
 
-def validate_input_directory(input_dir: Path, logger) -> bool:
+def validate_input_directory(input_dir: Path, logger, deep: bool = False,
+                             rules_file: Optional[str] = None) -> bool:
     """
     Valida la directory di input.
     
     Args:
         input_dir: Path della directory
         logger: Logger per output
+        deep: Verifica anche le colonne richieste (solo riga di intestazione)
+              e la tabella regole differenza
+        rules_file: Tabella regole da verificare (None = Config.DIFFERENCE_RULES_FILE)
         
     Returns:
         True se la directory è valida
@@ -120,9 +453,10 @@ def validate_input_directory(input_dir: Path, logger) -> bool:
         logger.error(f"Il path non è una directory: {input_dir}")
         return False
     
-    # Verifica presenza file essenziali
-    post_vendita_found = any(input_dir.glob(pattern) for pattern in Config.POST_VENDITA_PATTERNS)
-    ti_found = list(input_dir.glob(Config.TI_PATTERN))
+    # Verifica presenza file essenziali (singolo listing della directory)
+    files = discover_input_files(input_dir)
+    post_vendita_found = bool(files['post_vendita'])
+    ti_found = files['ti']
     
     if not post_vendita_found:
         logger.error(f"File post_vendita_fisici non trovato in {input_dir}")
@@ -137,12 +471,59 @@ def validate_input_directory(input_dir: Path, logger) -> bool:
     logger.info(f"  • File TI: {len(ti_found)} trovati")
     
     # Verifica file data (opzionale)
-    data_found = any(input_dir.glob(pattern) for pattern in Config.DATA_PATTERNS)
-    if data_found:
+    if files['data']:
         logger.info(f"  • File dati finanziari: trovato")
     else:
         logger.warning(f"  • File dati finanziari: non trovato (opzionale)")
     
+    if deep:
+        return validate_input_columns(files, logger) and validate_difference_rules(rules_file, logger)
+    
+    return True
+
+def validate_input_columns(files: dict, logger) -> bool:
+    """
+    Verifica le colonne richieste leggendo in parallelo solo le intestazioni.
+    
+    Args:
+        files: File di input per sorgente (discover_input_files)
+        logger: Logger per output
+        
+    Returns:
+        True se tutti i file hanno le colonne richieste
+    """
+    valid = True
+    for result in validate_input_headers(files):
+        if result['error']:
+            logger.error(f"  • {result['file']}: intestazione non leggibile ({result['error']})")
+            valid = False
+        elif result['missing']:
+            logger.error(f"  • {result['file']}: colonne mancanti {result['missing']}")
+            valid = False
+        else:
+            logger.info(f"  • {result['file']}: colonne richieste presenti")
+    return valid
+
+def validate_difference_rules(rules_file: Optional[str], logger) -> bool:
+    """
+    Carica e valida la tabella regole differenza.
+    
+    Args:
+        rules_file: File YAML (None = Config.DIFFERENCE_RULES_FILE)
+        logger: Logger per output
+        
+    Returns:
+        True se la tabella è valida
+    """
+    from utils.rules import DifferenceRuleSet, RuleValidationError
+    
+    try:
+        rule_set = DifferenceRuleSet.load(rules_file)
+    except RuleValidationError as e:
+        logger.error(f"  • Regole differenza: {e}")
+        return False
+    
+    logger.info(f"  • Regole differenza: {len(rule_set.rules)} regole valide ({rule_set.source})")
     return True
 
 def create_backup(output_path: Path, logger) -> Optional[Path]:
@@ -196,6 +577,66 @@ def cleanup_old_backups(backup_dir: Path, file_prefix: str, logger):
     except Exception as e:
         logger.warning(f"Errore cleanup backup: {e}")
 
+def export_prometheus_metrics(metrics_file: str, success: bool, stats: Optional[dict],
+                              processor: Optional['VARProcessor'], logger) -> None:
+    """
+    Esporta le metriche dell'esecuzione per il textfile collector di node_exporter.
+    
+    Args:
+        metrics_file: Path del file .prom
+        success: Esito dell'elaborazione
+        stats: Riepilogo statistiche (None se elaborazione fallita)
+        processor: Processore VAR (None se non creato)
+        logger: Logger per output
+    """
+    try:
+        from utils.metrics import PrometheusTextfileExporter
+        
+        exporter = PrometheusTextfileExporter(metrics_file)
+        exporter.collect_run(
+            success=success,
+            stats=stats,
+            source_stats=processor.get_source_statistics() if processor else None,
+            profiler=processor.profiler if processor else None,
+            memory_governor=processor.memory_governor if processor else None
+        )
+        exporter.write()
+    except Exception as e:
+        logger.warning(f"Impossibile scrivere metriche Prometheus: {e}")
+
+def print_plan(plan: dict):
+    """Stampa il piano di esecuzione stimato (--plan)."""
+    labels = {'post_vendita': 'Post vendita', 'ti': 'Telefono incluso', 'data': 'Dati finanziari'}
+    
+    print("\n" + "="*60)
+    print("📐 PIANO DI ESECUZIONE (stima)")
+    print("="*60)
+    
+    print("\n📂 INPUT:")
+    for source, info in plan['inputs'].items():
+        rows = f"{plan['rows'][source]:,} righe"
+        if info['estimated_rows']:
+            rows += f" (di cui {info['estimated_rows']:,} stimate dalla dimensione)"
+        print(f"   • {labels[source]}: {info['files']} file, {info['bytes'] / (1024 * 1024):,.1f} MB, {rows}")
+    
+    print(f"\n⏱️  FASI (modello: {plan['model']}):")
+    for stage, estimate in plan['stages'].items():
+        print(f"   • {stage}: {estimate['seconds']:,.1f}s, RSS {estimate['rss_mb']:,.0f} MB "
+              f"({estimate['rows']:,} righe)")
+    print(f"   • Totale: {plan['total_seconds']:,.1f}s, picco {plan['peak_rss_mb']:,.0f} MB")
+    
+    print("\n🧭 STRATEGIA:")
+    print(f"   • {plan['strategy']}: {plan['reason']}")
+    if plan['budget_mb']:
+        print(f"   • Budget memoria: {plan['budget_mb']:,.0f} MB")
+    print(f"   • RAM consigliata per la VM: {plan['recommended_ram_mb'] / 1024:,.1f} GB")
+    if plan['recommended_workers']:
+        print(f"   • Matching parallelo consigliato: --workers {plan['recommended_workers']}")
+    if not plan['calibrated']:
+        print("   ⚠️  Modello non calibrato: eseguire benchmarks/run_benchmarks.py --calibrate")
+    
+    print("="*60)
+
 def print_summary(stats: dict, output_path: str, logger):
     """Stampa riepilogo finale."""
     print(f"\n{'=' * 60}")
@@ -224,11 +665,108 @@ def print_summary(stats: dict, output_path: str, logger):
                 print(f"   • {fin_type}: {data['count']} record, EUR {data['total_diff']:,.2f}")
         print(f"")
     
+    # Utilizzo regole differenza
+    if stats.get('rule_hits'):
+        print(f"📐 REGOLE DIFFERENZA:")
+        for rule_name, count in stats['rule_hits'].items():
+            print(f"   • {rule_name}: {count:,} record")
+        print(f"")
+    
+    # Record abbinati su chiavi secondarie (IMEI diverso tra le sorgenti)
+    if any((stats.get('key_matches') or {}).values()):
+        print(f"🔑 MATCH SU CHIAVI SECONDARIE (colonna 'Chiave Match'):")
+        for key_name, count in stats['key_matches'].items():
+            print(f"   • {key_name}: {count:,} record")
+        print(f"")
+    
+    # IMEI duplicati per sorgente
+    duplicates = {source: data for source, data in (stats.get('duplicates') or {}).items() if data['imei']}
+    if duplicates:
+        print(f"♻️  IMEI DUPLICATI:")
+        for source, data in duplicates.items():
+            print(f"   • {source}: {data['imei']:,} IMEI, {data['rows']:,} righe in eccesso "
+                  f"(policy '{data['policy']}')")
+        print(f"")
+    
+    # Qualità dati per file (solo file con problemi)
+    quality_issues = {}
+    for file_name, profile in (stats.get('data_quality') or {}).items():
+        issues = [f"{reason} {count:,}" for reason, count in profile['invalid_imei'].items()]
+        issues += [f"importi non numerici '{col}' {count:,}"
+                   for col, count in profile['non_numeric_amounts'].items() if count]
+        issues += [f"date fuori intervallo '{col}' {count:,}"
+                   for col, count in profile['dates_out_of_range'].items() if count]
+        issues += [f"'{col}' mancante {rate:.1%}"
+                   for col, rate in profile['null_rates'].items() if rate > Config.QUALITY_NULL_WARNING_RATE]
+        if issues:
+            quality_issues[file_name] = issues
+    if quality_issues:
+        print(f"🧪 QUALITÀ DATI:")
+        for file_name, issues in quality_issues.items():
+            print(f"   • {file_name}: {', '.join(issues)}")
+        print(f"")
+    
+    # Top N differenze e dealer non abbinati
+    anomalies = stats.get('anomalies')
+    if anomalies and anomalies['rows']:
+        print(f"🚨 ANOMALIE (foglio '{Config.ANOMALY_SHEET_NAME}', top {Config.ANOMALY_TOP_N} per ambito):")
+        for scope, rows in anomalies['scopes'].items():
+            print(f"   • {scope}: {rows:,} righe")
+        print(f"")
+    
+    # Candidati near-match per IMEI scartati o non abbinati
+    near_matches = stats.get('near_matches')
+    if near_matches and near_matches['candidates']:
+        print(f"🧩 RECUPERO IMEI (foglio '{Config.NEAR_MATCH_SHEET_NAME}'):")
+        print(f"   • Righe con candidati: {near_matches['rows']:,}")
+        print(f"   • Candidati: {near_matches['candidates']:,} "
+              f"({near_matches['high_confidence']:,} con confidenza >= {Config.NEAR_MATCH_HIGH_CONFIDENCE:.0%})")
+        print(f"")
+    
+    # Note credito già riconciliate in run precedenti
+    seen_notes = stats.get('seen_notes')
+    if seen_notes and seen_notes['repeated_rows']:
+        action = 'escluse' if seen_notes['policy'] == 'drop' else 'segnalate'
+        print(f"🔁 NOTE CREDITO GIÀ RICONCILIATE ({action}):")
+        print(f"   • Stesso IMEI: {seen_notes['repeated_pairs']:,} righe")
+        print(f"   • Altro IMEI: {seen_notes['repeated_notes']:,} righe")
+        print(f"")
+    
+    # Metriche fasi se profiling attivo
+    if 'stage_metrics' in stats:
+        print(f"⏱️  FASI:")
+        for stage in stats['stage_metrics']:
+            rows = f"{stage['rows']:,} righe" if stage['rows'] is not None else "-"
+            peak = f"{stage['peak_rss_mb']:,.0f} MB" if stage['peak_rss_mb'] is not None else "n/d"
+            print(f"   • {stage['name']}: {stage['wall_seconds']:.2f}s "
+                  f"(CPU {stage['cpu_seconds']:.2f}s), {rows}, picco RSS {peak}")
+        if 'metrics_file' in stats:
+            print(f"   • Metriche: {stats['metrics_file']}")
+        print(f"")
+    
+    if 'partition_dir' in stats:
+        print(f"🗂️  Report per periodo: {stats['partition_files']:,} file in {stats['partition_dir']}")
+    if 'audit_file' in stats:
+        print(f"🔎 Audit calcoli: {stats['audit_file']}")
+    if 'quarantine_file' in stats:
+        print(f"🚧 Righe scartate: {stats['quarantine_file']} ({stats['quarantine_rows']:,} righe)")
+    if 'archive_dir' in stats:
+        print(f"🗄️  Archivio storico: {stats['archive_dir']} (periodo {stats['archive_period']})")
     print(f"📝 Log dettagli: var_processor.log")
     print(f"{'=' * 60}")
 
 def main():
     """Funzione principale."""
+    # Comandi dedicati (python main.py lookup IMEI ...)
+    if len(sys.argv) > 1 and sys.argv[1] == 'lookup':
+        return run_lookup(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == 'diff':
+        return run_diff(sys.argv[2:])
+    
+    metrics_file = None
+    processor = None
+    success = False
+    
     try:
         # Setup iniziale
         logger = setup_environment()
@@ -236,16 +774,36 @@ def main():
         
         # Configura logging finale
         logger = configure_logging_level(args)
+        # --plan e --validate-only non elaborano dati: nessuna metrica del run (né last_run_success)
+        if not (args.plan or args.validate_only):
+            metrics_file = args.metrics_file or Config.PROMETHEUS_TEXTFILE
+        
+        # Profiler fasi (no-op se disabilitato, sempre attivo con metriche Prometheus)
+        profiler = StageProfiler(
+            enabled=args.profile or Config.ENABLE_PROFILING or bool(metrics_file),
+            trace_memory=args.profile_memory or Config.PROFILE_TRACEMALLOC
+        )
         
         # Valida input
         input_dir = Path(args.input).resolve()
-        if not validate_input_directory(input_dir, logger):
-            return 1
+        with profiler.stage('validate_input'):
+            if not validate_input_directory(input_dir, logger, deep=args.validate_only and args.deep,
+                                            rules_file=args.rules):
+                return 1
+        
+        # Solo stima del piano di esecuzione
+        if args.plan:
+            from utils.planner import build_plan
+            print_plan(build_plan(input_dir, budget_mb=args.memory_budget))
+            return 0
         
         # Solo validazione se richiesto
         if args.validate_only:
             logger.info("Validazione completata con successo")
-            print("✅ Validazione completata - tutti i file necessari sono presenti")
+            if args.deep:
+                print("✅ Validazione completata - file presenti e colonne richieste verificate")
+            else:
+                print("✅ Validazione completata - tutti i file necessari sono presenti")
             return 0
         
         # Determina output filename
@@ -254,34 +812,79 @@ def main():
         
         # Backup se necessario
         if Config.ENABLE_BACKUP and not args.no_backup:
-            create_backup(output_path, logger)
+            with profiler.stage('backup'):
+                create_backup(output_path, logger)
+        
+        if args.drop_seen_notes:
+            Config.SEEN_NOTES_POLICY = 'drop'
+        Config.ENABLE_KEY_MATCHING = Config.ENABLE_KEY_MATCHING or args.match_keys
+        Config.EXCEL_OUTPUT_MODE = args.excel_format
+        Config.REPORT_PARTITION = args.split_by
+        Config.ANOMALY_TOP_N = args.top_n
+        Config.ENABLE_ANOMALIES = Config.ENABLE_ANOMALIES and args.top_n > 0
         
         # Elaborazione principale
         logger.info("Inizio elaborazione VAR workflow...")
         
-        processor = VARProcessor(str(input_dir))
+        from processors.var_processor import VARProcessor
+        
+        governor = MemoryGovernor(budget_mb=args.memory_budget)
+        processor = VARProcessor(str(input_dir), profiler=profiler, memory_governor=governor,
+                                 audit_file=args.audit_file, rules_file=args.rules,
+                                 archive_dir=args.archive, archive_period=args.period,
+                                 seen_notes_dir=args.seen_notes, matching_workers=args.workers,
+                                 resume=args.resume, quarantine_file=args.quarantine_file)
         result_path = processor.run(output_filename)
         
-        # Calcola statistiche avanzate
-        output_records = processor.get_output_records()
-        stats = StatisticsCalculator.calculate_summary(output_records)
-        stats['financial_breakdown'] = StatisticsCalculator.calculate_financial_breakdown(output_records)
-        stats['causale_breakdown'] = StatisticsCalculator.calculate_causale_breakdown(output_records)
+        # Statistiche avanzate (accumulate in singolo passaggio durante il matching)
+        stats = processor.get_summary_statistics()
+        
+        if processor.audit_path:
+            stats['audit_file'] = str(processor.audit_path)
+        if processor.quarantine_path:
+            stats['quarantine_file'] = str(processor.quarantine_path)
+            stats['quarantine_rows'] = processor.quarantine_rows
+        if processor.partition_dir:
+            stats['partition_dir'] = str(processor.partition_dir)
+            stats['partition_files'] = processor.partition_files
+        if processor.archive_path:
+            stats['archive_dir'] = str(processor.archive_path)
+            stats['archive_period'] = processor.archive_period
+        
+        # Metriche fasi accanto al report
+        if metrics_file:
+            export_prometheus_metrics(metrics_file, True, stats, processor, logger)
+        
+        if args.profile or Config.ENABLE_PROFILING:
+            metrics_path = profiler.write_json(StageProfiler.metrics_path_for(result_path))
+            stats['stage_metrics'] = profiler.to_dict()['stages']
+            stats['metrics_file'] = str(metrics_path)
+        profiler.stop()
         
         # Riepilogo finale
         print_summary(stats, result_path, logger)
         
         logger.info("Elaborazione completata con successo")
+        success = True
         return 0
         
     except KeyboardInterrupt:
         print("\n❌ Elaborazione interrotta dall'utente")
         return 1
+    except MemoryBudgetExceeded as e:
+        logger.error(f"Memoria insufficiente: {e}")
+        print(f"\n❌ MEMORIA INSUFFICIENTE: {e}")
+        print("📝 Controlla var_processor.log per le decisioni del governor memoria")
+        return 1
     except Exception as e:
         logger.error(f"Errore critico: {e}")
         print(f"\n❌ ERRORE: {e}")
         print("📝 Controlla var_processor.log per dettagli completi")
         return 1
+    finally:
+        # Metriche anche in caso di errore (last_run_success = 0)
+        if metrics_file and not success:
+            export_prometheus_metrics(metrics_file, False, None, processor, logger)
 
 if __name__ == "__main__":
     sys.exit(main())
@@ -11,27 +11,39 @@ from tqdm import tqdm
 
 from config import Config
 from utils.validators import IMEIValidator, DataFrameValidator, BusinessValidator
+from utils.memory import MemoryBudgetExceeded
+from utils.excel_reader import load_excel
+from utils.categorical import encode_categorical
+from utils.data_quality import profile_source
+from utils.calculators import CurrencyFormatter
+from utils.duplicates import resolve_duplicates
 
 logger = logging.getLogger(__name__)
 
 class DataFileProcessor:
     """Processore dedicato per il file data.xlsx."""
     
-    def __init__(self, file_path: Path):
+    def __init__(self, file_path: Path, memory_governor=None):
         """
         Inizializza il processore.
         
         Args:
             file_path: Path del file data.xlsx
+            memory_governor: Governor budget memoria (opzionale)
         """
         self.file_path = file_path
+        self.memory_governor = memory_governor
         self.data_map = {}
         self.stats = {}
+        self.rejected_rows = None  # Righe scartate con motivo (quarantena)
         
-    def load_and_process(self) -> Dict[str, Dict]:
+    def load_and_process(self, df: Optional[pd.DataFrame] = None) -> Dict[str, Dict]:
         """
         Carica e processa il file data.xlsx.
         
+        Args:
+            df: Righe già lette al posto del file (opzionale)
+            
         Returns:
             Dict mappato per IMEI con dati finanziari
             
@@ -42,7 +54,8 @@ class DataFileProcessor:
         
         try:
             # Carica DataFrame
-            df = self._load_dataframe()
+            if df is None:
+                df = self._load_dataframe()
             if df.empty:
                 logger.warning("File data.xlsx vuoto - continuando senza dati finanziari")
                 return {}
@@ -59,6 +72,8 @@ class DataFileProcessor:
             logger.info(f"Dati finanziari processati: {len(self.data_map)} IMEI")
             return self.data_map
             
+        except MemoryBudgetExceeded:
+            raise
         except Exception as e:
             logger.error(f"Errore elaborazione data.xlsx: {e}")
             logger.info("Continuando senza dati finanziari...")
@@ -67,7 +82,7 @@ class DataFileProcessor:
     def _load_dataframe(self) -> pd.DataFrame:
         """Carica il DataFrame dal file."""
         try:
-            df = pd.read_excel(self.file_path)
+            df = load_excel(self.file_path, self.memory_governor)
             logger.info(f"Caricati {len(df)} record da {self.file_path.name}")
             
             if logger.isEnabledFor(logging.DEBUG):
@@ -77,6 +92,8 @@ class DataFileProcessor:
             
             return df
             
+        except MemoryBudgetExceeded:
+            raise
         except Exception as e:
             raise Exception(f"Impossibile leggere {self.file_path}: {e}")
     
@@ -98,20 +115,24 @@ class DataFileProcessor:
         """Processa i record del DataFrame."""
         logger.info("Elaborazione record dati finanziari...")
         
+        # Valida IMEI in blocco e risolve i duplicati prima di costruire il mapping
+        imei_clean, imei_stats = IMEIValidator.validate_batch(df[Config.DATA_COLUMN_MAPPING['imei']])
+        
+        # Profilo qualità sul file come letto, poi conversioni solo sulle righe valide
+        self.stats['quality'], self.rejected_rows = profile_source(
+            df, 'data', self.file_path.name, Config.DATA_COLUMN_MAPPING['imei'], imei_clean,
+            Config.DATA_COLUMN_MAPPING['id_pratica'])
+        valid_df = df.assign(IMEI_CLEAN=imei_clean)[imei_clean.notna()]
+        encode_categorical(valid_df, Config.CATEGORICAL_COLUMNS['data'])
+        CurrencyFormatter.convert_columns_to_cents(valid_df, Config.AMOUNT_COLUMNS['data'])
+        valid_df, duplicate_stats = resolve_duplicates(valid_df, 'IMEI_CLEAN', 'data')
+        
         # Progress bar per file grandi
-        iterator = tqdm(df.iterrows(), total=len(df), desc="Elaborazione data.xlsx") if len(df) > 100 else df.iterrows()
+        iterator = tqdm(valid_df.iterrows(), total=len(valid_df), desc="Elaborazione data.xlsx") if len(valid_df) > 100 else valid_df.iterrows()
         
-        processed_count = 0
         validation_warnings = []
         
         for _, row in iterator:
-            # Valida IMEI
-            imei_raw = row.get(Config.DATA_COLUMN_MAPPING['imei'])
-            imei_clean = IMEIValidator.validate(imei_raw)
-            
-            if not imei_clean:
-                continue
-            
             # Estrae dati usando mapping configurazione
             record_data = self._extract_record_data(row)
             
@@ -121,8 +142,7 @@ class DataFileProcessor:
                 validation_warnings.extend(warnings)
             
             # Aggiunge al mapping
-            self.data_map[imei_clean] = record_data
-            processed_count += 1
+            self.data_map[row['IMEI_CLEAN']] = record_data
         
         # Log warning se presenti
         if validation_warnings:
@@ -130,9 +150,10 @@ class DataFileProcessor:
             for warning in validation_warnings[:5]:  # Mostra solo le prime 5
                 logger.warning(f"  {warning}")
         
-        self.stats['processed_records'] = processed_count
+        self.stats['processed_records'] = int(imei_stats['valid'])
         self.stats['total_records'] = len(df)
         self.stats['validation_warnings'] = len(validation_warnings)
+        self.stats['duplicates'] = duplicate_stats
     
     def _extract_record_data(self, row: pd.Series) -> Dict:
         """
@@ -142,11 +163,11 @@ class DataFileProcessor:
             row: Riga pandas Series
             
         Returns:
-            Dict con dati estratti e normalizzati
+            Dict con dati estratti e normalizzati (importo in centesimi)
         """
         return {
             'finanziaria': str(row.get(Config.DATA_COLUMN_MAPPING['finanziaria'], '')).strip(),
-            'importo_finanziato_wind': self._safe_float(row.get(Config.DATA_COLUMN_MAPPING['importo_finanziato'], 0)),
+            'importo_finanziato_wind': int(row.get(Config.DATA_COLUMN_MAPPING['importo_finanziato'], 0)),
             'id_pratica': str(row.get(Config.DATA_COLUMN_MAPPING['id_pratica'], '')).strip(),
             'tipo_finanz': str(row.get(Config.DATA_COLUMN_MAPPING['tipo_finanz'], '')).strip(),
             'n_ldc_findomestic': self._safe_float_or_string(row.get(Config.DATA_COLUMN_MAPPING['n_ldc_findomestic'], '')),
@@ -154,15 +175,6 @@ class DataFileProcessor:
             'codice': self._safe_int_or_string(row.get(Config.DATA_COLUMN_MAPPING['codice'], ''))
         }
     
-    def _safe_float(self, value) -> float:
-        """Conversione sicura a float."""
-        if pd.isna(value) or value == '':
-            return 0.0
-        try:
-            return float(value)
-        except (ValueError, TypeError):
-            return 0.0
-    
     def _safe_float_or_string(self, value) -> str:
         """Conversione sicura a float o stringa se numerico."""
         if pd.isna(value) or value == '':
@@ -188,8 +200,6 @@ class DataFileProcessor:
     
     def _validate_results(self) -> None:
         """Valida i risultati finali."""
-        BusinessValidator.validate_imei_uniqueness(self.data_map, "data.xlsx")
-        
         if self.data_map:
             # Statistiche per tipo finanziaria
             finanziarie = {}
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Matching partizionato per hash IMEI su più processi per VAR Processor
+"""
+
+import logging
+import multiprocessing
+from functools import partial
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import Config
+from processors.var_processor import VARProcessor
+from utils.shared_frames import SharedFrame, create_shared_directory, remove_shared_directory
+
+logger = logging.getLogger(__name__)
+
+ORDINAL_COLUMN = '_ORD'
+RULE_COLUMN = '_RULE'
+
+# Partizioni ereditate dai worker con start method 'fork' (nessuna serializzazione in ingresso)
+_FORK_TASKS: List[Tuple] = []
+
+
+def partition_codes(imeis, partitions: int) -> np.ndarray:
+    """
+    Assegna ogni IMEI a una partizione con hash vettoriale.
+    
+    Lo stesso IMEI finisce nella stessa partizione in tutte le sorgenti.
+    
+    Args:
+        imeis: IMEI (Series, array o lista)
+        partitions: Numero di partizioni
+        
+    Returns:
+        Array con il numero di partizione per IMEI
+    """
+    hashes = pd.util.hash_array(np.asarray(imeis, dtype=object), categorize=False)
+    return (hashes % np.uint64(partitions)).astype(np.intp)
+
+
+def build_partitions(post_vendita_df: pd.DataFrame, ti_df: pd.DataFrame,
+                     data_map: Dict, partitions: int) -> List[Tuple]:
+    """
+    Suddivide le tre sorgenti per hash IMEI.
+    
+    Ogni riga riceve l'ordinale del suo record nel matching seriale: ordine
+    di prima apparizione dell'IMEI nei post vendita, poi nei TI.
+    
+    Args:
+        post_vendita_df: Dati post vendita
+        ti_df: Dati TI
+        data_map: Mapping IMEI -> dati finanziari
+        partitions: Numero di partizioni
+        
+    Returns:
+        Lista di tuple (post vendita, TI, dati finanziari) per partizione
+    """
+    pv_ordinals = pd.factorize(post_vendita_df['IMEI_CLEAN'])[0]
+    pv_unique = int(pv_ordinals.max()) + 1 if len(pv_ordinals) else 0
+    post_vendita_df = post_vendita_df.assign(**{ORDINAL_COLUMN: pv_ordinals})
+    ti_df = ti_df.assign(**{ORDINAL_COLUMN: pd.factorize(ti_df['IMEI_CLEAN'])[0] + pv_unique})
+    
+    pv_codes = partition_codes(post_vendita_df['IMEI_CLEAN'], partitions)
+    ti_codes = partition_codes(ti_df['IMEI_CLEAN'], partitions)
+    data_keys = np.asarray(list(data_map), dtype=object)
+    data_codes = partition_codes(data_keys, partitions)
+    
+    tasks = []
+    for partition in range(partitions):
+        tasks.append((
+            post_vendita_df[pv_codes == partition],
+            ti_df[ti_codes == partition],
+            {imei: data_map[imei] for imei in data_keys[data_codes == partition]}
+        ))
+    return tasks
+
+
+def match_partition(task: Tuple, rules, directory: Optional[Path] = None) -> Tuple[object, Dict[str, int]]:
+    """
+    Matching e differenze di una partizione (eseguito nel processo worker).
+    
+    Args:
+        task: Tupla (post vendita, TI, dati finanziari) della partizione
+        rules: Tabella regole differenza
+        directory: Directory di scambio zero-copy (None = risultato serializzato)
+        
+    Returns:
+        Tuple con (DataFrame o SharedFrame con colonne _ORD e _RULE, conteggi per tipo)
+    """
+    post_vendita_df, ti_df, data_map = task
+    post_vendita_map = VARProcessor._create_post_vendita_mapping(post_vendita_df)
+    ti_map = VARProcessor._create_ti_mapping(ti_df)
+    records, counts = VARProcessor._build_match_records(post_vendita_map, ti_map, data_map)
+    
+    frame = pd.DataFrame(records)
+    if frame.empty:
+        return frame, counts
+    
+    # Ordinali nello stesso ordine dei record: IMEI post vendita, poi solo TI
+    ti_imeis = pd.unique(ti_df['IMEI_CLEAN'].to_numpy())
+    ti_ordinals = pd.unique(ti_df[ORDINAL_COLUMN].to_numpy())
+    ti_only = ~pd.Index(ti_imeis).isin(pd.Index(list(post_vendita_map)))
+    frame[ORDINAL_COLUMN] = np.concatenate([
+        pd.unique(post_vendita_df[ORDINAL_COLUMN].to_numpy()), ti_ordinals[ti_only]
+    ])
+    
+    differences, rule_index = rules.evaluate(frame)
+    frame['Differenza'] = differences
+    frame[RULE_COLUMN] = rule_index
+    
+    # Il processo principale riceve solo il riferimento al file Arrow
+    return SharedFrame.publish(frame, directory, 'partizione'), counts
+
+
+def _match_inherited_partition(partition: int, rules,
+                               directory: Optional[Path] = None) -> Tuple[object, Dict[str, int]]:
+    """Worker 'fork': legge la partizione ereditata dal processo principale."""
+    return match_partition(_FORK_TASKS[partition], rules, directory)
+
+
+def pool_context():
+    """Contesto multiprocessing (Config.MATCHING_START_METHOD, default 'fork' dove disponibile)."""
+    method = Config.MATCHING_START_METHOD
+    if method is None:
+        method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+
+def run_partitioned_matching(post_vendita_df: pd.DataFrame, ti_df: pd.DataFrame, data_map: Dict,
+                             rules, workers: int) -> Tuple[pd.DataFrame, Dict[str, int]]:
+    """
+    Esegue matching e differenze su partizioni per hash IMEI in parallelo.
+    
+    Args:
+        post_vendita_df: Dati post vendita
+        ti_df: Dati TI
+        data_map: Mapping IMEI -> dati finanziari
+        rules: Tabella regole differenza
+        workers: Processi worker (= partizioni)
+        
+    Returns:
+        Tuple con (DataFrame in ordine di partizione con colonne _ORD e _RULE,
+        conteggi per tipo). L'ordine seriale si ottiene ordinando per _ORD
+    """
+    global _FORK_TASKS
+    
+    tasks = build_partitions(post_vendita_df, ti_df, data_map, workers)
+    context = pool_context()
+    directory = create_shared_directory()
+    logger.info(f"Matching parallelo: {workers} partizioni per hash IMEI "
+                f"(start method '{context.get_start_method()}', "
+                f"risultati {'zero-copy in ' + str(directory) if directory else 'serializzati'})")
+    
+    # Con 'fork' i worker ereditano le partizioni: si passa solo il numero di partizione
+    if context.get_start_method() == 'fork':
+        _FORK_TASKS = tasks
+        worker, arguments = partial(_match_inherited_partition, rules=rules, directory=directory), range(len(tasks))
+    else:
+        worker, arguments = partial(match_partition, rules=rules, directory=directory), tasks
+    
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            results = list(executor.map(worker, arguments))
+        
+        counts = {'matched': 0, 'pv_only': 0, 'ti_only': 0}
+        for _, partial_counts in results:
+            for key, value in partial_counts.items():
+                counts[key] += value
+        
+        frames = [frame for frame, _ in results if len(frame)]
+        if not frames:
+            return pd.DataFrame(columns=[ORDINAL_COLUMN, RULE_COLUMN]), counts
+        return SharedFrame.combine(frames), counts
+    finally:
+        _FORK_TASKS = []
+        remove_shared_directory(directory)
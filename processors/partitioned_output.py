@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Report suddiviso per periodo di Data Scarico (un file per mese o settimana) per VAR Processor
+"""
+
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import Config
+from processors.parallel_matching import pool_context
+from utils.excel_writer import write_excel_report
+
+logger = logging.getLogger(__name__)
+
+INDEX_COLUMNS = ['PERIODO', 'FILE', 'APRI', 'RIGHE', 'MATCHED', 'POST_VENDITA_ONLY', 'TI_ONLY', 'Differenza']
+
+# Partizioni ereditate dai worker con start method 'fork' (nessuna serializzazione in ingresso)
+_FORK_TASKS: List[Tuple] = []
+
+
+def period_labels(dates: pd.Series, period: str) -> Tuple[np.ndarray, List[str]]:
+    """
+    Assegna ogni riga al proprio periodo di Data Scarico.
+    
+    Args:
+        dates: Date di scarico (datetime, NaT se mancanti)
+        period: 'month' (YYYY-MM) o 'week' (settimana ISO, YYYY-Www)
+        
+    Returns:
+        Tuple con (codice periodo per riga, etichette in ordine cronologico;
+        le righe senza data hanno l'ultima etichetta, Config.REPORT_PARTITION_UNDATED)
+        
+    Raises:
+        ValueError: Se il periodo non è valido
+    """
+    if period not in Config.REPORT_PARTITIONS:
+        raise ValueError(f"Periodo '{period}' non valido (valori: {', '.join(Config.REPORT_PARTITIONS)})")
+    
+    periods = pd.to_datetime(dates, errors='coerce').dt.to_period('M' if period == 'month' else 'W')
+    codes, uniques = pd.factorize(periods, sort=True)
+    if period == 'month':
+        labels = [str(value) for value in uniques]
+    else:
+        labels = ["{0}-W{1:02d}".format(*value.start_time.isocalendar()[:2]) for value in uniques]
+    
+    # Codice -1 (data mancante) in coda
+    if (codes < 0).any():
+        codes = np.where(codes < 0, len(labels), codes)
+        labels.append(Config.REPORT_PARTITION_UNDATED)
+    return codes, labels
+
+
+def partition_dir_for(output_path) -> Path:
+    """Restituisce la cartella dei report per periodo associata a un report."""
+    output_path = Path(output_path)
+    return output_path.with_name(f"{output_path.stem}{Config.REPORT_PARTITION_DIR_SUFFIX}")
+
+
+def write_partition(task: Tuple[Path, pd.DataFrame, str]) -> Path:
+    """Scrive il report di un periodo (eseguito nei worker)."""
+    path, frame, mode = task
+    write_excel_report(path, {Config.EXCEL_SHEET_NAME: frame}, mode)
+    return path
+
+
+def _write_inherited_partition(partition: int) -> Path:
+    """Worker 'fork': scrive la partizione ereditata dal processo principale."""
+    return write_partition(_FORK_TASKS[partition])
+
+
+def write_partitioned_reports(df_output: pd.DataFrame, output_path, period: str,
+                              record_types: Optional[pd.Series] = None,
+                              extra_sheets: Optional[Dict[str, pd.DataFrame]] = None,
+                              workers: int = 1) -> Tuple[Path, int]:
+    """
+    Scrive un report per periodo di Data Scarico e un indice con i collegamenti.
+    
+    Le righe di ogni periodo sono un taglio del report (ordinamento stabile
+    sui codici periodo, ordine delle righe invariato). Con più worker i
+    periodi sono scritti in processi separati. Il file indice prende il
+    posto del report unico: un foglio Config.REPORT_INDEX_SHEET_NAME con
+    righe, conteggi per tipo e Differenza per periodo, più i fogli extra.
+    
+    Args:
+        df_output: Report (colonne di output, importi in euro)
+        output_path: Path del file indice
+        period: 'month' o 'week'
+        record_types: Tipo record per riga (MATCHED, POST_VENDITA_ONLY, TI_ONLY)
+        extra_sheets: Fogli aggiunti all'indice (es. anomalie)
+        workers: Processi per la scrittura dei periodi
+        
+    Returns:
+        Tuple con (cartella dei report per periodo, file scritti)
+    """
+    global _FORK_TASKS
+    
+    output_path = Path(output_path)
+    directory = partition_dir_for(output_path)
+    directory.mkdir(parents=True, exist_ok=True)
+    mode = Config.EXCEL_OUTPUT_MODE
+    
+    codes, labels = period_labels(df_output['Data Scarico'], period)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(labels) + 1))
+    paths = [directory / f"{output_path.stem}_{label}.xlsx" for label in labels]
+    tasks = [(path, df_output.iloc[order[bounds[code]:bounds[code + 1]]], mode)
+             for code, path in enumerate(paths)]
+    
+    workers = min(workers, len(tasks))
+    if workers > 1:
+        context = pool_context()
+        logger.info(f"Report per periodo: {len(tasks)} file con {workers} processi "
+                    f"(start method '{context.get_start_method()}')")
+        # Con 'fork' i worker ereditano le partizioni: si passa solo il numero di partizione
+        if context.get_start_method() == 'fork':
+            _FORK_TASKS = tasks
+            worker, arguments = _write_inherited_partition, range(len(tasks))
+        else:
+            worker, arguments = write_partition, tasks
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                list(executor.map(worker, arguments))
+        finally:
+            _FORK_TASKS = []
+    else:
+        logger.info(f"Report per periodo: {len(tasks)} file")
+        for task in tasks:
+            write_partition(task)
+    
+    index = _partition_index(df_output, codes, labels, paths, output_path.parent, record_types)
+    write_excel_report(output_path, {Config.REPORT_INDEX_SHEET_NAME: index, **(extra_sheets or {})}, mode)
+    logger.info(f"Indice report per periodo: {output_path} ({len(paths)} file in {directory})")
+    return directory, len(paths)
+
+
+def _partition_index(df_output: pd.DataFrame, codes: np.ndarray, labels: List[str], paths: List[Path],
+                     base_dir: Path, record_types: Optional[pd.Series]) -> pd.DataFrame:
+    """Righe dell'indice: una per periodo con collegamento relativo al file."""
+    files = [path.relative_to(base_dir).as_posix() for path in paths]
+    index = pd.DataFrame({
+        'PERIODO': labels,
+        'FILE': files,
+        'APRI': [f'=HYPERLINK("{file}","Apri")' for file in files],
+        'RIGHE': np.bincount(codes, minlength=len(labels))
+    })
+    
+    # Conteggi per tipo in un solo groupby sui codici periodo
+    if record_types is not None:
+        counts = (pd.DataFrame({'code': codes, 'tipo': np.asarray(record_types.astype(str))})
+                  .groupby(['code', 'tipo']).size().unstack(fill_value=0)
+                  .reindex(index=range(len(labels)), fill_value=0))
+        for tipo in ('MATCHED', 'POST_VENDITA_ONLY', 'TI_ONLY'):
+            index[tipo] = counts[tipo].to_numpy() if tipo in counts.columns else 0
+    if 'Differenza' in df_output.columns:
+        differences = pd.to_numeric(df_output['Differenza'], errors='coerce').fillna(0).to_numpy()
+        index['Differenza'] = np.round(np.bincount(codes, weights=differences, minlength=len(labels)), 2)
+    return index.reindex(columns=[col for col in INDEX_COLUMNS if col in index.columns])
@@ -3,36 +3,108 @@
 VAR Processor principale - Production Version
 """
 
+import numpy as np
 import pandas as pd
 import logging
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from tqdm import tqdm
 
 from config import Config
 from processors.data_processor import DataFileProcessor
 from utils.validators import IMEIValidator, DataFrameValidator, FileValidator
-from utils.calculators import DifferenceCalculator, CurrencyFormatter
+from utils.calculators import CurrencyFormatter, StatisticsAccumulator
+from utils.profiler import StageProfiler
+from utils.memory import MemoryGovernor, MemoryBudgetExceeded, SpilledFrame
+from utils.excel_reader import load_excel
+from utils.excel_writer import write_excel_report
+from utils.audit import CalculationAuditWriter
+from utils.preflight import discover_input_files
+from utils.categorical import encode_categorical, concat_categorical
+from utils.duplicates import resolve_duplicates
+from utils.archive import ReportArchive
+from utils.checkpoints import StageCheckpoint
+from utils.seen_notes import CreditNoteRegistry
+from utils.anomalies import extract_anomalies
+from utils.near_match import IMEINearMatchIndex, recover_near_matches
+from utils.rules import DifferenceRuleSet, get_rule_set
+from utils.key_matching import (match_secondary_keys, rejected_key_rows, MATCH_KEY_COLUMN,
+                                ORIGINAL_IMEI_COLUMN, PRIMARY_KEY)
+from utils.data_quality import profile_source, quarantine_path_for, write_quarantine
 
 logger = logging.getLogger(__name__)
 
 class VARProcessor:
     """Processore principale per il workflow VAR - Production Version."""
     
-    def __init__(self, input_directory: str = "."):
+    # Fasi di caricamento con checkpoint e sorgente corrispondente
+    LOAD_STAGES = {'load_post_vendita': 'post_vendita', 'load_ti': 'ti', 'load_financial': 'data'}
+    
+    def __init__(self, input_directory: str = ".", profiler: Optional[StageProfiler] = None,
+                 memory_governor: Optional[MemoryGovernor] = None, audit_file: Optional[str] = None,
+                 rules_file: Optional[str] = None, archive_dir: Optional[str] = None,
+                 archive_period: Optional[str] = None, seen_notes_dir: Optional[str] = None,
+                 matching_workers: Optional[int] = None, resume: bool = False,
+                 checkpoint_dir: Optional[str] = None, quarantine_file: Optional[str] = None):
         """
         Inizializza il processore VAR.
         
         Args:
             input_directory: Directory contenente i file da elaborare
+            profiler: Profiler fasi (opzionale, default da configurazione)
+            memory_governor: Governor budget memoria (opzionale, default da configurazione)
+            audit_file: Path audit calcoli ("auto" = accanto al report, None = Config.AUDIT_FILE)
+            rules_file: Tabella regole differenza YAML (None = Config.DIFFERENCE_RULES_FILE)
+            archive_dir: Archivio storico ("auto" = accanto al report, None = Config.ARCHIVE_DIR)
+            archive_period: Periodo di competenza per l'archivio (default mese corrente)
+            seen_notes_dir: Registro note credito già riconciliate ("auto" = accanto ai file
+                            di input, None = Config.SEEN_NOTES_DIR)
+            matching_workers: Processi per il matching partizionato (None = Config.MATCHING_WORKERS)
+            resume: Riprende dall'ultima fase salvata di un run interrotto con gli stessi input
+            checkpoint_dir: Directory checkpoint (None = Config.CHECKPOINT_DIR o accanto ai file di input)
+            quarantine_file: Righe scartate con motivo ("auto" = accanto al report,
+                             None = Config.QUARANTINE_FILE)
         """
         self.input_dir = Path(input_directory)
+        self.profiler = profiler or StageProfiler(
+            enabled=Config.ENABLE_PROFILING, trace_memory=Config.PROFILE_TRACEMALLOC
+        )
+        self.memory_governor = memory_governor or MemoryGovernor()
+        self.audit_file = audit_file or Config.AUDIT_FILE
+        self.rules = DifferenceRuleSet.load(rules_file) if rules_file else get_rule_set()
+        self.rule_hits = {}
+        self.key_matches = {}  # Righe abbinate per chiave secondaria
+        self.matching_workers = max(1, matching_workers or Config.MATCHING_WORKERS)
+        self.audit = None
+        self.audit_path = None
+        self.archive_dir = archive_dir or Config.ARCHIVE_DIR
+        self.archive_period = ReportArchive.validate_period(archive_period or ReportArchive.default_period())
+        self.archive_path = None
+        self.quarantine_file = quarantine_file or Config.QUARANTINE_FILE
+        self.quarantine_path = None
+        self.quarantine_rows = 0
+        self.seen_notes = self._open_seen_notes(seen_notes_dir or Config.SEEN_NOTES_DIR)
+        self._seen_note_keys = None
+        self._run_id = None
+        self.resume = resume
+        self.checkpoint_dir = checkpoint_dir or Config.CHECKPOINT_DIR
+        self.checkpoint = None
+        self.sources = None  # DataFrame già letti al posto dei file (load)
         self.post_vendita_file = None
         self.ti_files = []
         self.data_file = None
-        self.output_records = []
+        self.output_records = []  # Importi in centesimi (None: solo output_frame, vedi get_output_records)
+        self.output_frame = None
+        self.rejected_rows = {}  # Righe scartate per sorgente con motivo (quarantena e recupero near-match)
+        self.key_candidates = {}  # Righe con IMEI scartato ma chiavi secondarie (Config.ENABLE_KEY_MATCHING)
+        self.near_matches = None
+        self.anomalies = None
+        self.partition_dir = None  # Report per periodo (Config.REPORT_PARTITION)
+        self.partition_files = 0
         self.stats = {}
+        self.stats_accumulator = StatisticsAccumulator()
+        self.source_stats = {}
         
         logger.info(f"Inizializzato VAR Processor: {self.input_dir.absolute()}")
     
@@ -50,49 +122,439 @@ class VARProcessor:
             Exception: Se l'elaborazione fallisce
         """
         logger.info("Avvio workflow VAR...")
+        profiler = self.profiler
+        output_filename = output_filename or Config.get_output_filename()
         
         try:
-            # 1. Ricerca e validazione file
-            self._find_and_validate_files()
+            # 1. Ricerca e validazione file (sempre rieseguita: l'impronta dei checkpoint dipende dai file)
+            with profiler.stage('discovery') as stage:
+                self._find_and_validate_files()
+                stage.rows = len(self.ti_files) + 1 + (1 if self.data_file else 0)
+            self._open_checkpoint()
+            
+            # 2-3. Caricamento dati e matching (con audit calcoli opzionale), ripresi se salvati
+            if not self._restore_stage('matching'):
+                post_vendita_df, ti_df, data_map = self._load_sources()
+                
+                self._open_audit(output_filename)
+                with profiler.stage('matching') as stage:
+                    self.output_records = self._process_matching(post_vendita_df, ti_df, data_map)
+                    stage.rows = len(self.output_frame)
+                self._close_audit()
+                self._save_stage('matching')
             
-            # 2. Caricamento dati
-            post_vendita_df = self._load_post_vendita_data()
-            ti_df = self._load_ti_data()
-            data_map = self._load_financial_data()
+            # Candidati near-match per IMEI scartati o non abbinati (foglio dedicato)
+            if Config.ENABLE_NEAR_MATCH and not self._restore_stage('near_match'):
+                with profiler.stage('near_match') as stage:
+                    self.near_matches = self._recover_near_matches(self.output_frame)
+                    stage.rows = len(self.near_matches)
+                self._save_stage('near_match')
             
-            # 3. Elaborazione matching
-            self.output_records = self._process_matching(post_vendita_df, ti_df, data_map)
+            # Top N differenze per ambito e dealer non abbinati (foglio dedicato, selezione parziale)
+            if Config.ENABLE_ANOMALIES:
+                with profiler.stage('anomalies') as stage:
+                    self.anomalies = extract_anomalies(self.output_frame)
+                    stage.rows = len(self.anomalies)
+            
+            # 4. Calcolo statistiche finali (groupby sulle colonne categoriche)
+            if not self._restore_stage('statistics'):
+                with profiler.stage('statistics') as stage:
+                    self._calculate_final_statistics(self.output_frame)
+                    stage.rows = len(self.output_frame)
+                self._save_stage('statistics')
             
-            # 4. Generazione output
-            output_path = self._generate_excel_output(output_filename)
+            # 5. Generazione output
+            with profiler.stage('excel_output') as stage:
+                output_path = self._generate_excel_output(output_filename, self.output_frame)
+                stage.rows = len(self.output_frame)
             
-            # 5. Calcolo statistiche finali
-            self._calculate_final_statistics()
+            # 6. Righe scartate con motivo (quarantena accanto al report)
+            if self.quarantine_file:
+                with profiler.stage('quarantine') as stage:
+                    stage.rows = self._write_quarantine(output_path)
+            
+            # 7. Archivio storico (righe riconciliate + indice IMEI)
+            if self.archive_dir:
+                with profiler.stage('archive') as stage:
+                    self._archive_output(output_path)
+                    stage.rows = len(self.output_frame)
+            
+            # 8. Note credito del run registrate solo a report generato
+            if self.seen_notes is not None:
+                with profiler.stage('seen_notes'):
+                    self._register_seen_notes()
+            # Il DataFrame resta solo se i record non sono stati costruiti (matching parallelo, ripresa)
+            if self.output_records is not None:
+                self.output_frame = None
+            
+            # Report completo: i checkpoint non servono più
+            if self.checkpoint is not None:
+                self.checkpoint.clear()
             
             logger.info("Workflow VAR completato con successo")
             return output_path
             
         except Exception as e:
             logger.error(f"Errore durante l'elaborazione: {e}")
+            if self.checkpoint is not None and self.checkpoint.stages:
+                logger.info(f"Fasi salvate: {', '.join(self.checkpoint.stages)} "
+                            f"(rieseguire con --resume per riprendere)")
             raise
+        finally:
+            self._close_audit()
+            self.memory_governor.cleanup()
+    
+    def load(self, sources: Optional[Dict] = None) -> Tuple:
+        """
+        Carica le sorgenti con la stessa preparazione del workflow completo.
+        
+        Validazione IMEI, profilo qualità, codifiche categoriche, importi in
+        centesimi e policy duplicati, come in run().
+        
+        Args:
+            sources: DataFrame già letti al posto dei file: {'post_vendita': df,
+                'ti': {nome file: df}, 'data': df (opzionale)} (None = file della
+                directory di input)
+                
+        Returns:
+            Tuple con (post vendita, TI, mapping dati finanziari)
+        """
+        self.sources = sources
+        if sources is None:
+            with self.profiler.stage('discovery'):
+                self._find_and_validate_files()
+        else:
+            self.post_vendita_file = Path("post_vendita_fisici.xlsx")
+            self.ti_files = [Path(name) for name in sources['ti']]
+            self.data_file = Path("data.xlsx") if sources.get('data') is not None else None
+        return self._load_sources()
+    
+    def reconcile(self, post_vendita_df: pd.DataFrame, ti_df: pd.DataFrame, data_map: Dict) -> pd.DataFrame:
+        """
+        Esegue matching, differenze e statistiche finali sulle sorgenti caricate con load().
+        
+        Args:
+            post_vendita_df: Dati post vendita
+            ti_df: Dati TI
+            data_map: Mapping IMEI -> dati finanziari
+            
+        Returns:
+            DataFrame di output (importi in centesimi)
+        """
+        with self.profiler.stage('matching') as stage:
+            self.output_records = self._process_matching(post_vendita_df, ti_df, data_map)
+            stage.rows = len(self.output_frame)
+        with self.profiler.stage('statistics') as stage:
+            self._calculate_final_statistics(self.output_frame)
+            stage.rows = len(self.output_frame)
+        return self.output_frame
+    
+    def _read_source(self, file_path: Path) -> pd.DataFrame:
+        """Legge un file di input o il DataFrame corrispondente passato a load()."""
+        if self.sources is None:
+            return load_excel(file_path, self.memory_governor)
+        if file_path == self.post_vendita_file:
+            return self.sources['post_vendita'].copy()
+        return self.sources['ti'][file_path.name].copy()
+    
+    def _open_audit(self, output_filename: str) -> None:
+        """Apre l'audit trail dei calcoli se configurato."""
+        if not self.audit_file:
+            return
+        
+        if self.audit_file == 'auto':
+            path = CalculationAuditWriter.audit_path_for(self.input_dir / output_filename)
+        else:
+            path = Path(self.audit_file)
+        
+        self.audit = CalculationAuditWriter(path)
+        self.audit_path = self.audit.path
+        logger.info(f"Audit calcoli attivo: {self.audit_path}")
+    
+    def _close_audit(self) -> None:
+        """Chiude l'audit trail dei calcoli se aperto."""
+        if self.audit is not None:
+            self.audit.close()
+            self.audit = None
+    
+    def _run_fingerprint(self) -> str:
+        """Impronta del run (file di input e tabella regole), calcolata una volta."""
+        if self._run_id is None:
+            input_files = [self.post_vendita_file, *self.ti_files] + ([self.data_file] if self.data_file else [])
+            self._run_id = ReportArchive.run_fingerprint(input_files, extra=self.rules.source)
+        return self._run_id
+    
+    def _load_sources(self) -> Tuple:
+        """
+        Carica le tre sorgenti, riprendendo dai checkpoint quelle già caricate.
+        
+        Returns:
+            Tuple con (post vendita, TI, mapping dati finanziari)
+        """
+        profiler = self.profiler
+        
+        with profiler.stage('load_post_vendita') as stage:
+            post_vendita_df = self._restore_stage('load_post_vendita')
+            if post_vendita_df is None:
+                post_vendita_df = self._load_post_vendita_data()
+                self._save_stage('load_post_vendita', post_vendita_df)
+            stage.rows = len(post_vendita_df)
+        post_vendita_df = self.memory_governor.maybe_spill(post_vendita_df, 'post_vendita')
+        
+        with profiler.stage('load_ti') as stage:
+            ti_df = self._restore_stage('load_ti')
+            if ti_df is None:
+                ti_df = self._load_ti_data()
+                self._save_stage('load_ti', ti_df)
+            stage.rows = len(ti_df)
+        ti_df = self.memory_governor.maybe_spill(ti_df, 'ti')
+        
+        with profiler.stage('load_financial') as stage:
+            data_map = self._restore_stage('load_financial')
+            if data_map is None:
+                data_map = self._load_financial_data()
+                self._save_stage('load_financial', data_map)
+            stage.rows = len(data_map)
+        
+        return post_vendita_df, ti_df, data_map
+    
+    def _open_checkpoint(self) -> None:
+        """Apre i checkpoint del run (impronta input + impostazioni che influenzano i risultati)."""
+        if not Config.ENABLE_CHECKPOINTS:
+            return
+        
+        root = self.checkpoint_dir or StageCheckpoint.default_dir(self.input_dir)
+        settings = {
+            'rules': self.rules.digest,  # Contenuto, non path: tabella modificata sul posto = fasi obsolete
+            'duplicate_policy': Config.DUPLICATE_POLICY,
+            'seen_notes': str(self.seen_notes.root) if self.seen_notes is not None else None,
+            'seen_notes_policy': Config.SEEN_NOTES_POLICY,
+            'match_keys': [Config.ENABLE_KEY_MATCHING, Config.MATCH_SECONDARY_KEYS],
+            'near_match': [Config.ENABLE_NEAR_MATCH, Config.NEAR_MATCH_UNMATCHED,
+                           Config.NEAR_MATCH_MIN_CONFIDENCE, Config.NEAR_MATCH_MAX_CANDIDATES]
+        }
+        self.checkpoint = StageCheckpoint(root, self._run_fingerprint(), settings)
+        
+        if not self.resume:
+            # Nuova elaborazione: eventuali fasi salvate per gli stessi input sono obsolete
+            self.checkpoint.clear()
+        elif self.checkpoint.load():
+            logger.info(f"Ripresa run {self._run_fingerprint()}: fasi salvate {', '.join(self.checkpoint.stages)}")
+        else:
+            logger.info(f"Nessun checkpoint per il run {self._run_fingerprint()}: elaborazione completa")
+    
+    def _save_stage(self, stage: str, result=None) -> None:
+        """
+        Salva il risultato di una fase e lo stato che produce.
+        
+        Args:
+            stage: Nome della fase
+            result: Risultato della fase di caricamento (DataFrame o mapping dati finanziari)
+        """
+        if self.checkpoint is None:
+            return
+        
+        frames, state = {}, {}
+        if stage in self.LOAD_STAGES:
+            source = self.LOAD_STAGES[stage]
+            state['source_stats'] = self.source_stats.get(source)
+            frames['scartati'] = self.rejected_rows.get(source)
+            frames['chiavi_scartati'] = self.key_candidates.get(source)
+            if stage == 'load_financial':
+                frames['dati'] = pd.DataFrame.from_dict(result, orient='index').rename_axis('IMEI').reset_index()
+            else:
+                frames['dati'] = result
+            if stage == 'load_ti' and self._seen_note_keys is not None:
+                note_keys, pair_keys = self._seen_note_keys
+                frames['chiavi_note'] = pd.DataFrame({'NOTA': note_keys.to_numpy(), 'IMEI_NOTA': pair_keys.to_numpy()})
+        elif stage == 'matching':
+            frames['output'] = self.output_frame
+            state = {'rule_hits': self.rule_hits, 'key_matches': self.key_matches,
+                     'audit_path': str(self.audit_path) if self.audit_path else None}
+        elif stage == 'near_match':
+            frames['candidati'] = self.near_matches
+        elif stage == 'statistics':
+            state = {'stats': self.stats, 'accumulator': vars(self.stats_accumulator)}
+        
+        try:
+            self.checkpoint.save(stage, frames, state)
+        except Exception as e:
+            # Il checkpoint serve solo alla ripresa: un errore di scrittura non interrompe il run
+            logger.warning(f"Impossibile salvare il checkpoint della fase '{stage}': {e}")
+    
+    def _restore_stage(self, stage: str):
+        """
+        Ripristina una fase salvata (solo con --resume).
+        
+        Args:
+            stage: Nome della fase
+            
+        Returns:
+            Risultato della fase di caricamento, True per le altre fasi ripristinate,
+            None se la fase va eseguita
+        """
+        if not self.resume or self.checkpoint is None or not self.checkpoint.completed(stage):
+            return None
+        
+        logger.info(f"Ripresa: fase '{stage}' dal checkpoint")
+        if stage in self.LOAD_STAGES:
+            frames, state = self.checkpoint.restore(stage)
+            self._restore_source_state(stage, frames, state)
+            data = frames['dati']
+            if stage == 'load_financial':
+                return data.set_index('IMEI').to_dict('index')
+            return data
+        
+        if stage == 'matching':
+            # Lo stato delle sorgenti (statistiche, scarti, chiavi note) serve alle fasi successive
+            for load_stage in self.LOAD_STAGES:
+                if self.checkpoint.completed(load_stage):
+                    self._restore_source_state(load_stage, *self.checkpoint.restore(load_stage, skip=('dati',)))
+            frames, state = self.checkpoint.restore(stage)
+            self.output_frame = frames['output']
+            self.output_records = None
+            self.rule_hits = state['rule_hits']
+            self.key_matches = state.get('key_matches', {})
+            self.audit_path = Path(state['audit_path']) if state['audit_path'] else None
+        elif stage == 'near_match':
+            frames, _ = self.checkpoint.restore(stage)
+            self.near_matches = frames['candidati']
+        elif stage == 'statistics':
+            _, state = self.checkpoint.restore(stage)
+            self.stats = state['stats']
+            self.stats_accumulator = StatisticsAccumulator()
+            vars(self.stats_accumulator).update(state['accumulator'])
+        return True
+    
+    def _restore_source_state(self, stage: str, frames: Dict[str, pd.DataFrame], state: Dict) -> None:
+        """Ripristina statistiche, righe scartate e chiavi note di una sorgente caricata."""
+        source = self.LOAD_STAGES[stage]
+        if state.get('source_stats') is not None:
+            self.source_stats[source] = state['source_stats']
+        if 'scartati' in frames:
+            self.rejected_rows[source] = frames['scartati']
+        if 'chiavi_scartati' in frames:
+            self.key_candidates[source] = frames['chiavi_scartati']
+        if 'chiavi_note' in frames:
+            self._seen_note_keys = (frames['chiavi_note']['NOTA'], frames['chiavi_note']['IMEI_NOTA'])
+    
+    def _write_quarantine(self, output_path: str) -> int:
+        """
+        Scrive le righe scartate di tutte le sorgenti nel file di quarantena.
+        
+        Args:
+            output_path: Path del report (per il path predefinito)
+            
+        Returns:
+            Righe scritte (0 = nessuna riga scartata, nessun file)
+        """
+        frames = [frame for frame in self.rejected_rows.values()
+                  if frame is not None and not frame.empty and 'MOTIVO' in frame.columns]
+        if not frames:
+            return 0
+        
+        path = quarantine_path_for(output_path) if self.quarantine_file == 'auto' else Path(self.quarantine_file)
+        try:
+            self.quarantine_path, self.quarantine_rows = write_quarantine(frames, path)
+            logger.info(f"Quarantena: {self.quarantine_rows:,} righe scartate in {self.quarantine_path}")
+        except Exception as e:
+            # Il report è già scritto: la quarantena mancante non annulla l'elaborazione
+            logger.error(f"Impossibile scrivere la quarantena {path}: {e}")
+        return self.quarantine_rows
+    
+    def _archive_output(self, output_path: str) -> None:
+        """Accoda le righe riconciliate all'archivio storico."""
+        if self.archive_dir == 'auto':
+            archive = ReportArchive(ReportArchive.archive_dir_for(output_path))
+        else:
+            archive = ReportArchive(self.archive_dir)
+        
+        try:
+            frame = self.output_frame if self.output_frame is not None else self._build_output_frame()
+            archive.append(frame, self.archive_period, self._run_fingerprint())
+            self.archive_path = archive.root
+        except Exception as e:
+            # Il report è già scritto: l'archivio mancante non annulla l'elaborazione
+            logger.error(f"Impossibile aggiornare l'archivio storico {archive.root}: {e}")
+    
+    def _open_seen_notes(self, seen_notes_dir: Optional[str]) -> Optional[CreditNoteRegistry]:
+        """Apre il registro delle note credito già riconciliate se configurato."""
+        if not seen_notes_dir:
+            return None
+        if seen_notes_dir == 'auto':
+            seen_notes_dir = self.input_dir / Config.SEEN_NOTES_DEFAULT_DIR
+        if Config.SEEN_NOTES_POLICY not in ('flag', 'drop'):
+            raise ValueError(f"SEEN_NOTES_POLICY non valida: {Config.SEEN_NOTES_POLICY} (ammesse: flag, drop)")
+        
+        registry = CreditNoteRegistry(seen_notes_dir)
+        logger.info(f"Registro note credito: {registry.root} ({registry.statistics()['keys']:,} chiavi, "
+                    f"policy '{Config.SEEN_NOTES_POLICY}')")
+        return registry
+    
+    def _check_seen_notes(self, ti_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Segnala o scarta le note credito già riconciliate per altri periodi.
+        
+        Args:
+            ti_df: TI combinati (prima della gestione duplicati)
+            
+        Returns:
+            TI con colonna _NOTA_RIPETUTA ('flag') o senza le righe ripetute ('drop')
+        """
+        note_keys, pair_keys = CreditNoteRegistry.build_keys(ti_df['IMEI_CLEAN'], ti_df['NUMERO NOTA CREDITO'])
+        # Identità stabile: il periodo di competenza, non l'impronta dei file (riesportati, altre regole)
+        repeats = self.seen_notes.find_repeats(note_keys, pair_keys, self.archive_period)
+        repeated = (repeats != '').to_numpy()
+        
+        stats = {
+            'policy': Config.SEEN_NOTES_POLICY,
+            'repeated_rows': int(repeated.sum()),
+            'repeated_pairs': int((repeats == 'IMEI_NOTA').sum()),
+            'repeated_notes': int((repeats == 'NOTA').sum())
+        }
+        self.source_stats.setdefault('ti', {})['seen_notes'] = stats
+        
+        if stats['repeated_rows']:
+            sample = ', '.join(note_keys[repeated].dropna().unique()[:5])
+            logger.warning(f"Note credito già riconciliate: {stats['repeated_rows']:,} righe "
+                           f"({stats['repeated_pairs']:,} stesso IMEI, {stats['repeated_notes']:,} altro IMEI) "
+                           f"- es. {sample} (policy '{Config.SEEN_NOTES_POLICY}')")
+        
+        if Config.SEEN_NOTES_POLICY == 'drop':
+            keep = ~repeated
+            ti_df = ti_df[keep].reset_index(drop=True)
+            note_keys, pair_keys = note_keys[keep], pair_keys[keep]
+        else:
+            ti_df['_NOTA_RIPETUTA'] = repeats.to_numpy()
+        
+        self._seen_note_keys = (note_keys, pair_keys)
+        return ti_df
+    
+    def _register_seen_notes(self) -> None:
+        """Registra le note credito del run nel registro persistente."""
+        if self._seen_note_keys is None:
+            return
+        try:
+            self.seen_notes.register(*self._seen_note_keys, self.archive_period)
+        except Exception as e:
+            logger.error(f"Impossibile aggiornare il registro note credito {self.seen_notes.root}: {e}")
+        self._seen_note_keys = None
     
     def _find_and_validate_files(self) -> None:
         """Trova e valida tutti i file necessari."""
         logger.info("Ricerca e validazione file...")
+        files = discover_input_files(self.input_dir)
         
         # File post_vendita_fisici (obbligatorio)
-        for pattern in Config.POST_VENDITA_PATTERNS:
-            files = list(self.input_dir.glob(pattern))
-            if files:
-                self.post_vendita_file = files[0]
-                logger.info(f"File post vendita: {self.post_vendita_file.name}")
-                break
+        if files['post_vendita']:
+            self.post_vendita_file = files['post_vendita'][0]
+            logger.info(f"File post vendita: {self.post_vendita_file.name}")
         
         if not self.post_vendita_file:
             raise FileNotFoundError("File post_vendita_fisici non trovato")
         
         # File telefono_incluso (obbligatori)
-        self.ti_files = list(self.input_dir.glob(Config.TI_PATTERN))
+        self.ti_files = files['ti']
         if not self.ti_files:
             raise FileNotFoundError("Nessun file telefono_incluso trovato")
         
@@ -101,12 +563,9 @@ class VARProcessor:
             logger.info(f"  • {ti_file.name}")
         
         # File data.xlsx (opzionale)
-        for pattern in Config.DATA_PATTERNS:
-            files = list(self.input_dir.glob(pattern))
-            if files:
-                self.data_file = files[0]
-                logger.info(f"File dati finanziari: {self.data_file.name}")
-                break
+        if files['data']:
+            self.data_file = files['data'][0]
+            logger.info(f"File dati finanziari: {self.data_file.name}")
         
         if not self.data_file:
             logger.warning("File data.xlsx non trovato - continuando senza dati finanziari")
@@ -126,14 +585,14 @@ class VARProcessor:
         
         try:
             # Gestisce file HTML mascherati da XLS
-            if self.post_vendita_file.suffix.lower() == '.xls':
+            if self.sources is None and self.post_vendita_file.suffix.lower() == '.xls':
                 try:
                     df = pd.read_excel(self.post_vendita_file, engine='xlrd')
                 except:
                     logger.info("File XLS sembra essere HTML, lettura come HTML...")
                     df = pd.read_html(self.post_vendita_file)[0]
             else:
-                df = pd.read_excel(self.post_vendita_file)
+                df = self._read_source(self.post_vendita_file)
             
             logger.info(f"Caricati {len(df)} record da post_vendita_fisici")
             
@@ -142,15 +601,39 @@ class VARProcessor:
                 df, Config.POST_VENDITA_REQUIRED_COLUMNS, "post_vendita_fisici"
             )
             
-            # Valida e pulisce IMEI
-            df['IMEI_CLEAN'], imei_stats = IMEIValidator.validate_batch(df['IMEI'])
+            # Valida e pulisce IMEI, profilo qualità e righe scartate sul file come letto
+            imei_clean, imei_stats = IMEIValidator.validate_batch(df['IMEI'])
             logger.info(f"IMEI post vendita: {imei_stats['valid']}/{imei_stats['total']} validi")
+            quality, self.rejected_rows['post_vendita'] = profile_source(
+                df, 'post_vendita', self.post_vendita_file.name, 'IMEI', imei_clean, 'ID Vendita')
+            df['IMEI_CLEAN'] = imei_clean
+            self.source_stats['post_vendita'] = {
+                'files': 1,
+                'rows': len(df),
+                'valid_imei': int(imei_stats['valid']),
+                'invalid_imei': int(imei_stats['invalid']),
+                'quality': {self.post_vendita_file.name: quality}
+            }
             
             # Filtra solo righe con IMEI validi
             df_clean = df[df['IMEI_CLEAN'].notna()].copy()
+            encode_categorical(df_clean, Config.CATEGORICAL_COLUMNS['post_vendita'])
+            CurrencyFormatter.convert_columns_to_cents(df_clean, Config.AMOUNT_COLUMNS['post_vendita'])
+            
+            # Righe con IMEI scartato ancora abbinabili su chiavi secondarie
+            if Config.ENABLE_KEY_MATCHING:
+                candidates = rejected_key_rows(df, 'post_vendita')
+                CurrencyFormatter.convert_columns_to_cents(candidates, Config.AMOUNT_COLUMNS['post_vendita'])
+                self.key_candidates['post_vendita'] = candidates
+            
+            # Una riga per IMEI secondo la policy duplicati
+            df_clean, duplicate_stats = resolve_duplicates(df_clean, 'IMEI_CLEAN', 'post_vendita')
+            self._record_duplicate_stats('post_vendita', duplicate_stats)
             
             return df_clean
             
+        except MemoryBudgetExceeded:
+            raise
         except Exception as e:
             raise Exception(f"Errore caricamento post_vendita_fisici: {e}")
     
@@ -159,13 +642,17 @@ class VARProcessor:
         logger.info("Caricamento file telefono_incluso...")
         
         all_ti_data = []
+        rejected = []
+        key_candidates = []
         total_records = 0
+        ti_stats = {'files': 0, 'rows': 0, 'valid_imei': 0, 'invalid_imei': 0, 'quality': {}}
+        self.source_stats['ti'] = ti_stats
         
         for ti_file in self.ti_files:
             try:
                 logger.info(f"Elaborazione {ti_file.name}...")
                 
-                df = pd.read_excel(ti_file)
+                df = self._read_source(ti_file)
                 total_records += len(df)
                 
                 # Valida struttura
@@ -177,8 +664,13 @@ class VARProcessor:
                 if 'IMEI/SERIALE' in df.columns:
                     df = df.rename(columns={'IMEI/SERIALE': 'IMEI'})
                 
-                # Valida IMEI
-                df['IMEI_CLEAN'], imei_stats = IMEIValidator.validate_batch(df['IMEI'])
+                # Valida IMEI, profilo qualità e righe scartate (quarantena e recupero near-match)
+                imei_clean, imei_stats = IMEIValidator.validate_batch(df['IMEI'])
+                quality, file_rejected = profile_source(df, 'ti', ti_file.name, 'IMEI', imei_clean,
+                                                        'NUMERO NOTA CREDITO')
+                df['IMEI_CLEAN'] = imei_clean
+                rejected.append(file_rejected)
+                ti_stats['quality'][ti_file.name] = quality
                 
                 # Filtra righe valide
                 valid_rows = df[df['IMEI_CLEAN'].notna()].copy()
@@ -186,9 +678,24 @@ class VARProcessor:
                 
                 # Aggiunge tracciabilità
                 valid_rows['SOURCE_FILE'] = ti_file.name
+                encode_categorical(valid_rows, Config.CATEGORICAL_COLUMNS['ti'])
+                CurrencyFormatter.convert_columns_to_cents(valid_rows, Config.AMOUNT_COLUMNS['ti'], absolute=True)
+                
+                # Righe con IMEI scartato ancora abbinabili su chiavi secondarie
+                if Config.ENABLE_KEY_MATCHING:
+                    candidates = rejected_key_rows(df, 'ti').assign(SOURCE_FILE=ti_file.name)
+                    CurrencyFormatter.convert_columns_to_cents(candidates, Config.AMOUNT_COLUMNS['ti'], absolute=True)
+                    key_candidates.append(candidates)
+                
+                ti_stats['files'] += 1
+                ti_stats['rows'] += len(df)
+                ti_stats['valid_imei'] += int(imei_stats['valid'])
+                ti_stats['invalid_imei'] += int(imei_stats['invalid'])
                 
                 all_ti_data.append(valid_rows)
                 
+            except MemoryBudgetExceeded:
+                raise
             except Exception as e:
                 logger.error(f"Errore caricamento {ti_file.name}: {e}")
                 continue
@@ -196,62 +703,149 @@ class VARProcessor:
         if not all_ti_data:
             raise Exception("Nessun file TI caricato con successo")
         
-        # Combina tutti i DataFrame
-        combined_df = pd.concat(all_ti_data, ignore_index=True)
+        # Combina tutti i DataFrame (categorie unificate tra i file)
+        combined_df = concat_categorical(all_ti_data)
+        self.rejected_rows['ti'] = pd.concat(rejected, ignore_index=True)
+        if key_candidates:
+            self.key_candidates['ti'] = pd.concat(key_candidates, ignore_index=True)
         logger.info(f"TI combinati: {len(combined_df)} record validi da {total_records} totali")
         
+        # Note credito già riconciliate in run precedenti (Bloom filter + verifica esatta)
+        if self.seen_notes is not None:
+            combined_df = self._check_seen_notes(combined_df)
+        
+        # Note credito multiple per IMEI (anche tra file diversi) secondo la policy duplicati
+        combined_df, duplicate_stats = resolve_duplicates(combined_df, 'IMEI_CLEAN', 'ti')
+        self._record_duplicate_stats('ti', duplicate_stats)
+        
         return combined_df
     
+    def _record_duplicate_stats(self, source: str, duplicate_stats: Dict) -> None:
+        """Aggiunge le statistiche duplicati alle statistiche della sorgente."""
+        self.source_stats.setdefault(source, {}).update({
+            'duplicate_imei': duplicate_stats['duplicate_imei'],
+            'duplicate_rows': duplicate_stats['duplicate_rows'],
+            'duplicate_policy': duplicate_stats['policy']
+        })
+    
     def _load_financial_data(self) -> Dict[str, Dict]:
         """Carica dati finanziari (opzionale)."""
         if not self.data_file:
             return {}
         
         try:
-            processor = DataFileProcessor(self.data_file)
-            data_map = processor.load_and_process()
+            processor = DataFileProcessor(self.data_file, memory_governor=self.memory_governor)
+            data_map = processor.load_and_process(
+                self.sources['data'].copy() if self.sources is not None else None)
+            
+            data_stats = processor.get_statistics()
+            if 'total_records' in data_stats:
+                self.source_stats['data'] = {
+                    'files': 1,
+                    'rows': data_stats['total_records'],
+                    'valid_imei': data_stats['processed_records'],
+                    'invalid_imei': data_stats['total_records'] - data_stats['processed_records']
+                }
+                if 'quality' in data_stats:
+                    self.source_stats['data']['quality'] = {self.data_file.name: data_stats['quality']}
+                if 'duplicates' in data_stats:
+                    self._record_duplicate_stats('data', data_stats['duplicates'])
+            if processor.rejected_rows is not None:
+                self.rejected_rows['data'] = processor.rejected_rows
             
             if processor.has_data():
                 logger.info(f"Dati finanziari caricati: {processor.get_imei_count()} IMEI")
             
             return data_map
             
+        except MemoryBudgetExceeded:
+            raise
         except Exception as e:
             logger.warning(f"Errore caricamento dati finanziari: {e}")
             return {}
     
     def _process_matching(self, post_vendita_df: pd.DataFrame, 
-                         ti_df: pd.DataFrame, data_map: Dict) -> List[Dict]:
-        """Esegue il matching tra i dati."""
+                         ti_df: pd.DataFrame, data_map: Dict) -> Optional[List[Dict]]:
+        """Esegue il matching tra i dati (record None se il report è solo in output_frame)."""
         logger.info("Elaborazione matching IMEI...")
+        governor = self.memory_governor
+        
+        # DataFrame ricaricati se scaricati su disco
+        post_vendita_df = SpilledFrame.resolve(post_vendita_df)
+        ti_df = SpilledFrame.resolve(ti_df)
+        
+        # Chiavi secondarie (opzionali) per i record senza match IMEI o con IMEI scartato
+        if Config.ENABLE_KEY_MATCHING:
+            post_vendita_df, ti_df, self.key_matches = match_secondary_keys(
+                post_vendita_df, ti_df, pv_rejected=self.key_candidates.get('post_vendita'),
+                ti_rejected=self.key_candidates.get('ti'))
+            if '_NOTA_RIPETUTA' in ti_df.columns:
+                ti_df['_NOTA_RIPETUTA'] = ti_df['_NOTA_RIPETUTA'].fillna('')
+        
+        # Partizioni per IMEI elaborate in processi separati sui volumi grandi
+        workers = self.matching_workers
+        if workers > 1 and len(post_vendita_df) + len(ti_df) >= Config.PARALLEL_MATCHING_MIN_ROWS:
+            return self._process_matching_parallel(post_vendita_df, ti_df, data_map, workers)
         
         # Crea mapping per accesso rapido
         post_vendita_map = self._create_post_vendita_mapping(post_vendita_df)
+        governor.check("mapping post vendita")
         ti_map = self._create_ti_mapping(ti_df)
+        governor.check("mapping TI")
         
         logger.info(f"Mapping creati: {len(post_vendita_map)} post vendita, {len(ti_map)} TI")
         
-        # Processa matching con progress bar
+        output_records, counts = self._build_match_records(post_vendita_map, ti_map, data_map, governor)
+        self._log_matching_counts(len(output_records), counts)
+        
+        # Ordina per Data Scarico
+        output_records.sort(key=lambda x: x.get('Data Scarico') or '', reverse=True)
+        
+        # Differenze calcolate in blocco con la tabella regole
+        self.output_frame = self._apply_difference_rules(output_records)
+        
+        return output_records
+    
+    @staticmethod
+    def _build_match_records(post_vendita_map: Dict, ti_map: Dict, data_map: Dict,
+                             governor: Optional[MemoryGovernor] = None) -> Tuple[List[Dict], Dict[str, int]]:
+        """
+        Costruisce i record di output: IMEI post vendita (in ordine di mapping), poi solo TI.
+        
+        Args:
+            post_vendita_map: Mapping IMEI -> dati post vendita
+            ti_map: Mapping IMEI -> dati TI
+            data_map: Mapping IMEI -> dati finanziari
+            governor: Governor memoria (None nei processi worker)
+            
+        Returns:
+            Tuple con (record, conteggi per tipo)
+        """
         output_records = []
         matched_count = 0
         pv_only_count = 0
         
-        # Progress bar per post vendita
+        # Progress bar per post vendita (solo nel processo principale)
         pv_iterator = tqdm(post_vendita_map.items(), desc="Matching post vendita", 
-                          disable=len(post_vendita_map) < 100)
+                          disable=governor is None or len(post_vendita_map) < 100)
         
-        for imei, pv_data in pv_iterator:
+        check_interval = Config.MEMORY_CHECK_INTERVAL
+        
+        for position, (imei, pv_data) in enumerate(pv_iterator, start=1):
+            if governor is not None and position % check_interval == 0:
+                governor.check("matching")
+            
             ti_data = ti_map.get(imei)
             data_financial = data_map.get(imei, {})
             
             if ti_data:
                 # Match trovato
                 matched_count += 1
-                record = self._create_matched_record(imei, pv_data, ti_data, data_financial)
+                record = VARProcessor._create_matched_record(imei, pv_data, ti_data, data_financial)
             else:
                 # Solo post vendita
                 pv_only_count += 1
-                record = self._create_post_vendita_only_record(imei, pv_data, data_financial)
+                record = VARProcessor._create_post_vendita_only_record(imei, pv_data, data_financial)
             
             output_records.append(record)
         
@@ -261,23 +855,164 @@ class VARProcessor:
             if imei not in post_vendita_map:
                 ti_only_count += 1
                 data_financial = data_map.get(imei, {})
-                record = self._create_ti_only_record(imei, ti_data, data_financial)
+                record = VARProcessor._create_ti_only_record(imei, ti_data, data_financial)
                 output_records.append(record)
         
-        # Log statistiche matching
+        return output_records, {'matched': matched_count, 'pv_only': pv_only_count, 'ti_only': ti_only_count}
+    
+    @staticmethod
+    def _log_matching_counts(total: int, counts: Dict[str, int]) -> None:
+        """Log statistiche matching."""
         logger.info(f"Matching completato:")
-        logger.info(f"  • IMEI totali: {len(output_records)}")
-        logger.info(f"  • IMEI matched: {matched_count}")
-        logger.info(f"  • Solo post vendita: {pv_only_count}")
-        logger.info(f"  • Solo TI: {ti_only_count}")
+        logger.info(f"  • IMEI totali: {total}")
+        logger.info(f"  • IMEI matched: {counts['matched']}")
+        logger.info(f"  • Solo post vendita: {counts['pv_only']}")
+        logger.info(f"  • Solo TI: {counts['ti_only']}")
+    
+    def _process_matching_parallel(self, post_vendita_df: pd.DataFrame, ti_df: pd.DataFrame,
+                                   data_map: Dict, workers: int) -> None:
+        """
+        Matching e differenze partizionati per hash IMEI su più processi.
         
-        # Ordina per Data Scarico
-        output_records.sort(key=lambda x: x.get('Data Scarico') or '', reverse=True)
+        Ogni record porta l'ordinale che avrebbe nel matching seriale: i
+        risultati dei worker sono mappati senza copia e riordinati una sola
+        volta (ordinale, poi Data Scarico), riproducendo l'output seriale.
+        Il report resta in self.output_frame: i dict dei record sono
+        costruiti solo su richiesta (get_output_records).
         
-        return output_records
+        Args:
+            post_vendita_df: Dati post vendita
+            ti_df: Dati TI
+            data_map: Mapping IMEI -> dati finanziari
+            workers: Processi worker (= partizioni)
+            
+        Returns:
+            None (nessun record costruito)
+        """
+        from processors.parallel_matching import run_partitioned_matching
+        
+        df_output, counts = run_partitioned_matching(post_vendita_df, ti_df, data_map, self.rules, workers)
+        self.memory_governor.check("matching parallelo")
+        self._log_matching_counts(len(df_output), counts)
+        
+        # Ordine seriale per ordinale, poi stesso ordinamento stabile per Data Scarico:
+        # una sola permutazione applicata ai risultati mappati
+        order = np.argsort(df_output.pop('_ORD').to_numpy(), kind='stable')
+        if 'Data Scarico' in df_output.columns:
+            # Chiave con le date mancanti al minimo (NaT come int64, '' come nel seriale)
+            dates = df_output['Data Scarico'].iloc[order]
+            if pd.api.types.is_datetime64_any_dtype(dates.dtype):
+                keys = pd.Series(dates.to_numpy(dtype='datetime64[ns]').view('i8'))
+            else:
+                keys = dates.fillna('')
+            # Decrescente stabile: crescente stabile sulla sequenza invertita, poi invertito
+            ascending = keys[::-1].argsort(kind='stable').to_numpy()
+            order = order[len(order) - 1 - ascending[::-1]]
+        df_output = df_output.iloc[order].reset_index(drop=True)
+        
+        rule_index = df_output.pop('_RULE').to_numpy()
+        encode_categorical(df_output, Config.CATEGORICAL_COLUMNS['output'])
+        self.output_frame = self._record_rule_results(df_output, rule_index)
+        
+        return None
     
-    def _create_post_vendita_mapping(self, df: pd.DataFrame) -> Dict:
-        """Crea mapping IMEI -> dati post vendita."""
+    def _apply_difference_rules(self, output_records: List[Dict]) -> pd.DataFrame:
+        """
+        Calcola le differenze di tutti i record con maschere vettoriali.
+        
+        Args:
+            output_records: Record di output (aggiornati con la Differenza)
+            
+        Returns:
+            DataFrame di output con colonna Differenza (centesimi)
+        """
+        df_output = self._build_output_frame(output_records)
+        if df_output.empty:
+            self.rule_hits = {name: 0 for name in self.rules.rule_names}
+            return df_output
+        
+        differences, rule_index = self.rules.evaluate(df_output)
+        df_output['Differenza'] = differences
+        for record, differenza in zip(output_records, differences.tolist()):
+            record['Differenza'] = differenza
+        
+        return self._record_rule_results(df_output, rule_index)
+    
+    def _record_rule_results(self, df_output: pd.DataFrame, rule_index: np.ndarray) -> pd.DataFrame:
+        """Registra utilizzo regole e audit per un DataFrame con Differenza già calcolata."""
+        self.rule_hits = self.rules.hit_counts(rule_index)
+        logger.info(f"Regole differenza ({self.rules.source}): "
+                    + ", ".join(f"{name} {count:,}" for name, count in self.rule_hits.items()))
+        
+        if self.audit is not None:
+            self.audit.record_frame(df_output, self.rules.method_labels(rule_index))
+        
+        return df_output
+    
+    def _recover_near_matches(self, df_output: pd.DataFrame) -> pd.DataFrame:
+        """
+        Propone IMEI candidati per le righe scartate e per i solo post vendita.
+        
+        Gli IMEI validi di ciascuna sorgente sono indicizzati (esatti e per
+        vicinato di cancellazione): ogni riga da recuperare è un join sulle
+        chiavi, senza confronti a coppie.
+        
+        Args:
+            df_output: DataFrame di output (IMEI validi per sorgente e tipo match)
+            
+        Returns:
+            Candidati con confidenza (vuoto se nessuno)
+        """
+        queries = []
+        for source, target in (('post_vendita', 'ti'), ('ti', 'post_vendita')):
+            rejected = self.rejected_rows.get(source)
+            if rejected is not None and not rejected.empty:
+                queries.append(pd.DataFrame({
+                    'ORIGINE': source,
+                    'STATO': 'SCARTATO',
+                    'IMEI_ORIGINALE': rejected['IMEI'].to_numpy(),
+                    'RIFERIMENTO': rejected['RIFERIMENTO'].astype(str).to_numpy(),
+                    'CERCA_IN': target
+                }))
+        
+        indexes = {}
+        matched = None
+        if not df_output.empty:
+            tipo = df_output['_TIPO'].astype(str)
+            imeis = df_output['IMEI'].astype(str)
+            matched = imeis[tipo == 'MATCHED']
+            
+            # IMEI validi ma senza controparte: cercati tra i TI (direzione unica, la relazione è simmetrica)
+            pv_only = tipo == 'POST_VENDITA_ONLY'
+            if Config.NEAR_MATCH_UNMATCHED and pv_only.any():
+                queries.append(pd.DataFrame({
+                    'ORIGINE': 'post_vendita',
+                    'STATO': 'NON_ABBINATO',
+                    'IMEI_ORIGINALE': imeis[pv_only].to_numpy(),
+                    'RIFERIMENTO': df_output.loc[pv_only, 'ID Vendita'].astype(str).to_numpy(),
+                    'CERCA_IN': 'ti'
+                }))
+            
+            if queries:
+                targets = set(pd.concat(queries)['CERCA_IN'])
+                if 'ti' in targets:
+                    indexes['ti'] = IMEINearMatchIndex(imeis[tipo != 'POST_VENDITA_ONLY'])
+                if 'post_vendita' in targets:
+                    indexes['post_vendita'] = IMEINearMatchIndex(imeis[tipo != 'TI_ONLY'])
+        
+        if not queries or not indexes:
+            return recover_near_matches(pd.DataFrame(), {})
+        
+        near_matches = recover_near_matches(pd.concat(queries, ignore_index=True), indexes, matched)
+        if not near_matches.empty:
+            logger.info(f"Recupero IMEI: {len(near_matches):,} candidati per "
+                        f"{near_matches.groupby(['ORIGINE', 'IMEI_ORIGINALE', 'RIFERIMENTO']).ngroups:,} righe "
+                        f"(foglio '{Config.NEAR_MATCH_SHEET_NAME}')")
+        return near_matches
+    
+    @staticmethod
+    def _create_post_vendita_mapping(df: pd.DataFrame) -> Dict:
+        """Crea mapping IMEI -> dati post vendita (importi in centesimi)."""
         mapping = {}
         for _, row in df.iterrows():
             imei = row['IMEI_CLEAN']
@@ -287,14 +1022,15 @@ class VARProcessor:
                 'cliente': str(row.get('Cliente', '')),
                 'data_scarico': row.get('Data Scarico'),
                 'modalita_vendita': str(row.get('Modalita vendita', '')),
-                'importo_credito': CurrencyFormatter.format_value(row.get('IMPORTO CREDITO', 0)),
-                'importo_ndc': CurrencyFormatter.format_value(row.get('IMPORTO NDC', 0)),
-                'importo_finanziato': CurrencyFormatter.format_value(row.get('IMPORTO FINANZIATO', 0))
+                'importo_credito': int(row.get('IMPORTO CREDITO', 0)),
+                'importo_ndc': int(row.get('IMPORTO NDC', 0)),
+                'importo_finanziato': int(row.get('IMPORTO FINANZIATO', 0))
             }
         return mapping
     
-    def _create_ti_mapping(self, df: pd.DataFrame) -> Dict:
-        """Crea mapping IMEI -> dati TI."""
+    @staticmethod
+    def _create_ti_mapping(df: pd.DataFrame) -> Dict:
+        """Crea mapping IMEI -> dati TI (importi in centesimi)."""
         mapping = {}
         for _, row in df.iterrows():
             imei = row['IMEI_CLEAN']
@@ -303,24 +1039,18 @@ class VARProcessor:
                 'codice_pos': str(row.get('CODICE POS', '')),
                 'numero_nota_credito': str(row.get('NUMERO NOTA CREDITO', '')),
                 'causale': str(row.get('CAUSALE', '')),
-                'importo_originale': CurrencyFormatter.format_value(abs(float(row.get('IMPORTO ORIGINALE', 0)))),
-                'source_file': str(row.get('SOURCE_FILE', ''))
+                'importo_originale': int(row.get('IMPORTO ORIGINALE', 0)),
+                'source_file': str(row.get('SOURCE_FILE', '')),
+                'nota_ripetuta': row.get('_NOTA_RIPETUTA', ''),
+                'chiave_match': row.get(MATCH_KEY_COLUMN, PRIMARY_KEY),
+                'imei_ti': row.get(ORIGINAL_IMEI_COLUMN, imei)
             }
         return mapping
     
-    def _create_matched_record(self, imei: str, pv_data: Dict, 
-                              ti_data: Dict, data_financial: Dict) -> Dict:
+    @staticmethod
+    def _create_matched_record(imei: str, pv_data: Dict, 
+                               ti_data: Dict, data_financial: Dict) -> Dict:
         """Crea record per IMEI matched."""
-        differenza = DifferenceCalculator.calculate(
-            causale=ti_data['causale'],
-            finanziaria=data_financial.get('finanziaria', ''),
-            importo_originale=ti_data['importo_originale'],
-            importo_credito=pv_data['importo_credito'],
-            importo_ndc=pv_data['importo_ndc'],
-            importo_finanziato_wind=data_financial.get('importo_finanziato_wind', 0.0),
-            importo_finanziato_post=pv_data['importo_finanziato']
-        )
-        
         return {
             'IMEI': imei,
             'Ragione sociale Dealer': ti_data['ragione_sociale_dealer'],
@@ -339,28 +1069,22 @@ class VARProcessor:
             'N° L.d.C. o N° Prat. Findomestic': data_financial.get('n_ldc_findomestic', ''),
             'Stato Prat': data_financial.get('stato_prat', ''),
             'W-Importo Originale': ti_data['importo_originale'],
-            'W-Finanziato Wind': data_financial.get('importo_finanziato_wind', 0.0),
+            'W-Finanziato Wind': data_financial.get('importo_finanziato_wind', 0),
             'B-IMPORTO CREDITO': pv_data['importo_credito'],
             'B-IMPORTO NDC': pv_data['importo_ndc'],
             'B-IMPORTO FINANZIATO': pv_data['importo_finanziato'],
-            'Differenza': differenza,
+            'Differenza': 0,  # Calcolata in blocco dalle regole differenza
+            'Chiave Match': ti_data['chiave_match'],
+            'IMEI TI': ti_data['imei_ti'],
             '_TIPO': 'MATCHED',
+            'Nota Ripetuta': ti_data['nota_ripetuta'],
             '_SOURCE_TI': ti_data['source_file']
         }
     
-    def _create_post_vendita_only_record(self, imei: str, pv_data: Dict, 
-                                        data_financial: Dict) -> Dict:
+    @staticmethod
+    def _create_post_vendita_only_record(imei: str, pv_data: Dict, 
+                                         data_financial: Dict) -> Dict:
         """Crea record per IMEI solo in post vendita."""
-        differenza = DifferenceCalculator.calculate(
-            causale='',
-            finanziaria=data_financial.get('finanziaria', ''),
-            importo_originale=0.0,
-            importo_credito=pv_data['importo_credito'],
-            importo_ndc=pv_data['importo_ndc'],
-            importo_finanziato_wind=data_financial.get('importo_finanziato_wind', 0.0),
-            importo_finanziato_post=pv_data['importo_finanziato']
-        )
-        
         return {
             'IMEI': imei,
             'Ragione sociale Dealer': '',
@@ -378,28 +1102,22 @@ class VARProcessor:
             'Tipo Finanz': data_financial.get('tipo_finanz', ''),
             'N° L.d.C. o N° Prat. Findomestic': data_financial.get('n_ldc_findomestic', ''),
             'Stato Prat': data_financial.get('stato_prat', ''),
-            'W-Importo Originale': 0.0,
-            'W-Finanziato Wind': data_financial.get('importo_finanziato_wind', 0.0),
+            'W-Importo Originale': 0,
+            'W-Finanziato Wind': data_financial.get('importo_finanziato_wind', 0),
             'B-IMPORTO CREDITO': pv_data['importo_credito'],
             'B-IMPORTO NDC': pv_data['importo_ndc'],
             'B-IMPORTO FINANZIATO': pv_data['importo_finanziato'],
-            'Differenza': differenza,
+            'Differenza': 0,  # Calcolata in blocco dalle regole differenza
+            'Chiave Match': '',
+            'IMEI TI': '',
+            'Nota Ripetuta': '',
             '_TIPO': 'POST_VENDITA_ONLY'
         }
     
-    def _create_ti_only_record(self, imei: str, ti_data: Dict, 
-                              data_financial: Dict) -> Dict:
+    @staticmethod
+    def _create_ti_only_record(imei: str, ti_data: Dict, 
+                               data_financial: Dict) -> Dict:
         """Crea record per IMEI solo in TI."""
-        differenza = DifferenceCalculator.calculate(
-            causale=ti_data['causale'],
-            finanziaria=data_financial.get('finanziaria', ''),
-            importo_originale=ti_data['importo_originale'],
-            importo_credito=0.0,
-            importo_ndc=0.0,
-            importo_finanziato_wind=data_financial.get('importo_finanziato_wind', 0.0),
-            importo_finanziato_post=0.0
-        )
-        
         return {
             'IMEI': imei,
             'Ragione sociale Dealer': ti_data['ragione_sociale_dealer'],
@@ -418,16 +1136,27 @@ class VARProcessor:
             'N° L.d.C. o N° Prat. Findomestic': data_financial.get('n_ldc_findomestic', ''),
             'Stato Prat': data_financial.get('stato_prat', ''),
             'W-Importo Originale': ti_data['importo_originale'],
-            'W-Finanziato Wind': data_financial.get('importo_finanziato_wind', 0.0),
-            'B-IMPORTO CREDITO': 0.0,
-            'B-IMPORTO NDC': 0.0,
-            'B-IMPORTO FINANZIATO': 0.0,
-            'Differenza': differenza,
+            'W-Finanziato Wind': data_financial.get('importo_finanziato_wind', 0),
+            'B-IMPORTO CREDITO': 0,
+            'B-IMPORTO NDC': 0,
+            'B-IMPORTO FINANZIATO': 0,
+            'Differenza': 0,  # Calcolata in blocco dalle regole differenza
+            'Chiave Match': '',
+            'IMEI TI': ti_data['imei_ti'],
             '_TIPO': 'TI_ONLY',
+            'Nota Ripetuta': ti_data['nota_ripetuta'],
             '_SOURCE_TI': ti_data['source_file']
         }
     
-    def _generate_excel_output(self, output_filename: str = None) -> str:
+    def _build_output_frame(self, output_records: Optional[List[Dict]] = None) -> pd.DataFrame:
+        """Crea il DataFrame dei record di output con i campi ripetuti categorici."""
+        records = self.output_records if output_records is None else output_records
+        df_output = pd.DataFrame(records or [])
+        encode_categorical(df_output, Config.CATEGORICAL_COLUMNS['output'])
+        return df_output
+    
+    def _generate_excel_output(self, output_filename: str = None,
+                               df_output: Optional[pd.DataFrame] = None) -> str:
         """Genera il file Excel di output."""
         if not output_filename:
             output_filename = Config.get_output_filename()
@@ -436,24 +1165,39 @@ class VARProcessor:
         logger.info(f"Generazione file Excel: {output_filename}")
         
         # Crea DataFrame per l'output
-        df_output = pd.DataFrame(self.output_records)
+        if df_output is None:
+            df_output = self._build_output_frame()
+        
+        # Tipo record per l'indice dei report per periodo (colonna di servizio)
+        record_types = df_output['_TIPO'] if '_TIPO' in df_output.columns else None
         
         # Rimuove colonne di servizio
         service_columns = [col for col in df_output.columns if col.startswith('_')]
         df_output = df_output.drop(columns=service_columns, errors='ignore')
         
         # Riordina colonne secondo configurazione
-        available_columns = [col for col in Config.OUTPUT_COLUMNS if col in df_output.columns]
+        available_columns = [col for col in Config.get_output_columns() if col in df_output.columns]
         df_output = df_output[available_columns]
         
-        # Formatta colonne valute
-        CurrencyFormatter.format_currency_columns(df_output, Config.CURRENCY_COLUMNS)
+        # Converte colonne valute da centesimi a euro (solo in output)
+        CurrencyFormatter.cents_columns_to_euros(df_output, Config.CURRENCY_COLUMNS)
         
         # Ordina per Data Scarico (più recenti prima)
         if 'Data Scarico' in df_output.columns:
             df_output['Data Scarico'] = pd.to_datetime(df_output['Data Scarico'], errors='coerce')
             df_output = df_output.sort_values('Data Scarico', ascending=False, na_position='last')
         
+        # Un file per periodo di Data Scarico e indice al posto del report unico
+        if Config.REPORT_PARTITION and 'Data Scarico' in df_output.columns:
+            from processors.partitioned_output import write_partitioned_reports
+            
+            if record_types is not None:
+                record_types = record_types.loc[df_output.index]
+            self.partition_dir, self.partition_files = write_partitioned_reports(
+                df_output, output_path, Config.REPORT_PARTITION, record_types,
+                self._extra_sheets(), self.matching_workers)
+            return str(output_path)
+        
         # Scrive file Excel con formattazione
         self._write_excel_file(df_output, output_path)
         
@@ -461,74 +1205,89 @@ class VARProcessor:
         return str(output_path)
     
     def _write_excel_file(self, df: pd.DataFrame, output_path: Path) -> None:
-        """Scrive il file Excel con formattazione professionale."""
-        with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
-            # Scrive il foglio principale
-            df.to_excel(writer, sheet_name=Config.EXCEL_SHEET_NAME, index=False)
-            
-            # Ottiene worksheet per formattazione
-            worksheet = writer.sheets[Config.EXCEL_SHEET_NAME]
-            
-            # Formatta intestazioni
-            for cell in worksheet[1]:
-                if cell.value:  # Solo celle con contenuto
-                    try:
-                        # Usa metodo moderno per evitare deprecation warning
-                        from openpyxl.styles import Font, PatternFill
-                        cell.font = Font(bold=True, size=11)
-                        cell.fill = PatternFill(start_color="E8E8E8", end_color="E8E8E8", fill_type="solid")
-                    except ImportError:
-                        # Fallback per versioni più vecchie
-                        cell.font = cell.font.copy(bold=True)
-                        cell.fill = cell.fill.copy(fgColor="E8E8E8")
-            
-            # Auto-width colonne con limite massimo
-            for column in worksheet.columns:
-                max_length = 0
-                column_letter = column[0].column_letter
-                
-                for cell in column:
-                    try:
-                        if cell.value and len(str(cell.value)) > max_length:
-                            max_length = len(str(cell.value))
-                    except:
-                        continue
-                
-                # Imposta larghezza con limiti ragionevoli
-                adjusted_width = min(max(max_length + 2, 10), 50)
-                worksheet.column_dimensions[column_letter].width = adjusted_width
-            
-            # Freeze panes su prima riga
-            worksheet.freeze_panes = "A2"
+        """Scrive il file Excel con formattazione per colonna (Config.EXCEL_OUTPUT_MODE)."""
+        write_excel_report(output_path, {Config.EXCEL_SHEET_NAME: df, **self._extra_sheets()})
+    
+    def _extra_sheets(self) -> Dict[str, pd.DataFrame]:
+        """Fogli anomalie e candidati near-match (solo se presenti)."""
+        sheets = {}
+        if self.anomalies is not None and not self.anomalies.empty:
+            sheets[Config.ANOMALY_SHEET_NAME] = self.anomalies
+        if self.near_matches is not None and not self.near_matches.empty:
+            sheets[Config.NEAR_MATCH_SHEET_NAME] = self.near_matches
+        return sheets
     
-    def _calculate_final_statistics(self) -> None:
+    def _calculate_final_statistics(self, output_df: Optional[pd.DataFrame] = None) -> None:
         """Calcola statistiche finali per il processore."""
-        if not self.output_records:
+        # Riepilogo e breakdown con groupby vettoriali sul DataFrame di output
+        if output_df is None:
+            output_df = self.output_frame if self.output_frame is not None else self._build_output_frame()
+        if output_df.empty:
             return
         
-        # Statistiche base
-        total_difference = sum(record.get('Differenza', 0) for record in self.output_records)
-        
-        # Conta per tipo
-        type_counts = {}
-        for record in self.output_records:
-            record_type = record.get('_TIPO', 'UNKNOWN')
-            type_counts[record_type] = type_counts.get(record_type, 0) + 1
+        accumulator = StatisticsAccumulator().add_frame(output_df, in_cents=True)
+        self.stats_accumulator = accumulator
+        type_counts = accumulator.type_counts
         
         self.stats = {
-            'total_imei': len(self.output_records),
+            'total_imei': accumulator.total_records,
             'matched_imei': type_counts.get('MATCHED', 0),
             'pv_only_imei': type_counts.get('POST_VENDITA_ONLY', 0),
             'ti_only_imei': type_counts.get('TI_ONLY', 0),
-            'total_difference': round(total_difference, 2)
+            'total_difference': accumulator.total_difference,
+            'rule_hits': dict(self.rule_hits)
         }
         
         logger.info(f"Statistiche finali: {self.stats}")
     
     def get_output_records(self) -> List[Dict]:
-        """Restituisce i record di output per analisi esterne."""
-        return self.output_records.copy()
+        """Restituisce i record di output per analisi esterne (importi in euro)."""
+        records = self.output_records
+        if records is None:
+            # Matching parallelo o ripresa: record costruiti solo ora dal DataFrame di output
+            records = self.output_frame.to_dict('records') if self.output_frame is not None else []
+        currency_columns = set(Config.CURRENCY_COLUMNS)
+        return [{key: value / 100 if key in currency_columns else value for key, value in record.items()}
+                for record in records]
     
     def get_statistics(self) -> Dict:
         """Restituisce le statistiche elaborate."""
         return self.stats.copy()
+    
+    def get_source_statistics(self) -> Dict:
+        """Restituisce righe, IMEI validi/invalidi e duplicati per sorgente."""
+        return {source: data.copy() for source, data in self.source_stats.items()}
+    
+    def get_summary_statistics(self) -> Dict:
+        """Restituisce riepilogo, breakdown, utilizzo regole e duplicati calcolati a fine elaborazione."""
+        summary = self.stats_accumulator.full_summary()
+        summary['rule_hits'] = dict(self.rule_hits)
+        summary['key_matches'] = dict(self.key_matches)
+        if self.near_matches is not None:
+            summary['near_matches'] = {
+                'rows': int(self.near_matches.groupby(['ORIGINE', 'IMEI_ORIGINALE', 'RIFERIMENTO']).ngroups),
+                'candidates': len(self.near_matches),
+                'high_confidence': int((self.near_matches['CONFIDENZA'] >= Config.NEAR_MATCH_HIGH_CONFIDENCE).sum())
+            }
+        if self.anomalies is not None:
+            summary['anomalies'] = {
+                'rows': len(self.anomalies),
+                'scopes': {scope: int(rows) for scope, rows in
+                           self.anomalies['AMBITO'].value_counts(sort=False).items()}
+            }
+        summary['data_quality'] = {
+            file_name: profile
+            for source in ('post_vendita', 'ti', 'data')
+            for file_name, profile in self.source_stats.get(source, {}).get('quality', {}).items()
+        }
+        if 'seen_notes' in self.source_stats.get('ti', {}):
+            summary['seen_notes'] = dict(self.source_stats['ti']['seen_notes'])
+        summary['duplicates'] = {
+            source: {
+                'imei': data['duplicate_imei'],
+                'rows': data['duplicate_rows'],
+                'policy': data['duplicate_policy']
+            }
+            for source, data in self.source_stats.items() if 'duplicate_policy' in data
+        }
+        return summary
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Estrazione anomalie (differenze maggiori e dealer non abbinati) per VAR Processor
+"""
+
+import logging
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import Config
+from utils.calculators import CurrencyFormatter
+
+logger = logging.getLogger(__name__)
+
+ANOMALY_COLUMNS = [
+    'AMBITO', 'GRUPPO', 'POSIZIONE', 'IMEI', 'TIPO', 'Ragione sociale Dealer', 'FINANZIARIA',
+    'Causale', 'ID Vendita', 'Numero Nota di Credito', 'Differenza', 'RIGHE'
+]
+
+DETAIL_COLUMNS = ['IMEI', 'Ragione sociale Dealer', 'FINANZIARIA', 'Causale', 'ID Vendita',
+                  'Numero Nota di Credito', 'Differenza']
+
+
+def top_positions(values: np.ndarray, n: int) -> np.ndarray:
+    """
+    Posizioni degli n valori maggiori, in ordine decrescente.
+    
+    Selezione parziale (np.argpartition, lineare): solo gli n selezionati
+    vengono ordinati.
+    
+    Args:
+        values: Valori numerici
+        n: Numero di posizioni
+        
+    Returns:
+        Posizioni ordinate per valore decrescente
+    """
+    if len(values) > n:
+        selected = np.argpartition(values, len(values) - n)[len(values) - n:]
+    else:
+        selected = np.arange(len(values))
+    return selected[np.argsort(-values[selected], kind='stable')]
+
+
+def _blank_groups(values: pd.Series) -> np.ndarray:
+    """Maschera dei gruppi vuoti (riga senza dealer o finanziaria)."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Verifica sulle sole categorie, codice -1 (mancante) sull'ultimo elemento
+        blank = _blank_groups(pd.Series(values.cat.categories))
+        return np.append(blank, True)[values.cat.codes.to_numpy()]
+    return (values.isna() | (values.astype(str).str.strip() == '')).to_numpy()
+
+
+def _ranked_rows(df: pd.DataFrame, selections: List[Tuple[str, str, np.ndarray]]) -> pd.DataFrame:
+    """
+    Righe selezionate con ambito, gruppo e posizione (un solo DataFrame per tutti i gruppi).
+    
+    Args:
+        df: Righe candidate
+        selections: Tuple (ambito, gruppo, posizioni ordinate) per gruppo
+        
+    Returns:
+        Righe selezionate nell'ordine delle selezioni
+    """
+    lengths = [len(positions) for _, _, positions in selections]
+    positions = np.concatenate([positions for _, _, positions in selections])
+    rows = df.iloc[positions]
+    return pd.DataFrame({
+        'AMBITO': np.repeat([scope for scope, _, _ in selections], lengths),
+        'GRUPPO': np.repeat([group for _, group, _ in selections], lengths),
+        'POSIZIONE': np.concatenate([np.arange(1, length + 1) for length in lengths]),
+        'TIPO': rows['_TIPO'].astype(str).to_numpy() if '_TIPO' in rows.columns else '',
+        **{col: rows[col].to_numpy() for col in DETAIL_COLUMNS if col in rows.columns}
+    })
+
+
+def _group_selections(scope: str, groups: pd.Series, magnitude: np.ndarray,
+                      top_n: int, top_groups: Optional[int]) -> List[Tuple[str, str, np.ndarray]]:
+    """
+    Top N righe dei gruppi con la maggiore differenza totale.
+    
+    I gruppi sono classificati per somma di |Differenza| (np.bincount sui
+    codici); solo le righe dei gruppi scelti vengono ordinate, per posizione
+    del gruppo e poi per valore.
+    
+    Args:
+        scope: Ambito (DEALER, FINANZIARIA)
+        groups: Gruppo di ogni riga candidata
+        magnitude: |Differenza| di ogni riga candidata
+        top_n: Righe per gruppo
+        top_groups: Gruppi da includere (None = tutti)
+        
+    Returns:
+        Tuple (ambito, gruppo, posizioni ordinate) in ordine di classifica
+    """
+    filled = np.flatnonzero(~_blank_groups(groups))
+    codes, labels = pd.factorize(groups.iloc[filled], sort=True)
+    if not len(labels):
+        return []
+    
+    totals = np.bincount(codes, weights=magnitude[filled], minlength=len(labels))
+    ranked = top_positions(totals, len(labels) if top_groups is None else top_groups)
+    rank = np.full(len(labels), -1)
+    rank[ranked] = np.arange(len(ranked))
+    
+    member = rank[codes] >= 0
+    rows = filled[member]
+    row_rank = rank[codes[member]]
+    order = np.lexsort((-magnitude[rows], row_rank))
+    rows, row_rank = rows[order], row_rank[order]
+    
+    # Posizione nel gruppo: distanza dall'inizio del proprio blocco
+    starts = np.searchsorted(row_rank, np.arange(len(ranked)))
+    keep = np.arange(len(rows)) - starts[row_rank] < top_n
+    rows, row_rank = rows[keep], row_rank[keep]
+    bounds = np.searchsorted(row_rank, np.arange(len(ranked) + 1))
+    return [(scope, str(labels[code]), rows[bounds[position]:bounds[position + 1]])
+            for position, code in enumerate(ranked)]
+
+
+def extract_anomalies(df_output: pd.DataFrame, top_n: Optional[int] = None) -> pd.DataFrame:
+    """
+    Seleziona le anomalie del report da rivedere per prime.
+    
+    - TOTALE: le top N differenze in valore assoluto
+    - DEALER / FINANZIARIA: le top N differenze dei Config.ANOMALY_TOP_GROUPS
+      dealer e finanziarie con la maggiore differenza totale
+    - DEALER_NON_ABBINATI: i dealer con più note credito solo TI
+    
+    Le selezioni sono parziali e vettoriali, senza ordinare l'intero report
+    né iterare su tutti i gruppi.
+    
+    Args:
+        df_output: DataFrame di output (Differenza in centesimi)
+        top_n: Righe per gruppo (default Config.ANOMALY_TOP_N)
+        
+    Returns:
+        Anomalie con colonne ANOMALY_COLUMNS (Differenza in euro)
+    """
+    top_n = Config.ANOMALY_TOP_N if top_n is None else top_n
+    if df_output is None or df_output.empty or top_n <= 0 or 'Differenza' not in df_output.columns:
+        return pd.DataFrame(columns=ANOMALY_COLUMNS)
+    
+    # Differenze nulle non sono anomalie
+    differences = pd.to_numeric(df_output['Differenza'], errors='coerce').fillna(0).to_numpy()
+    nonzero = np.flatnonzero(differences != 0)
+    df = df_output.iloc[nonzero]
+    magnitude = np.abs(differences[nonzero])
+    
+    selections = [('TOTALE', 'TUTTI', top_positions(magnitude, top_n))]
+    for scope, column in (('DEALER', 'Ragione sociale Dealer'), ('FINANZIARIA', 'FINANZIARIA')):
+        if column in df.columns:
+            selections.extend(_group_selections(scope, df[column], magnitude, top_n,
+                                                Config.ANOMALY_TOP_GROUPS))
+    
+    sections = [_ranked_rows(df, selections), _unmatched_dealers(df_output, top_n)]
+    sections = [section for section in sections if len(section)]
+    if not sections:
+        return pd.DataFrame(columns=ANOMALY_COLUMNS)
+    
+    anomalies = pd.concat(sections, ignore_index=True).reindex(columns=ANOMALY_COLUMNS)
+    anomalies['RIGHE'] = anomalies['RIGHE'].astype('Int64')
+    CurrencyFormatter.cents_columns_to_euros(anomalies, ['Differenza'])
+    logger.info(f"Anomalie: {len(anomalies):,} righe (top {top_n} per ambito)")
+    return anomalies
+
+
+def _unmatched_dealers(df_output: pd.DataFrame, top_n: int) -> pd.DataFrame:
+    """Dealer con più righe solo TI (conteggio hash, selezione parziale dei maggiori)."""
+    if '_TIPO' not in df_output.columns or 'Ragione sociale Dealer' not in df_output.columns:
+        return pd.DataFrame(columns=ANOMALY_COLUMNS)
+    
+    unmatched = df_output[(df_output['_TIPO'].astype(str) == 'TI_ONLY').to_numpy()]
+    dealers = unmatched['Ragione sociale Dealer']
+    unmatched = unmatched[~_blank_groups(dealers)]
+    if unmatched.empty:
+        return pd.DataFrame(columns=ANOMALY_COLUMNS)
+    
+    totals = (unmatched.groupby(unmatched['Ragione sociale Dealer'].astype(str), sort=False)['Differenza']
+              .agg(['size', 'sum']))
+    totals = totals.nlargest(top_n, 'size', keep='first')
+    return pd.DataFrame({
+        'AMBITO': 'DEALER_NON_ABBINATI',
+        'GRUPPO': totals.index.to_numpy(),
+        'POSIZIONE': np.arange(1, len(totals) + 1),
+        'TIPO': 'TI_ONLY',
+        'Ragione sociale Dealer': totals.index.to_numpy(),
+        'Differenza': totals['sum'].to_numpy(),
+        'RIGHE': totals['size'].to_numpy()
+    })
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Archivio storico multi-periodo dei report VAR con indice IMEI
+"""
+
+import os
+import hashlib
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+import pandas as pd
+
+from config import Config
+from utils.calculators import CurrencyFormatter
+from utils.columnar import write_table, read_table, default_suffix
+
+logger = logging.getLogger(__name__)
+
+PERIOD_COLUMN = 'PERIODO'
+RUN_COLUMN = 'RUN'
+INDEX_COLUMNS = ['IMEI', PERIOD_COLUMN, RUN_COLUMN]
+
+
+class ReportArchive:
+    """
+    Archivio colonnare delle righe riconciliate di ogni esecuzione.
+    
+    Layout: <root>/PERIODO=<periodo>/RUN=<fingerprint>.parquet, ogni file
+    ordinato per IMEI. L'indice <root>/imei_index.parquet (IMEI, PERIODO,
+    RUN) è ordinato per IMEI con row group piccoli: un lookup legge solo i
+    blocchi dell'indice e i file dei run che contengono l'IMEI.
+    """
+    
+    def __init__(self, root):
+        """
+        Inizializza l'archivio.
+        
+        Args:
+            root: Directory dell'archivio (creata alla prima scrittura)
+        """
+        self.root = Path(root)
+        self.index_path = self.root / f"{Config.ARCHIVE_INDEX_NAME}{default_suffix()}"
+    
+    @staticmethod
+    def default_period() -> str:
+        """Periodo predefinito (mese corrente)."""
+        return datetime.now().strftime(Config.ARCHIVE_PERIOD_FORMAT)
+    
+    @staticmethod
+    def validate_period(period: str) -> str:
+        """
+        Verifica il formato del periodo.
+        
+        Args:
+            period: Periodo (es. '2025-03')
+            
+        Returns:
+            Periodo verificato
+            
+        Raises:
+            ValueError: Se il formato non è Config.ARCHIVE_PERIOD_FORMAT
+        """
+        try:
+            datetime.strptime(period, Config.ARCHIVE_PERIOD_FORMAT)
+        except (TypeError, ValueError):
+            raise ValueError(f"Periodo non valido: {period} (formato {Config.ARCHIVE_PERIOD_FORMAT})")
+        return period
+    
+    @staticmethod
+    def run_fingerprint(input_files: Iterable[Path], extra: str = '') -> str:
+        """
+        Calcola l'impronta di un'esecuzione dai file di input.
+        
+        Usa nome, dimensione e data di modifica dei file (nessuna lettura del
+        contenuto): rielaborare gli stessi file sostituisce il run archiviato.
+        
+        Args:
+            input_files: File di input dell'esecuzione
+            extra: Ulteriore contesto (es. tabella regole)
+            
+        Returns:
+            Impronta esadecimale (12 caratteri)
+        """
+        digest = hashlib.sha256(extra.encode('utf-8'))
+        for path in sorted(Path(p) for p in input_files):
+            stat = path.stat()
+            digest.update(f"{path.name}|{stat.st_size}|{stat.st_mtime_ns}\n".encode('utf-8'))
+        return digest.hexdigest()[:12]
+    
+    def partition_path(self, period: str, run_id: str) -> Path:
+        """Restituisce il file della partizione di un run."""
+        return self.root / f"{PERIOD_COLUMN}={period}" / f"{RUN_COLUMN}={run_id}{default_suffix()}"
+    
+    def append(self, frame: pd.DataFrame, period: str, run_id: str) -> Path:
+        """
+        Archivia le righe riconciliate di un run e aggiorna l'indice IMEI.
+        
+        Args:
+            frame: DataFrame di output (importi in centesimi, colonna _TIPO)
+            period: Periodo di competenza
+            run_id: Impronta del run (un run già archiviato viene sostituito)
+            
+        Returns:
+            Path della partizione scritta
+        """
+        period = self.validate_period(period)
+        rows = self._prepare_rows(frame, period, run_id)
+        
+        path = self._write_atomic(rows, self.partition_path(period, run_id))
+        self._update_index(rows[INDEX_COLUMNS], period, run_id)
+        
+        logger.info(f"Archivio: {len(rows):,} righe in {path.relative_to(self.root)} "
+                    f"(periodo {period}, run {run_id})")
+        return path
+    
+    def lookup(self, imeis: Iterable[str], columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Estrae lo storico degli IMEI da tutti i run archiviati.
+        
+        Args:
+            imeis: IMEI da cercare
+            columns: Colonne da restituire (None = tutte)
+            
+        Returns:
+            DataFrame ordinato per IMEI e periodo (vuoto se nessun risultato)
+        """
+        imeis = sorted({str(imei).strip() for imei in imeis})
+        if not imeis or not self.index_path.exists():
+            return pd.DataFrame(columns=columns or INDEX_COLUMNS)
+        
+        hits = read_table(self.index_path, columns=INDEX_COLUMNS, filters={'IMEI': imeis})
+        if hits.empty:
+            return pd.DataFrame(columns=columns or INDEX_COLUMNS)
+        
+        read_columns = None
+        if columns is not None:
+            read_columns = list(dict.fromkeys(INDEX_COLUMNS + list(columns)))
+        
+        frames = []
+        runs = hits[[PERIOD_COLUMN, RUN_COLUMN]].astype(str).drop_duplicates()
+        for period, run_id in runs.itertuples(index=False):
+            path = self.partition_path(period, run_id)
+            if not path.exists():
+                logger.warning(f"Archivio: partizione mancante {path} (indice non aggiornato?)")
+                continue
+            frames.append(read_table(path, columns=read_columns, filters={'IMEI': imeis}))
+        
+        if not frames:
+            return pd.DataFrame(columns=columns or INDEX_COLUMNS)
+        
+        result = pd.concat(frames, ignore_index=True)
+        result = result.sort_values(INDEX_COLUMNS, kind='stable').reset_index(drop=True)
+        return result[columns] if columns is not None else result
+    
+    def _prepare_rows(self, frame: pd.DataFrame, period: str, run_id: str) -> pd.DataFrame:
+        """Seleziona le colonne di output, converte gli importi in euro e ordina per IMEI."""
+        columns = [col for col in Config.get_output_columns() if col in frame.columns]
+        rows = frame[columns].copy()
+        if '_TIPO' in frame.columns:
+            rows['TIPO'] = frame['_TIPO'].astype(str)
+        
+        CurrencyFormatter.cents_columns_to_euros(rows, Config.CURRENCY_COLUMNS)
+        if 'Data Scarico' in rows.columns:
+            rows['Data Scarico'] = pd.to_datetime(rows['Data Scarico'], errors='coerce')
+        
+        # Testo misto (numeri, stringhe, NaN) reso uniforme per lo schema colonnare
+        for col in rows.columns:
+            if pd.api.types.is_object_dtype(rows[col].dtype):
+                rows[col] = rows[col].where(rows[col].notna(), '').astype(str)
+        
+        rows['IMEI'] = rows['IMEI'].astype(str)
+        rows[PERIOD_COLUMN] = period
+        rows[RUN_COLUMN] = run_id
+        return rows.sort_values('IMEI', kind='stable').reset_index(drop=True)
+    
+    def _update_index(self, entries: pd.DataFrame, period: str, run_id: str) -> None:
+        """Sostituisce le voci del run nell'indice e lo riscrive ordinato per IMEI."""
+        frames = [entries]
+        if self.index_path.exists():
+            index = read_table(self.index_path, columns=INDEX_COLUMNS).astype(str)
+            index = index[(index[PERIOD_COLUMN] != period) | (index[RUN_COLUMN] != run_id)]
+            frames.insert(0, index)
+        
+        index = pd.concat(frames, ignore_index=True).sort_values(INDEX_COLUMNS, kind='stable')
+        
+        self._write_atomic(index, self.index_path)
+    
+    @staticmethod
+    def _write_atomic(rows: pd.DataFrame, path: Path) -> Path:
+        """
+        Scrive un file dell'archivio su un file temporaneo e lo rinomina.
+        
+        Un lookup concorrente o un'interruzione a metà scrittura non lasciano
+        mai un file troncato al path definitivo.
+        
+        Args:
+            rows: Righe da scrivere
+            path: Path definitivo
+            
+        Returns:
+            Path scritto
+        """
+        tmp_path = path.with_name(f"{path.stem}.tmp{path.suffix}")
+        try:
+            write_table(rows, tmp_path, row_group_size=Config.ARCHIVE_ROW_GROUP_SIZE)
+            os.replace(tmp_path, path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        return path
+    
+    @staticmethod
+    def archive_dir_for(report_path) -> Path:
+        """Restituisce la directory archivio predefinita associata a un report."""
+        return Path(report_path).parent / Config.ARCHIVE_DEFAULT_DIR
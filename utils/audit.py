@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Audit trail colonnare dei calcoli differenza per VAR Processor
+"""
+
+import logging
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+import pandas as pd
+
+from config import Config
+from utils.calculators import CurrencyFormatter
+from utils.columnar import BatchTableWriter, read_table, default_suffix
+
+logger = logging.getLogger(__name__)
+
+AUDIT_COLUMNS = [
+    'IMEI', 'TIPO', 'METODO', 'CAUSALE', 'FINANZIARIA',
+    'IMPORTO_ORIGINALE', 'IMPORTO_CREDITO', 'IMPORTO_NDC',
+    'FINANZIATO_WIND', 'FINANZIATO_POST', 'DIFFERENZA'
+]
+
+AMOUNT_AUDIT_COLUMNS = AUDIT_COLUMNS[5:]
+
+# Colonna audit -> colonna del DataFrame di output (record_frame)
+FRAME_AUDIT_COLUMNS = {
+    'IMEI': 'IMEI',
+    'TIPO': '_TIPO',
+    'CAUSALE': 'Causale',
+    'FINANZIARIA': 'FINANZIARIA',
+    'IMPORTO_ORIGINALE': 'W-Importo Originale',
+    'IMPORTO_CREDITO': 'B-IMPORTO CREDITO',
+    'IMPORTO_NDC': 'B-IMPORTO NDC',
+    'FINANZIATO_WIND': 'W-Finanziato Wind',
+    'FINANZIATO_POST': 'B-IMPORTO FINANZIATO',
+    'DIFFERENZA': 'Differenza'
+}
+
+
+class CalculationAuditWriter:
+    """
+    Registra ogni calcolo differenza come riga di un file colonnare.
+    
+    Le righe sono accumulate in memoria come tuple e scritte a blocchi di
+    Config.AUDIT_BATCH_SIZE righe: nessuna formattazione stringa per record.
+    Gli importi sono ricevuti in centesimi e scritti in euro.
+    """
+    
+    def __init__(self, output_path, batch_size: int = None):
+        """
+        Inizializza l'audit trail.
+        
+        Args:
+            output_path: Path del file (.parquet o .csv)
+            batch_size: Righe per blocco (default Config.AUDIT_BATCH_SIZE)
+        """
+        self.batch_size = batch_size or Config.AUDIT_BATCH_SIZE
+        self._writer = BatchTableWriter(output_path)
+        self._buffer: List[tuple] = []
+        self.path = self._writer.path
+    
+    def record(self, imei: str, tipo: str, metodo: str, causale: str, finanziaria: str,
+               importo_originale: int, importo_credito: int, importo_ndc: int,
+               finanziato_wind: int, finanziato_post: int, differenza: int) -> None:
+        """Accoda un calcolo all'audit trail (importi in centesimi)."""
+        self._buffer.append((imei, tipo, metodo, causale, finanziaria,
+                             importo_originale, importo_credito, importo_ndc,
+                             finanziato_wind, finanziato_post, differenza))
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+    
+    def record_frame(self, frame: pd.DataFrame, methods) -> None:
+        """
+        Registra in blocco i calcoli di un DataFrame di output.
+        
+        Args:
+            frame: DataFrame di output (importi in centesimi)
+            methods: Nome regola applicata per riga (stessa lunghezza del frame)
+        """
+        self.flush()
+        batch = pd.DataFrame({column: frame[source] for column, source in FRAME_AUDIT_COLUMNS.items()
+                              if source in frame.columns}).reset_index(drop=True)
+        batch['METODO'] = methods
+        batch = batch.reindex(columns=AUDIT_COLUMNS)
+        CurrencyFormatter.cents_columns_to_euros(batch, AMOUNT_AUDIT_COLUMNS)
+        
+        for start in range(0, len(batch), self.batch_size):
+            self._writer.write_batch(batch.iloc[start:start + self.batch_size])
+    
+    def flush(self) -> None:
+        """Scrive il blocco corrente su disco."""
+        if not self._buffer:
+            return
+        batch = pd.DataFrame.from_records(self._buffer, columns=AUDIT_COLUMNS)
+        self._buffer = []
+        CurrencyFormatter.cents_columns_to_euros(batch, AMOUNT_AUDIT_COLUMNS)
+        self._writer.write_batch(batch)
+    
+    def close(self) -> Path:
+        """
+        Scrive le righe residue e chiude il file.
+        
+        Returns:
+            Path del file di audit
+        """
+        self.flush()
+        self._writer.close()
+        logger.info(f"Audit calcoli salvato: {self.path} ({self._writer.rows_written:,} righe)")
+        return self.path
+    
+    @property
+    def rows_written(self) -> int:
+        """Righe scritte finora (escluse quelle in buffer)."""
+        return self._writer.rows_written
+    
+    @staticmethod
+    def query(audit_path, imeis: Optional[Iterable[str]] = None,
+              methods: Optional[Iterable[str]] = None,
+              columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Interroga un file di audit.
+        
+        Args:
+            audit_path: Path del file di audit
+            imeis: IMEI da estrarre (None = tutti)
+            methods: Metodi di calcolo da estrarre (None = tutti)
+            columns: Colonne da leggere (None = tutte)
+            
+        Returns:
+            DataFrame con le righe corrispondenti
+        """
+        filters = {}
+        if imeis is not None:
+            filters['IMEI'] = [str(imei) for imei in imeis]
+        if methods is not None:
+            filters['METODO'] = list(methods)
+        return read_table(audit_path, columns=columns, filters=filters)
+    
+    @staticmethod
+    def audit_path_for(report_path) -> Path:
+        """Restituisce il path di audit predefinito associato a un report."""
+        report_path = Path(report_path)
+        return report_path.with_name(f"{report_path.stem}{Config.AUDIT_SUFFIX}{default_suffix()}")
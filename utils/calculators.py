@@ -4,7 +4,7 @@ Utilities per calcoli VAR Processor
 """
 
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
 from config import Config
 
 logger = logging.getLogger(__name__)
@@ -16,11 +16,12 @@ class DifferenceCalculator:
     def calculate(causale: str, finanziaria: str, 
                  importo_originale: float, importo_credito: float, 
                  importo_ndc: float, importo_finanziato_wind: float, 
-                 importo_finanziato_post: float) -> float:
+                 importo_finanziato_post: float, rule_set=None, tipo: str = '',
+                 in_cents: bool = False) -> float:
         """
         Calcola la differenza basata su causale e finanziaria.
         
-        Logica prioritaria:
+        Logica prioritaria (regole predefinite, configurabili in difference_rules.yaml):
         1. Se FINANZIARIA = "FINDOMESTIC" o "COMPASS" -> W-Finanziato Wind - B-IMPORTO FINANZIATO
         2. Se Causale = "TEL_INCLUSO" -> W-Importo Originale - B-IMPORTO CREDITO  
         3. Se Causale = "PROMOCASH" -> W-Importo Originale - B-IMPORTO NDC
@@ -34,69 +35,218 @@ class DifferenceCalculator:
             importo_ndc: Importo NDC da post vendita
             importo_finanziato_wind: Importo finanziato da data.xlsx
             importo_finanziato_post: Importo finanziato da post vendita
+            rule_set: Tabella regole (default get_rule_set(); VARProcessor.rules con --rules)
+            tipo: Tipo record (MATCHED, POST_VENDITA_ONLY, TI_ONLY) per le condizioni 'tipo'
+            in_cents: True se gli importi sono in centesimi interi (risultato esatto)
             
         Returns:
             Differenza calcolata
         """
+        return DifferenceCalculator.calculate_with_method(
+            causale, finanziaria, importo_originale, importo_credito,
+            importo_ndc, importo_finanziato_wind, importo_finanziato_post, rule_set, tipo, in_cents
+        )[0]
+    
+    @staticmethod
+    def calculate_with_method(causale: str, finanziaria: str, 
+                              importo_originale: float, importo_credito: float, 
+                              importo_ndc: float, importo_finanziato_wind: float, 
+                              importo_finanziato_post: float, rule_set=None,
+                              tipo: str = '', in_cents: bool = False) -> Tuple[float, str]:
+        """
+        Calcola la differenza e restituisce anche il metodo applicato.
         
-        # Priorità 1: Logica finanziaria
-        if finanziaria in Config.FINANZIARIE_PRIORITY:
-            result = importo_finanziato_wind - importo_finanziato_post
-            logger.debug(f"Differenza finanziaria {finanziaria}: {importo_finanziato_wind} - {importo_finanziato_post} = {result}")
-            return result
-        
-        # Priorità 2: Logica causale
-        if causale == Config.CAUSALE_TEL_INCLUSO:
-            result = importo_originale - importo_credito
-            logger.debug(f"Differenza TEL_INCLUSO: {importo_originale} - {importo_credito} = {result}")
-            return result
-        elif causale == Config.CAUSALE_PROMOCASH:
-            result = importo_originale - importo_ndc
-            logger.debug(f"Differenza PROMOCASH: {importo_originale} - {importo_ndc} = {result}")
-            return result
+        Usa la tabella regole indicata, la stessa del calcolo vettoriale
+        (default quella configurata, Config.DIFFERENCE_RULES_FILE). Nessun
+        log per record: il dettaglio dei calcoli è registrato nell'audit
+        trail colonnare (CalculationAuditWriter). Gli importi sono in euro
+        o, con in_cents, in centesimi interi (stessa unità per tutti,
+        costanti delle formule convertite): con i centesimi il risultato è
+        esatto e coincide con il calcolo vettoriale.
         
-        # Default
-        result = importo_originale - importo_credito
-        logger.debug(f"Differenza default: {importo_originale} - {importo_credito} = {result}")
-        return result
+        Returns:
+            Tuple con (differenza, nome regola applicata)
+        """
+        rule = DifferenceCalculator._rule_set(rule_set).match(finanziaria, causale, tipo)
+        differenza = rule.formula.evaluate_scalar({
+            'importo_originale': importo_originale,
+            'importo_credito': importo_credito,
+            'importo_ndc': importo_ndc,
+            'importo_finanziato_wind': importo_finanziato_wind,
+            'importo_finanziato_post': importo_finanziato_post
+        }, in_cents=in_cents)
+        return differenza, rule.name
     
     @staticmethod
-    def get_calculation_method(causale: str, finanziaria: str) -> str:
+    def get_calculation_method(causale: str, finanziaria: str, rule_set=None, tipo: str = '') -> str:
         """
         Restituisce il metodo di calcolo utilizzato.
         
         Args:
             causale: Causale del record
             finanziaria: Tipo finanziaria
+            rule_set: Tabella regole (default get_rule_set(); VARProcessor.rules con --rules)
+            tipo: Tipo record per le condizioni 'tipo'
             
         Returns:
-            Stringa descrittiva del metodo
-        """
-        if finanziaria in Config.FINANZIARIE_PRIORITY:
-            return f"FINANZIARIA_{finanziaria}"
-        elif causale == Config.CAUSALE_TEL_INCLUSO:
-            return "CAUSALE_TEL_INCLUSO"
-        elif causale == Config.CAUSALE_PROMOCASH:
-            return "CAUSALE_PROMOCASH"
-        else:
-            return "DEFAULT"
+            Nome della regola applicata (es. FINANZIARIA_FINDOMESTIC, DEFAULT)
+        """
+        return DifferenceCalculator._rule_set(rule_set).match(finanziaria, causale, tipo).name
+    
+    @staticmethod
+    def _rule_set(rule_set=None):
+        """Tabella regole indicata o, se assente, quella configurata."""
+        if rule_set is not None:
+            return rule_set
+        from utils.rules import get_rule_set
+        return get_rule_set()
 
 
-class StatisticsCalculator:
-    """Calcolatore per statistiche elaborate."""
+class StatisticsAccumulator:
+    """
+    Accumulatore incrementale per statistiche elaborate.
+    
+    Può essere aggiornato record per record (add) o con un intero DataFrame
+    di output (add_frame, groupby vettoriali sulle colonne categoriche) e
+    fornisce riepilogo, breakdown finanziarie e breakdown causali.
+    
+    Totali, minimi e massimi sono accumulati in centesimi interi (somme
+    esatte, nessuna deriva float); la conversione in euro avviene solo nel
+    riepilogo.
+    """
+    
+    FINANCIAL_KEYS = ['FINDOMESTIC', 'COMPASS', 'VAR']
+    
+    def __init__(self):
+        """Inizializza contatori vuoti."""
+        self.total_records = 0
+        self.type_counts = {}
+        self.total_cents = 0
+        self.min_cents = None
+        self.max_cents = None
+        self.financial = {key: {'count': 0, 'total_cents': 0} 
+                          for key in self.FINANCIAL_KEYS + ['ALTRI']}
+        self.causali = {}
+    
+    @property
+    def total_difference(self) -> float:
+        """Somma delle differenze in euro."""
+        return self.total_cents / 100
+    
+    def add(self, record: Dict, in_cents: bool = False) -> None:
+        """
+        Aggiorna le statistiche con un record di output.
+        
+        Args:
+            record: Record di output (formato colonne Excel)
+            in_cents: Se True la Differenza del record è già in centesimi
+        """
+        differenza = record.get('Differenza', 0)
+        cents = int(differenza) if in_cents else CurrencyFormatter.to_cents(differenza)
+        
+        self.total_records += 1
+        record_type = record.get('_TIPO', 'UNKNOWN')
+        self.type_counts[record_type] = self.type_counts.get(record_type, 0) + 1
+        
+        # Differenze
+        self.total_cents += cents
+        if self.min_cents is None or cents < self.min_cents:
+            self.min_cents = cents
+        if self.max_cents is None or cents > self.max_cents:
+            self.max_cents = cents
+        
+        # Breakdown finanziarie
+        finanziaria = record.get('FINANZIARIA', '').upper()
+        bucket = self.financial.get(finanziaria, self.financial['ALTRI'])
+        bucket['count'] += 1
+        bucket['total_cents'] += cents
+        
+        # Breakdown causali
+        causale = record.get('Causale', 'VUOTO').upper()
+        bucket = self.causali.get(causale)
+        if bucket is None:
+            bucket = self.causali[causale] = {'count': 0, 'total_cents': 0}
+        bucket['count'] += 1
+        bucket['total_cents'] += cents
+    
+    def add_frame(self, df, in_cents: bool = False) -> 'StatisticsAccumulator':
+        """
+        Aggiorna le statistiche con un DataFrame di record di output.
+        
+        I breakdown sono calcolati con groupby sulle colonne FINANZIARIA e
+        Causale (codici interi se categoriche); la normalizzazione in
+        maiuscolo avviene solo sui valori distinti.
+        
+        Args:
+            df: DataFrame con colonne Differenza, _TIPO, FINANZIARIA, Causale
+            in_cents: Se True la colonna Differenza è già in centesimi int64
+            
+        Returns:
+            L'accumulatore stesso (per concatenazione)
+        """
+        if df.empty:
+            return self
+        
+        if in_cents:
+            differenze = df['Differenza'].astype('int64')
+        else:
+            differenze = CurrencyFormatter.series_to_cents(df['Differenza'])
+        self.total_records += len(df)
+        
+        for record_type, (count, _) in self._group_totals(df, '_TIPO', 'UNKNOWN', differenze):
+            self.type_counts[record_type] = self.type_counts.get(record_type, 0) + count
+        
+        # Differenze
+        self.total_cents += int(differenze.sum())
+        frame_min, frame_max = int(differenze.min()), int(differenze.max())
+        if self.min_cents is None or frame_min < self.min_cents:
+            self.min_cents = frame_min
+        if self.max_cents is None or frame_max > self.max_cents:
+            self.max_cents = frame_max
+        
+        # Breakdown finanziarie
+        for finanziaria, (count, total) in self._group_totals(df, 'FINANZIARIA', '', differenze):
+            bucket = self.financial.get(finanziaria.upper(), self.financial['ALTRI'])
+            bucket['count'] += count
+            bucket['total_cents'] += total
+        
+        # Breakdown causali
+        for causale, (count, total) in self._group_totals(df, 'Causale', 'VUOTO', differenze):
+            bucket = self.causali.get(causale.upper())
+            if bucket is None:
+                bucket = self.causali[causale.upper()] = {'count': 0, 'total_cents': 0}
+            bucket['count'] += count
+            bucket['total_cents'] += total
+        
+        return self
     
     @staticmethod
-    def calculate_summary(output_records: list) -> Dict[str, Any]:
+    def _group_totals(df, column: str, default: str, differenze) -> list:
+        """Restituisce [(valore, (conteggio, somma centesimi))] per i valori di una colonna."""
+        if column not in df.columns:
+            return [(default, (len(df), int(differenze.sum())))]
+        
+        grouped = differenze.groupby(df[column], observed=True, sort=False).agg(['count', 'sum'])
+        return [(str(key), (int(count), int(total)))
+                for key, count, total in zip(grouped.index, grouped['count'], grouped['sum'])]
+    
+    def add_records(self, output_records: list) -> 'StatisticsAccumulator':
         """
-        Calcola statistiche riepilogative.
+        Aggiorna le statistiche con una lista di record.
         
         Args:
             output_records: Lista record di output
             
         Returns:
-            Dict con statistiche complete
+            L'accumulatore stesso (per concatenazione)
         """
-        if not output_records:
+        for record in output_records:
+            self.add(record)
+        return self
+    
+    def summary(self) -> Dict[str, Any]:
+        """Restituisce le statistiche riepilogative (formato calculate_summary)."""
+        if not self.total_records:
             return {
                 'total_records': 0,
                 'matched': 0,
@@ -108,29 +258,51 @@ class StatisticsCalculator:
                 'max_difference': 0.0
             }
         
-        # Conta per tipo
-        matched = sum(1 for r in output_records if r.get('_TIPO') == 'MATCHED')
-        pv_only = sum(1 for r in output_records if r.get('_TIPO') == 'POST_VENDITA_ONLY')
-        ti_only = sum(1 for r in output_records if r.get('_TIPO') == 'TI_ONLY')
-        
-        # Calcoli differenze
-        differences = [r.get('Differenza', 0) for r in output_records]
-        total_diff = sum(differences)
-        avg_diff = total_diff / len(differences) if differences else 0
-        min_diff = min(differences) if differences else 0
-        max_diff = max(differences) if differences else 0
-        
         return {
-            'total_records': len(output_records),
-            'matched': matched,
-            'post_vendita_only': pv_only,
-            'ti_only': ti_only,
-            'total_difference': round(total_diff, 2),
-            'avg_difference': round(avg_diff, 2),
-            'min_difference': round(min_diff, 2),
-            'max_difference': round(max_diff, 2)
+            'total_records': self.total_records,
+            'matched': self.type_counts.get('MATCHED', 0),
+            'post_vendita_only': self.type_counts.get('POST_VENDITA_ONLY', 0),
+            'ti_only': self.type_counts.get('TI_ONLY', 0),
+            'total_difference': self.total_cents / 100,
+            'avg_difference': round(self.total_cents / self.total_records / 100, 2),
+            'min_difference': self.min_cents / 100,
+            'max_difference': self.max_cents / 100
         }
     
+    def financial_breakdown(self) -> Dict[str, Any]:
+        """Restituisce il breakdown per tipo finanziaria."""
+        return {key: {'count': data['count'], 'total_diff': data['total_cents'] / 100}
+                for key, data in self.financial.items()}
+    
+    def causale_breakdown(self) -> Dict[str, Any]:
+        """Restituisce il breakdown per causale."""
+        return {key: {'count': data['count'], 'total_diff': data['total_cents'] / 100}
+                for key, data in self.causali.items()}
+    
+    def full_summary(self) -> Dict[str, Any]:
+        """Restituisce riepilogo completo con breakdown (formato print_summary)."""
+        stats = self.summary()
+        stats['financial_breakdown'] = self.financial_breakdown()
+        stats['causale_breakdown'] = self.causale_breakdown()
+        return stats
+
+
+class StatisticsCalculator:
+    """Calcolatore per statistiche elaborate."""
+    
+    @staticmethod
+    def calculate_summary(output_records: list) -> Dict[str, Any]:
+        """
+        Calcola statistiche riepilogative.
+        
+        Args:
+            output_records: Lista record di output
+            
+        Returns:
+            Dict con statistiche complete
+        """
+        return StatisticsAccumulator().add_records(output_records).summary()
+    
     @staticmethod
     def calculate_financial_breakdown(output_records: list) -> Dict[str, Any]:
         """
@@ -142,29 +314,7 @@ class StatisticsCalculator:
         Returns:
             Dict con breakdown finanziarie
         """
-        breakdown = {
-            'FINDOMESTIC': {'count': 0, 'total_diff': 0.0},
-            'COMPASS': {'count': 0, 'total_diff': 0.0},
-            'VAR': {'count': 0, 'total_diff': 0.0},
-            'ALTRI': {'count': 0, 'total_diff': 0.0}
-        }
-        
-        for record in output_records:
-            finanziaria = record.get('FINANZIARIA', '').upper()
-            differenza = record.get('Differenza', 0)
-            
-            if finanziaria in breakdown:
-                breakdown[finanziaria]['count'] += 1
-                breakdown[finanziaria]['total_diff'] += differenza
-            else:
-                breakdown['ALTRI']['count'] += 1
-                breakdown['ALTRI']['total_diff'] += differenza
-        
-        # Arrotonda valori
-        for key in breakdown:
-            breakdown[key]['total_diff'] = round(breakdown[key]['total_diff'], 2)
-        
-        return breakdown
+        return StatisticsAccumulator().add_records(output_records).financial_breakdown()
     
     @staticmethod
     def calculate_causale_breakdown(output_records: list) -> Dict[str, Any]:
@@ -177,27 +327,96 @@ class StatisticsCalculator:
         Returns:
             Dict con breakdown causali
         """
-        breakdown = {}
+        return StatisticsAccumulator().add_records(output_records).causale_breakdown()
+    
+    @staticmethod
+    def calculate_all(output_records: list) -> Dict[str, Any]:
+        """
+        Calcola riepilogo e breakdown in un singolo passaggio.
         
-        for record in output_records:
-            causale = record.get('Causale', 'VUOTO').upper()
-            differenza = record.get('Differenza', 0)
-            
-            if causale not in breakdown:
-                breakdown[causale] = {'count': 0, 'total_diff': 0.0}
+        Args:
+            output_records: Lista record di output
             
-            breakdown[causale]['count'] += 1
-            breakdown[causale]['total_diff'] += differenza
-        
-        # Arrotonda valori
-        for key in breakdown:
-            breakdown[key]['total_diff'] = round(breakdown[key]['total_diff'], 2)
-        
-        return breakdown
+        Returns:
+            Dict con statistiche complete e breakdown
+        """
+        return StatisticsAccumulator().add_records(output_records).full_summary()
 
 
 class CurrencyFormatter:
-    """Formattatore per valori monetari."""
+    """
+    Formattatore per valori monetari.
+    
+    Gli importi sono convertiti in centesimi interi (int64) all'ingestione:
+    differenze e totali usano aritmetica intera esatta e la conversione in
+    euro avviene solo in output.
+    """
+    
+    @staticmethod
+    def to_cents(value) -> int:
+        """
+        Converte un importo in euro in centesimi interi.
+        
+        Args:
+            value: Importo in euro (None/NaN/non numerico = 0)
+            
+        Returns:
+            Centesimi
+        """
+        try:
+            if value is None or pd.isna(value):
+                return 0
+            return int(round(float(value) * 100))
+        except (ValueError, TypeError):
+            return 0
+    
+    @staticmethod
+    def series_to_cents(series: 'pd.Series', absolute: bool = False) -> 'pd.Series':
+        """
+        Converte una colonna di importi in euro in centesimi int64 (vettoriale).
+        
+        Args:
+            series: Importi in euro (valori non numerici = 0)
+            absolute: Se True usa il valore assoluto
+            
+        Returns:
+            Serie int64 di centesimi
+        """
+        values = pd.to_numeric(series, errors='coerce').astype(float).fillna(0.0)
+        if absolute:
+            values = values.abs()
+        return (values * 100).round().astype('int64')
+    
+    @staticmethod
+    def convert_columns_to_cents(df, columns: list, absolute: bool = False) -> list:
+        """
+        Converte in place le colonne importo presenti in centesimi int64.
+        
+        Args:
+            df: DataFrame da convertire
+            columns: Colonne importo (quelle assenti sono ignorate)
+            absolute: Se True usa il valore assoluto
+            
+        Returns:
+            Colonne convertite
+        """
+        converted = [col for col in columns if col in df.columns]
+        for col in converted:
+            df[col] = CurrencyFormatter.series_to_cents(df[col], absolute=absolute)
+        return converted
+    
+    @staticmethod
+    def cents_columns_to_euros(df, columns: list) -> None:
+        """
+        Converte in place colonne in centesimi in euro (vettoriale).
+        
+        Args:
+            df: DataFrame da convertire
+            columns: Colonne in centesimi
+        """
+        for col in columns:
+            if col in df.columns:
+                df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype('int64') / 100
     
     @staticmethod
     def format_value(value: float, decimals: int = 2) -> float:
@@ -219,7 +438,7 @@ class CurrencyFormatter:
     @staticmethod
     def format_currency_columns(df, currency_columns: list) -> None:
         """
-        Formatta colonne valute in un DataFrame.
+        Formatta colonne valute in un DataFrame (arrotondamento vettoriale).
         
         Args:
             df: DataFrame da formattare
@@ -227,7 +446,7 @@ class CurrencyFormatter:
         """
         for col in currency_columns:
             if col in df.columns:
-                df[col] = df[col].apply(CurrencyFormatter.format_value)
+                df[col] = pd.to_numeric(df[col], errors='coerce').astype(float).fillna(0.0).round(2)
     
     @staticmethod
     def format_for_display(value: float, currency: str = "EUR") -> str:
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Dictionary encoding (pandas categorical) dei campi testuali ripetuti per VAR Processor
+"""
+
+import logging
+from typing import List, Optional
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def _is_text(series: pd.Series) -> bool:
+    """Indica se la colonna contiene testo (object o stringa pandas/Arrow)."""
+    return pd.api.types.is_object_dtype(series.dtype) or pd.api.types.is_string_dtype(series.dtype)
+
+
+def encode_categorical(df: pd.DataFrame, columns: List[str],
+                       max_ratio: Optional[float] = None) -> List[str]:
+    """
+    Converte in categorical (in place) le colonne testuali a bassa cardinalità.
+    
+    Ogni valore distinto è memorizzato una sola volta: anche i dict costruiti
+    dalle righe condividono lo stesso oggetto stringa invece di una copia per
+    riga. Le colonne con troppi valori distinti restano invariate.
+    
+    Args:
+        df: DataFrame da convertire
+        columns: Colonne candidate (quelle assenti sono ignorate)
+        max_ratio: Rapporto massimo valori distinti / righe (default Config.CATEGORICAL_MAX_RATIO)
+        
+    Returns:
+        Colonne convertite
+    """
+    if not Config.ENABLE_CATEGORICAL or df.empty:
+        return []
+    
+    max_ratio = Config.CATEGORICAL_MAX_RATIO if max_ratio is None else max_ratio
+    max_distinct = max(1, int(len(df) * max_ratio))
+    
+    converted = []
+    for col in columns:
+        if col not in df.columns:
+            continue
+        series = df[col]
+        if isinstance(series.dtype, pd.CategoricalDtype) or not _is_text(series):
+            continue
+        if series.nunique(dropna=True) > max_distinct:
+            continue
+        df[col] = series.astype('category')
+        converted.append(col)
+    
+    if converted:
+        logger.debug(f"Colonne categoriche: {converted}")
+    return converted
+
+
+def concat_categorical(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Concatena DataFrame mantenendo le colonne categoriche.
+    
+    pd.concat converte in object le colonne categoriche con categorie diverse:
+    qui le categorie vengono prima unificate per ogni colonna.
+    
+    Args:
+        frames: DataFrame da concatenare
+        
+    Returns:
+        DataFrame combinato
+    """
+    if len(frames) > 1:
+        for col in frames[0].columns:
+            if not all(col in frame.columns and isinstance(frame[col].dtype, pd.CategoricalDtype)
+                       for frame in frames):
+                continue
+            categories = union_categoricals([frame[col] for frame in frames], ignore_order=True).categories
+            for frame in frames:
+                frame[col] = frame[col].cat.set_categories(categories)
+    
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Checkpoint delle fasi di elaborazione per la ripresa (--resume)
+"""
+
+import os
+import json
+import pickle
+import shutil
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import pandas as pd
+
+from config import Config
+from utils.columnar import write_table, read_table, HAS_PYARROW, PARQUET_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+PICKLE_SUFFIX = '.pkl'
+
+
+class StageCheckpoint:
+    """
+    Snapshot delle fasi completate di un run, indicizzati per impronta input.
+    
+    Layout: <root>/<impronta>/manifest.json (fasi completate in ordine, stato
+    leggero in JSON) più uno snapshot colonnare per DataFrame
+    (<fase>__<nome>.parquet). I DataFrame non rappresentabili in Parquet
+    (colonne con tipi misti) o senza pyarrow sono salvati serializzati.
+    """
+    
+    def __init__(self, root, run_id: str, settings: Optional[Dict] = None):
+        """
+        Apre i checkpoint di un run.
+        
+        Args:
+            root: Directory dei checkpoint
+            run_id: Impronta dei file di input (ReportArchive.run_fingerprint)
+            settings: Impostazioni che influenzano i risultati delle fasi; un
+                checkpoint salvato con impostazioni diverse non viene ripreso
+        """
+        self.root = Path(root)
+        self.run_id = run_id
+        self.directory = self.root / run_id
+        self.manifest_path = self.directory / MANIFEST_NAME
+        self.settings = settings or {}
+        self.manifest = {'run_id': run_id, 'settings': self.settings, 'stages': {}}
+    
+    @staticmethod
+    def default_dir(input_dir) -> Path:
+        """Directory checkpoint predefinita (accanto ai file di input)."""
+        return Path(input_dir) / Config.CHECKPOINT_DEFAULT_DIR
+    
+    def load(self) -> bool:
+        """
+        Carica il manifest salvato da un run precedente.
+        
+        Returns:
+            True se esiste un checkpoint compatibile con le impostazioni correnti
+        """
+        if not self.manifest_path.exists():
+            return False
+        
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Checkpoint {self.manifest_path} illeggibile ({e}): ripartenza da zero")
+            return False
+        
+        if manifest.get('settings') != json.loads(json.dumps(self.settings)):
+            logger.warning("Checkpoint salvato con impostazioni diverse: ripartenza da zero")
+            return False
+        
+        self.manifest = manifest
+        return True
+    
+    @property
+    def stages(self) -> list:
+        """Fasi completate in ordine di esecuzione."""
+        return list(self.manifest['stages'])
+    
+    def completed(self, stage: str) -> bool:
+        """Verifica se una fase è stata salvata."""
+        return stage in self.manifest['stages']
+    
+    def save(self, stage: str, frames: Optional[Dict[str, pd.DataFrame]] = None,
+             state: Optional[Dict] = None) -> None:
+        """
+        Salva il risultato di una fase e aggiorna il manifest.
+        
+        Args:
+            stage: Nome della fase
+            frames: DataFrame della fase per nome (None = esclusi)
+            state: Stato leggero serializzabile in JSON
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        
+        files = {}
+        for name, frame in (frames or {}).items():
+            if frame is not None:
+                files[name] = self._write_frame(frame, f"{stage}__{name}")
+        
+        self.manifest['stages'][stage] = {
+            'files': files,
+            'state': state or {},
+            'saved_at': datetime.now().isoformat(timespec='seconds')
+        }
+        
+        # Scrittura atomica: un'interruzione non lascia un manifest parziale
+        tmp_path = self.manifest_path.with_name(f"{MANIFEST_NAME}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+        logger.debug(f"Checkpoint fase '{stage}' salvato in {self.directory}")
+    
+    def restore(self, stage: str, skip: Tuple[str, ...] = ()) -> Tuple[Dict[str, pd.DataFrame], Dict]:
+        """
+        Ricarica il risultato di una fase salvata.
+        
+        Args:
+            stage: Nome della fase
+            skip: DataFrame da non leggere
+            
+        Returns:
+            Tuple con (DataFrame per nome, stato)
+        """
+        entry = self.manifest['stages'][stage]
+        frames = {name: self._read_frame(self.directory / file_name)
+                  for name, file_name in entry['files'].items() if name not in skip}
+        return frames, entry['state']
+    
+    def clear(self) -> None:
+        """Rimuove i checkpoint del run (e la directory radice se vuota)."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.manifest['stages'] = {}
+        try:
+            self.root.rmdir()
+        except OSError:
+            pass
+    
+    def _write_frame(self, frame: pd.DataFrame, stem: str) -> str:
+        """Scrive uno snapshot (Parquet, serializzato se non rappresentabile)."""
+        if HAS_PYARROW:
+            try:
+                path = write_table(frame, self.directory / f"{stem}{PARQUET_SUFFIX}")
+                return path.name
+            except Exception as e:
+                (self.directory / f"{stem}{PARQUET_SUFFIX}").unlink(missing_ok=True)
+                logger.debug(f"Snapshot {stem} non colonnare ({e}): salvato serializzato")
+        
+        path = self.directory / f"{stem}{PICKLE_SUFFIX}"
+        with open(path, 'wb') as f:
+            pickle.dump(frame, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return path.name
+    
+    @staticmethod
+    def _read_frame(path: Path) -> pd.DataFrame:
+        """Legge uno snapshot scritto da _write_frame."""
+        if path.suffix == PICKLE_SUFFIX:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        return read_table(path)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Persistenza colonnare (Parquet con pyarrow, CSV come fallback) per VAR Processor
+"""
+
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    pa = None
+    pq = None
+    HAS_PYARROW = False
+
+PARQUET_SUFFIX = '.parquet'
+CSV_SUFFIX = '.csv'
+
+
+def default_suffix() -> str:
+    """Restituisce l'estensione colonnare disponibile (.parquet o .csv)."""
+    return PARQUET_SUFFIX if HAS_PYARROW else CSV_SUFFIX
+
+
+def resolve_path(path) -> Path:
+    """
+    Adatta l'estensione del file al formato disponibile.
+    
+    Senza pyarrow i file .parquet vengono scritti come .csv; un path senza
+    estensione riceve quella predefinita.
+    
+    Args:
+        path: Path richiesto
+        
+    Returns:
+        Path effettivo
+    """
+    path = Path(path)
+    if path.suffix.lower() == PARQUET_SUFFIX and not HAS_PYARROW:
+        fallback = path.with_suffix(CSV_SUFFIX)
+        logger.warning(f"pyarrow non installato: {path.name} scritto come CSV ({fallback.name})")
+        return fallback
+    if path.suffix.lower() not in (PARQUET_SUFFIX, CSV_SUFFIX):
+        return path.with_name(path.name + default_suffix())
+    return path
+
+
+def write_table(df: pd.DataFrame, path, row_group_size: Optional[int] = None) -> Path:
+    """
+    Scrive un DataFrame in formato colonnare.
+    
+    Args:
+        df: DataFrame da scrivere
+        path: Path di destinazione (.parquet o .csv)
+        row_group_size: Righe per row group Parquet (None = predefinito pyarrow).
+            Su dati ordinati, row group piccoli rendono selettivi i filtri in lettura
+        
+    Returns:
+        Path effettivo scritto
+    """
+    path = resolve_path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    
+    if path.suffix.lower() == PARQUET_SUFFIX:
+        df.to_parquet(path, index=False, compression='zstd', row_group_size=row_group_size)
+    else:
+        df.to_csv(path, index=False, encoding='utf-8')
+    return path
+
+
+def read_table(path, columns: Optional[List[str]] = None,
+               filters: Optional[Dict[str, list]] = None) -> pd.DataFrame:
+    """
+    Legge un file colonnare con proiezione e filtri opzionali.
+    
+    Args:
+        path: Path del file (.parquet o .csv)
+        columns: Colonne da leggere (None = tutte)
+        filters: Filtri di uguaglianza {colonna: [valori ammessi]}
+        
+    Returns:
+        DataFrame letto
+    """
+    path = Path(path)
+    
+    if path.suffix.lower() == PARQUET_SUFFIX:
+        parquet_filters = [(col, 'in', list(values)) for col, values in (filters or {}).items()] or None
+        return pd.read_parquet(path, columns=columns, filters=parquet_filters)
+    
+    read_columns = None
+    if columns is not None:
+        read_columns = list(dict.fromkeys(list(columns) + list((filters or {}).keys())))
+    df = pd.read_csv(path, usecols=read_columns, dtype=str, keep_default_na=False, encoding='utf-8')
+    for col, values in (filters or {}).items():
+        df = df[df[col].isin([str(value) for value in values])]
+    return df[columns] if columns is not None else df
+
+
+class BatchTableWriter:
+    """
+    Scrittore colonnare a blocchi (row group Parquet o append CSV).
+    
+    Lo schema è fissato dal primo blocco; i blocchi successivi vengono
+    convertiti allo stesso schema.
+    """
+    
+    def __init__(self, path):
+        """
+        Inizializza lo scrittore.
+        
+        Args:
+            path: Path di destinazione (.parquet o .csv)
+        """
+        self.path = resolve_path(path)
+        self.rows_written = 0
+        self._writer = None
+        self._schema = None
+        self._header_written = False
+    
+    def write_batch(self, df: pd.DataFrame) -> None:
+        """
+        Accoda un blocco di righe.
+        
+        Args:
+            df: Blocco da scrivere
+        """
+        if df.empty:
+            return
+        
+        if self.rows_written == 0:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        
+        if self.path.suffix.lower() == PARQUET_SUFFIX:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._writer is None:
+                self._schema = table.schema
+                self._writer = pq.ParquetWriter(self.path, self._schema, compression='zstd')
+            else:
+                table = table.cast(self._schema)
+            self._writer.write_table(table)
+        else:
+            df.to_csv(self.path, mode='a' if self._header_written else 'w',
+                      header=not self._header_written, index=False, encoding='utf-8')
+            self._header_written = True
+        
+        self.rows_written += len(df)
+    
+    def close(self) -> None:
+        """Chiude il file."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Profilo qualità dati per file di input e quarantena delle righe scartate
+"""
+
+import logging
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import Config
+from utils.columnar import write_table, default_suffix
+from utils.validators import IMEIValidator
+
+logger = logging.getLogger(__name__)
+
+QUARANTINE_COLUMNS = ['SORGENTE', 'FILE', 'RIGA', 'MOTIVO', 'IMEI', 'RIFERIMENTO', 'DATI']
+
+REQUIRED_COLUMNS = {
+    'post_vendita': Config.POST_VENDITA_REQUIRED_COLUMNS,
+    'ti': Config.TI_REQUIRED_COLUMNS,
+    'data': Config.DATA_REQUIRED_COLUMNS
+}
+
+
+def _blank(values: pd.Series) -> np.ndarray:
+    """Maschera dei valori mancanti o vuoti."""
+    missing = values.isna()
+    if pd.api.types.is_object_dtype(values.dtype) or pd.api.types.is_string_dtype(values.dtype):
+        missing |= values.astype(str).str.strip() == ''
+    return missing.to_numpy()
+
+
+def _non_numeric(values: pd.Series) -> int:
+    """Valori presenti ma non convertibili in numero (importati come 0)."""
+    if pd.api.types.is_numeric_dtype(values.dtype):
+        return 0
+    numbers = pd.to_numeric(values, errors='coerce')
+    return int((~_blank(values) & numbers.isna().to_numpy()).sum())
+
+
+def _dates_out_of_range(values: pd.Series) -> int:
+    """Date presenti ma non interpretabili o fuori da [QUALITY_MIN_DATE, oggi + QUALITY_MAX_FUTURE_DAYS]."""
+    dates = pd.to_datetime(values, errors='coerce')
+    low = pd.Timestamp(Config.QUALITY_MIN_DATE)
+    high = pd.Timestamp.now().normalize() + pd.Timedelta(days=Config.QUALITY_MAX_FUTURE_DAYS + 1)
+    outside = dates.isna() | (dates < low) | (dates >= high)
+    return int((~_blank(values) & outside.to_numpy()).sum())
+
+
+def _row_json(df: pd.DataFrame) -> List[str]:
+    """Riga originale come JSON (una stringa per riga, serializzazione in C)."""
+    if df.empty:
+        return []
+    return df.to_json(orient='records', lines=True, force_ascii=False, date_format='iso').rstrip('\n').split('\n')
+
+
+def profile_source(df: pd.DataFrame, source: str, file_name: str, imei_column: str,
+                   cleaned: pd.Series, reference_column: str) -> Tuple[Dict, pd.DataFrame]:
+    """
+    Calcola il profilo qualità di un file e le righe da mettere in quarantena.
+    
+    Un solo passaggio vettoriale sulle colonne del file così come letto
+    (prima di conversioni importi e codifiche categoriche).
+    
+    Args:
+        df: Righe del file come lette
+        source: Sorgente ('post_vendita', 'ti', 'data')
+        file_name: Nome del file
+        imei_column: Colonna IMEI grezza
+        cleaned: IMEI validati (IMEIValidator.validate_batch), NaN se scartati
+        reference_column: Colonna di riferimento della riga (es. ID Vendita)
+        
+    Returns:
+        Tuple con (profilo serializzabile in JSON, righe scartate con colonne
+        QUARANTINE_COLUMNS; RIGA è la riga del foglio, intestazione = 1)
+    """
+    rejected = cleaned.isna().to_numpy()
+    raw_imei = df[imei_column]
+    reasons = IMEIValidator.rejection_reasons(raw_imei[rejected])
+    
+    columns = [col for col in dict.fromkeys([imei_column] + REQUIRED_COLUMNS[source]) if col in df.columns]
+    profile = {
+        'rows': len(df),
+        'null_rates': {col: round(float(_blank(df[col]).mean()), 4) if len(df) else 0.0 for col in columns},
+        'invalid_imei': {reason: int(count) for reason, count in reasons.value_counts().items()},
+        'non_numeric_amounts': {col: _non_numeric(df[col])
+                                for col in Config.AMOUNT_COLUMNS.get(source, []) if col in df.columns},
+        'dates_out_of_range': {col: _dates_out_of_range(df[col])
+                               for col in Config.QUALITY_DATE_COLUMNS.get(source, []) if col in df.columns}
+    }
+    
+    rejected_rows = df[rejected]
+    quarantine = pd.DataFrame({
+        'SORGENTE': np.full(len(rejected_rows), source, dtype=object),
+        'FILE': file_name,
+        'RIGA': np.flatnonzero(rejected) + 2,
+        'MOTIVO': reasons.to_numpy(),
+        'IMEI': raw_imei.to_numpy()[rejected],
+        'RIFERIMENTO': (rejected_rows[reference_column].to_numpy() if reference_column in df.columns
+                        else np.full(len(rejected_rows), '', dtype=object)),
+        'DATI': _row_json(rejected_rows)
+    }, columns=QUARANTINE_COLUMNS)
+    
+    log_profile(file_name, profile)
+    return profile, quarantine
+
+
+def log_profile(file_name: str, profile: Dict) -> None:
+    """Registra a log i problemi del profilo (nessun log se il file è pulito)."""
+    issues = []
+    invalid = sum(profile['invalid_imei'].values())
+    if invalid:
+        detail = ', '.join(f"{reason} {count:,}" for reason, count in profile['invalid_imei'].items())
+        issues.append(f"{invalid:,} IMEI scartati ({detail})")
+    for col, count in profile['non_numeric_amounts'].items():
+        if count:
+            issues.append(f"{count:,} importi non numerici in '{col}'")
+    for col, count in profile['dates_out_of_range'].items():
+        if count:
+            issues.append(f"{count:,} date fuori intervallo in '{col}'")
+    for col, rate in profile['null_rates'].items():
+        if rate > Config.QUALITY_NULL_WARNING_RATE:
+            issues.append(f"'{col}' mancante nel {rate:.1%} delle righe")
+    
+    if issues:
+        logger.warning(f"Qualità {file_name}: {'; '.join(issues)}")
+
+
+def quarantine_path_for(report_path) -> Path:
+    """Restituisce il path di quarantena predefinito associato a un report."""
+    report_path = Path(report_path)
+    return report_path.with_name(f"{report_path.stem}{Config.QUARANTINE_SUFFIX}{default_suffix()}")
+
+
+def write_quarantine(frames: List[pd.DataFrame], path) -> Tuple[Path, int]:
+    """
+    Scrive le righe scartate di tutte le sorgenti in un file colonnare.
+    
+    Args:
+        frames: Righe scartate per sorgente (colonne QUARANTINE_COLUMNS)
+        path: Path di destinazione (.parquet o .csv)
+        
+    Returns:
+        Tuple con (path scritto, righe scritte)
+    """
+    quarantine = pd.concat(frames, ignore_index=True)[QUARANTINE_COLUMNS]
+    # IMEI e riferimenti grezzi hanno tipi misti (numeri Excel e testo)
+    for col in ('IMEI', 'RIFERIMENTO'):
+        quarantine[col] = quarantine[col].astype(object).where(quarantine[col].notna(), '').astype(str)
+    return write_table(quarantine, path), len(quarantine)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Gestione vettoriale degli IMEI duplicati per VAR Processor
+"""
+
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_duplicates(df: pd.DataFrame, key: str, source: str,
+                       policy: Optional[str] = None) -> Tuple[pd.DataFrame, Dict]:
+    """
+    Riduce il DataFrame a una riga per chiave secondo la policy della sorgente.
+    
+    Le righe risultanti sono nell'ordine di prima apparizione della chiave
+    (come un dict popolato riga per riga). Importi e colonne da elencare
+    sono aggregati con groupby sui codici della chiave, solo per le chiavi
+    duplicate.
+    
+    Args:
+        df: DataFrame con chiave valorizzata (importi in centesimi)
+        key: Colonna chiave (es. 'IMEI_CLEAN')
+        source: Sorgente ('post_vendita', 'ti', 'data') per colonne e policy
+        policy: 'last', 'first', 'sum' o 'list' (default Config.DUPLICATE_POLICY)
+        
+    Returns:
+        Tuple con (DataFrame deduplicato, statistiche duplicati)
+        
+    Raises:
+        ValueError: Se la policy non è valida
+    """
+    policy = policy or Config.DUPLICATE_POLICY.get(source, 'last')
+    if policy not in Config.DUPLICATE_POLICIES:
+        raise ValueError(f"Policy duplicati non valida per {source}: {policy} "
+                         f"(ammesse: {', '.join(Config.DUPLICATE_POLICIES)})")
+    
+    stats = {'policy': policy, 'duplicate_imei': 0, 'duplicate_rows': 0}
+    duplicated = df.duplicated(key, keep=False)
+    if not duplicated.any():
+        return df, stats
+    
+    codes, uniques = pd.factorize(df[key])
+    positions = pd.Series(np.arange(len(df)))
+    keep = positions.groupby(codes, sort=True).min() if policy == 'first' else positions.groupby(codes, sort=True).max()
+    
+    stats['duplicate_imei'] = int(df.loc[duplicated, key].nunique())
+    stats['duplicate_rows'] = int(len(df) - len(uniques))
+    
+    result = df.iloc[keep.to_numpy()].reset_index(drop=True)
+    if policy in ('sum', 'list'):
+        _aggregate_amounts(df, result, codes, Config.AMOUNT_COLUMNS.get(source, []))
+    if policy == 'list':
+        _aggregate_lists(df, result, codes, duplicated.to_numpy(), Config.DUPLICATE_LIST_COLUMNS.get(source, []))
+    
+    logger.warning(f"IMEI duplicati in {source}: {stats['duplicate_imei']:,} IMEI su "
+                   f"{stats['duplicate_rows']:,} righe in eccesso (policy '{policy}')")
+    return result, stats
+
+
+def _aggregate_amounts(df: pd.DataFrame, result: pd.DataFrame, codes: np.ndarray,
+                       columns: List[str]) -> None:
+    """Somma per chiave le colonne importo (result è in ordine di codice)."""
+    for col in columns:
+        if col in df.columns:
+            result[col] = df[col].groupby(codes, sort=True).sum().to_numpy()
+
+
+def _aggregate_lists(df: pd.DataFrame, result: pd.DataFrame, codes: np.ndarray,
+                     duplicated: np.ndarray, columns: List[str]) -> None:
+    """Elenca i valori distinti delle colonne indicate per le sole chiavi duplicate."""
+    separator = Config.DUPLICATE_LIST_SEPARATOR
+    for col in columns:
+        if col not in df.columns:
+            continue
+        values = pd.DataFrame({
+            'code': codes[duplicated],
+            'value': df[col].to_numpy()[duplicated]
+        }).astype({'value': str}).drop_duplicates()
+        joined = values.groupby('code', sort=False)['value'].agg(separator.join)
+        
+        merged = result[col].astype(object)
+        merged.iloc[joined.index.to_numpy()] = joined.to_numpy()
+        result[col] = merged
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Lettura Excel a blocchi per VAR Processor
+"""
+
+import re
+import logging
+import zipfile
+import posixpath
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterator, List, Optional
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# pandas è importato solo dove serve: la lettura delle intestazioni
+# (validazione pre-flight) non deve pagarne il costo di import
+logger = logging.getLogger(__name__)
+
+_DIMENSION_RE = re.compile(rb'<(?:\w+:)?dimension[^>]*\bref="([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?"')
+
+
+def _first_sheet_name(archive: zipfile.ZipFile) -> Optional[str]:
+    """
+    Restituisce il path XML del primo foglio di lavoro di un archivio .xlsx.
+    
+    Segue l'ordine dei <sheet> in xl/workbook.xml, risolvendo il loro r:id in
+    xl/_rels/workbook.xml.rels (i file sheetN.xml non seguono l'ordine delle
+    schede); i fogli grafico sono saltati, come in openpyxl e pd.read_excel.
+    
+    Returns:
+        Path nell'archivio o None se il workbook non ha fogli di lavoro
+    """
+    from xml.etree.ElementTree import fromstring
+    
+    try:
+        workbook = fromstring(archive.read('xl/workbook.xml'))
+        relations = fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    except KeyError:
+        return None
+    
+    targets = {}
+    for relation in relations:
+        if relation.get('Type', '').endswith('/worksheet'):
+            target = relation.get('Target', '')
+            targets[relation.get('Id')] = (target.lstrip('/') if target.startswith('/')
+                                           else posixpath.normpath(posixpath.join('xl', target)))
+    
+    for sheet in workbook.iter():
+        if sheet.tag.rsplit('}', 1)[-1] != 'sheet':
+            continue
+        relation_id = next((value for key, value in sheet.attrib.items() if key.rsplit('}', 1)[-1] == 'id'), None)
+        if relation_id in targets:
+            return targets[relation_id]
+    return None
+
+
+def count_excel_rows(file_path) -> Optional[int]:
+    """
+    Stima il numero di righe dati del primo foglio senza leggere le celle.
+    
+    Legge l'attributo <dimension> dall'XML del foglio (solo .xlsx).
+    
+    Args:
+        file_path: Path del file Excel
+        
+    Returns:
+        Numero righe dati (esclusa intestazione) o None se non determinabile
+    """
+    path = Path(file_path)
+    if path.suffix.lower() != '.xlsx':
+        return None
+    
+    try:
+        with zipfile.ZipFile(path) as archive:
+            first_sheet = _first_sheet_name(archive)
+            if first_sheet is None:
+                return None
+            with archive.open(first_sheet) as sheet:
+                head = sheet.read(4096)
+    except (OSError, zipfile.BadZipFile, KeyError) as e:
+        logger.debug(f"Dimensione non leggibile per {path.name}: {e}")
+        return None
+    
+    match = _DIMENSION_RE.search(head)
+    if not match:
+        return None
+    
+    last_row = int(match.group(4) or match.group(2))
+    return max(last_row - 1, 0)
+
+
+def _column_index(cell_ref: str) -> int:
+    """Converte il riferimento colonna di una cella (es. 'AB1') in indice 0-based."""
+    index = 0
+    for char in cell_ref:
+        if not char.isalpha():
+            break
+        index = index * 26 + (ord(char.upper()) - 64)
+    return index - 1
+
+
+def _read_xlsx_header(path: Path) -> Optional[List[Optional[str]]]:
+    """
+    Legge la riga di intestazione di un .xlsx direttamente dall'XML.
+    
+    Si ferma alla fine della prima riga del foglio e legge dalla tabella
+    sharedStrings solo le stringhe referenziate dall'intestazione.
+    
+    Returns:
+        Valori della prima riga o None se il formato non è gestito
+    """
+    from xml.etree.ElementTree import iterparse
+    
+    with zipfile.ZipFile(path) as archive:
+        first_sheet = _first_sheet_name(archive)
+        if first_sheet is None:
+            return None
+        
+        cells = {}
+        with archive.open(first_sheet) as sheet:
+            for _, elem in iterparse(sheet, events=('end',)):
+                tag = elem.tag.rsplit('}', 1)[-1]
+                if tag == 'c':
+                    ref = elem.get('r')
+                    position = _column_index(ref) if ref else len(cells)
+                    cell_type = elem.get('t')
+                    if cell_type == 'inlineStr':
+                        value = ''.join(t.text or '' for t in elem.iter() if t.tag.endswith('}t'))
+                    else:
+                        value_elem = next((child for child in elem if child.tag.endswith('}v')), None)
+                        value = value_elem.text if value_elem is not None else None
+                    cells[position] = (cell_type, value)
+                elif tag == 'row':
+                    break
+        
+        if not cells:
+            return []
+        
+        # Stringhe condivise: legge solo fino all'indice massimo richiesto
+        shared_needed = {int(value) for cell_type, value in cells.values() if cell_type == 's' and value is not None}
+        shared = {}
+        if shared_needed:
+            last_needed = max(shared_needed)
+            with archive.open('xl/sharedStrings.xml') as strings:
+                index = 0
+                for _, elem in iterparse(strings, events=('end',)):
+                    if not elem.tag.endswith('}si'):
+                        continue
+                    if index in shared_needed:
+                        shared[index] = ''.join(t.text or '' for t in elem.iter() if t.tag.endswith('}t'))
+                    elem.clear()
+                    index += 1
+                    if index > last_needed:
+                        break
+    
+    header: List[Optional[str]] = [None] * (max(cells) + 1)
+    for position, (cell_type, value) in cells.items():
+        header[position] = shared.get(int(value)) if cell_type == 's' and value is not None else value
+    return header
+
+
+def read_excel_header(file_path) -> List[str]:
+    """
+    Legge solo la riga di intestazione del primo foglio, senza caricare dati.
+    
+    I file .xlsx sono letti dall'XML interno (con fallback openpyxl), i file
+    .xls con xlrd o, se sono HTML mascherati, come tabella HTML.
+    
+    Args:
+        file_path: Path del file Excel
+        
+    Returns:
+        Nomi colonna (stringhe, senza celle vuote finali)
+    """
+    path = Path(file_path)
+    header = None
+    
+    if path.suffix.lower() == '.xlsx':
+        try:
+            header = _read_xlsx_header(path)
+        except (KeyError, ValueError, zipfile.BadZipFile) as e:
+            logger.debug(f"Intestazione XML non leggibile per {path.name}: {e}")
+        
+        if header is None:
+            from openpyxl import load_workbook
+            
+            workbook = load_workbook(path, read_only=True, data_only=True)
+            try:
+                header = list(next(workbook.worksheets[0].iter_rows(max_row=1, values_only=True), ()))
+            finally:
+                workbook.close()
+    else:
+        import pandas as pd
+        
+        try:
+            header = list(pd.read_excel(path, nrows=0).columns)
+        except Exception:
+            header = list(pd.read_html(path)[0].columns)
+    
+    while header and header[-1] is None:
+        header.pop()
+    return [str(value) if value is not None else f"Unnamed: {i}" for i, value in enumerate(header)]
+
+
+def _convert_cell(cell):
+    """Converte una cella openpyxl come pd.read_excel (vuota -> '', interi come int)."""
+    value = cell.value
+    if value is None:
+        return ''
+    if cell.data_type == 'e':
+        return float('nan')
+    if cell.data_type == 'n':
+        integer = int(value)
+        return integer if integer == value else float(value)
+    return value
+
+
+def iter_excel_rows(file_path, chunk_size: int) -> Iterator[List[list]]:
+    """
+    Legge il primo foglio di un file .xlsx a blocchi di righe grezze.
+    
+    Le celle sono convertite come in pd.read_excel e le righe vuote finali
+    scartate (quelle interne sono mantenute), così che il parsing dei blocchi
+    concatenati produca lo stesso DataFrame della lettura completa. La prima
+    riga del primo blocco è l'intestazione.
+    
+    Args:
+        file_path: Path del file Excel
+        chunk_size: Righe per blocco
+        
+    Yields:
+        Liste di al massimo chunk_size righe
+    """
+    from openpyxl import load_workbook
+    
+    workbook = load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        worksheet = workbook.worksheets[0]
+        worksheet.reset_dimensions()
+        
+        buffer = []
+        blank_rows = []
+        for row in worksheet.rows:
+            values = [_convert_cell(cell) for cell in row]
+            while values and values[-1] == '':
+                values.pop()
+            if not values:
+                blank_rows.append(values)
+                continue
+            if blank_rows:
+                buffer.extend(blank_rows)
+                blank_rows = []
+            buffer.append(values)
+            if len(buffer) >= chunk_size:
+                yield buffer
+                buffer = []
+        
+        if buffer:
+            yield buffer
+    finally:
+        workbook.close()
+
+
+def load_excel(file_path, governor=None) -> 'pd.DataFrame':
+    """
+    Carica il primo foglio di un file Excel rispettando il budget di memoria.
+    
+    I file .xlsx il cui caricamento completo supererebbe la soglia del governor
+    (o letti con memoria sotto pressione) vengono letti a blocchi di
+    Config.CHUNK_SIZE righe con un controllo memoria dopo ogni blocco, così da
+    interrompere prima dell'OOM. Il parsing finale è lo stesso di
+    pd.read_excel: le due letture restituiscono le stesse colonne e righe.
+    
+    Args:
+        file_path: Path del file Excel
+        governor: MemoryGovernor (opzionale)
+        
+    Returns:
+        DataFrame caricato
+    """
+    import pandas as pd
+    from pandas.io.parsers import TextParser
+    from config import Config
+    
+    path = Path(file_path)
+    if governor is None or path.suffix.lower() != '.xlsx':
+        return pd.read_excel(path)
+    
+    governor.check(f"caricamento {path.name}")
+    estimated_rows = count_excel_rows(path)
+    if not governor.should_chunk(estimated_rows):
+        return pd.read_excel(path)
+    
+    if estimated_rows is not None:
+        rows_label = (f"{estimated_rows:,} righe stimate, "
+                      f"~{governor.estimate_load_mb(estimated_rows):,.0f} MB in lettura completa")
+    else:
+        rows_label = "righe non stimabili"
+    governor.record_decision(
+        f"caricamento {path.name}", 'chunked_read', None,
+        f"lettura a blocchi di {Config.CHUNK_SIZE:,} righe ({rows_label})", level=logging.INFO
+    )
+    
+    rows = []
+    for block in iter_excel_rows(path, Config.CHUNK_SIZE):
+        rows.extend(block)
+        governor.check(f"caricamento {path.name}")
+    
+    if not rows:
+        return pd.DataFrame()
+    width = max(len(row) for row in rows)
+    for row in rows:
+        row.extend([''] * (width - len(row)))
+    return TextParser(rows, header=0).read()
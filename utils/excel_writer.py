@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Scrittura report Excel con formattazione a livello di colonna e intervallo per VAR Processor
+"""
+
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+try:
+    import xlsxwriter  # noqa: F401 - motore con formati di colonna
+    HAS_XLSXWRITER = True
+except ImportError:
+    HAS_XLSXWRITER = False
+
+HEADER_COLOR = 'E8E8E8'
+
+
+def column_widths(df: pd.DataFrame) -> List[int]:
+    """
+    Larghezza di ogni colonna dal testo più lungo (intestazione compresa).
+    
+    Calcolata in blocco su un campione di Config.EXCEL_WIDTH_SAMPLE_ROWS righe:
+    il costo non cresce con il report.
+    
+    Args:
+        df: Dati del foglio
+        
+    Returns:
+        Larghezze nell'ordine delle colonne
+    """
+    sample = df.head(Config.EXCEL_WIDTH_SAMPLE_ROWS)
+    widths = []
+    for col in df.columns:
+        values = sample[col]
+        lengths = values[values.notna()].astype(str).str.len()
+        longest = max(len(str(col)), int(lengths.max()) if len(lengths) else 0)
+        widths.append(min(max(longest + 2, Config.EXCEL_MIN_COLUMN_WIDTH), Config.EXCEL_MAX_COLUMN_WIDTH))
+    return widths
+
+
+def number_formats(df: pd.DataFrame) -> Dict[int, str]:
+    """Formato numerico per posizione di colonna (valute e percentuali)."""
+    formats = {}
+    for position, col in enumerate(df.columns):
+        if col in Config.CURRENCY_COLUMNS:
+            formats[position] = Config.EXCEL_CURRENCY_FORMAT
+        elif col in Config.EXCEL_PERCENT_COLUMNS:
+            formats[position] = Config.EXCEL_PERCENT_FORMAT
+    return formats
+
+
+def write_excel_report(output_path, sheets: Dict[str, pd.DataFrame], mode: Optional[str] = None) -> None:
+    """
+    Scrive i fogli del report con formattazione per colonna o intervallo.
+    
+    In modalità 'table' ogni foglio è una tabella Excel (filtri e righe
+    alternate) con formati valuta/percentuale per colonna, date formattate e
+    formattazione condizionale della Differenza: nessuno stile per cella,
+    costo costante rispetto al numero di righe. Formati numerici e di data
+    richiedono xlsxwriter; senza, tabella e formattazione condizionale sono
+    applicate con openpyxl.
+    
+    Args:
+        output_path: Path del file .xlsx
+        sheets: DataFrame per nome foglio (il primo è il foglio principale)
+        mode: 'table' o 'plain' (default Config.EXCEL_OUTPUT_MODE)
+        
+    Raises:
+        ValueError: Se la modalità non è valida
+    """
+    mode = mode or Config.EXCEL_OUTPUT_MODE
+    if mode not in Config.EXCEL_OUTPUT_MODES:
+        raise ValueError(f"Modalità Excel '{mode}' non valida (valori: {', '.join(Config.EXCEL_OUTPUT_MODES)})")
+    
+    if mode == 'table' and HAS_XLSXWRITER:
+        _write_xlsxwriter(Path(output_path), sheets)
+        return
+    
+    if mode == 'table':
+        logger.info("xlsxwriter non installato: tabella e formattazione condizionale senza formati valuta/data")
+    _write_openpyxl(Path(output_path), sheets, tables=mode == 'table')
+
+
+def _write_xlsxwriter(output_path: Path, sheets: Dict[str, pd.DataFrame]) -> None:
+    """Tabelle Excel con formati di colonna (xlsxwriter)."""
+    with pd.ExcelWriter(output_path, engine='xlsxwriter',
+                        datetime_format=Config.EXCEL_DATETIME_FORMAT) as writer:
+        workbook = writer.book
+        formats = {fmt: workbook.add_format({'num_format': fmt})
+                   for fmt in (Config.EXCEL_CURRENCY_FORMAT, Config.EXCEL_PERCENT_FORMAT)}
+        highlights = {
+            '<': workbook.add_format({'font_color': f"#{Config.EXCEL_NEGATIVE_COLORS[0]}",
+                                      'bg_color': f"#{Config.EXCEL_NEGATIVE_COLORS[1]}"}),
+            '>': workbook.add_format({'font_color': f"#{Config.EXCEL_POSITIVE_COLORS[0]}",
+                                      'bg_color': f"#{Config.EXCEL_POSITIVE_COLORS[1]}"})
+        }
+        
+        for index, (sheet_name, df) in enumerate(sheets.items(), start=1):
+            # Intestazioni scritte dalla tabella: i dati partono dalla seconda riga
+            df.to_excel(writer, sheet_name=sheet_name, index=False, startrow=1, header=False)
+            worksheet = writer.sheets[sheet_name]
+            
+            column_formats = number_formats(df)
+            for position, width in enumerate(column_widths(df)):
+                worksheet.set_column(position, position, width, formats.get(column_formats.get(position)))
+            
+            # Almeno una riga dati: una tabella di sola intestazione non è valida
+            last_row = max(len(df), 1)
+            worksheet.add_table(0, 0, last_row, len(df.columns) - 1, {
+                'name': f"Tabella{index}",
+                'style': Config.EXCEL_TABLE_STYLE,
+                'columns': [{'header': str(col)} for col in df.columns]
+            })
+            
+            if Config.EXCEL_DIFFERENCE_COLUMN in df.columns and len(df):
+                col = df.columns.get_loc(Config.EXCEL_DIFFERENCE_COLUMN)
+                for criteria, highlight in highlights.items():
+                    worksheet.conditional_format(1, col, len(df), col, {
+                        'type': 'cell', 'criteria': criteria, 'value': 0, 'format': highlight
+                    })
+            
+            worksheet.freeze_panes(1, 0)
+
+
+def _write_openpyxl(output_path: Path, sheets: Dict[str, pd.DataFrame], tables: bool) -> None:
+    """Intestazioni formattate e, se richiesto, tabella e formattazione condizionale (openpyxl)."""
+    from openpyxl.formatting.rule import CellIsRule
+    from openpyxl.styles import Font, PatternFill
+    from openpyxl.utils import get_column_letter
+    from openpyxl.worksheet.table import Table, TableStyleInfo
+    
+    with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
+        for index, (sheet_name, df) in enumerate(sheets.items(), start=1):
+            df.to_excel(writer, sheet_name=sheet_name, index=False)
+            worksheet = writer.sheets[sheet_name]
+            
+            # Solo la riga di intestazione: una cella per colonna
+            for cell in worksheet[1]:
+                cell.font = Font(bold=True, size=11)
+                cell.fill = PatternFill(start_color=HEADER_COLOR, end_color=HEADER_COLOR, fill_type="solid")
+            
+            for position, width in enumerate(column_widths(df), start=1):
+                worksheet.column_dimensions[get_column_letter(position)].width = width
+            worksheet.freeze_panes = "A2"
+            
+            if not tables or df.empty:
+                continue
+            
+            last_column = get_column_letter(len(df.columns))
+            table = Table(displayName=f"Tabella{index}", ref=f"A1:{last_column}{len(df) + 1}")
+            table.tableStyleInfo = TableStyleInfo(name=Config.EXCEL_TABLE_STYLE, showRowStripes=True)
+            worksheet.add_table(table)
+            
+            if Config.EXCEL_DIFFERENCE_COLUMN in df.columns:
+                letter = get_column_letter(df.columns.get_loc(Config.EXCEL_DIFFERENCE_COLUMN) + 1)
+                cells = f"{letter}2:{letter}{len(df) + 1}"
+                for operator, (font, fill) in (('lessThan', Config.EXCEL_NEGATIVE_COLORS),
+                                               ('greaterThan', Config.EXCEL_POSITIVE_COLORS)):
+                    worksheet.conditional_formatting.add(cells, CellIsRule(
+                        operator=operator, formula=['0'], font=Font(color=font),
+                        fill=PatternFill(start_color=fill, end_color=fill, fill_type="solid")))
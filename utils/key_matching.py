@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Matching su chiavi secondarie (ID Vendita, numero nota credito) per VAR Processor
+"""
+
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import Config
+from utils.categorical import concat_categorical
+
+logger = logging.getLogger(__name__)
+
+PRIMARY_KEY = 'IMEI'
+MATCH_KEY_COLUMN = '_CHIAVE_MATCH'
+ORIGINAL_IMEI_COLUMN = '_IMEI_TI'
+
+
+def key_columns(source: str) -> List[str]:
+    """Colonne delle chiavi secondarie di una sorgente ('post_vendita' o 'ti'), vuote se disattivato."""
+    if not Config.ENABLE_KEY_MATCHING:
+        return []
+    position = 1 if source == 'post_vendita' else 2
+    return [key[position] for key in Config.MATCH_SECONDARY_KEYS]
+
+
+def _key_values(values: pd.Series) -> np.ndarray:
+    """Valori chiave come testo normalizzato (None se mancanti o vuoti)."""
+    if pd.api.types.is_float_dtype(values.dtype) and (values.dropna() % 1 == 0).all():
+        # Codici numerici letti da Excel come float (12345.0 -> '12345')
+        values = values.astype('Int64')
+    text = values.astype(str).str.strip()
+    return text.where(values.notna().to_numpy() & (text != '').to_numpy()).to_numpy(dtype=object)
+
+
+def _missing_from(values: pd.Series, other: pd.Series) -> np.ndarray:
+    """Maschera dei valori assenti in other (lookup su indice hash, anche per stringhe Arrow)."""
+    return pd.Index(other).unique().get_indexer(values) < 0
+
+
+def _open_keys(values: pd.Series, open_rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Chiavi delle righe ancora da abbinare, solo se univoche.
+    
+    Una chiave vuota o ripetuta su un lato renderebbe l'abbinamento ambiguo:
+    queste righe restano da abbinare alla chiave successiva.
+    
+    Returns:
+        Tuple con (valori chiave univoci, posizioni delle righe)
+    """
+    positions = np.flatnonzero(open_rows)
+    keys = _key_values(values.iloc[positions])
+    present = pd.notna(keys)
+    keys, positions = keys[present], positions[present]
+    unique = ~pd.Series(keys).duplicated(keep=False).to_numpy()
+    return keys[unique], positions[unique]
+
+
+def match_secondary_keys(post_vendita_df: pd.DataFrame, ti_df: pd.DataFrame,
+                         keys: Optional[List[Tuple[str, str, str]]] = None,
+                         pv_rejected: Optional[pd.DataFrame] = None,
+                         ti_rejected: Optional[pd.DataFrame] = None
+                         ) -> Tuple[pd.DataFrame, pd.DataFrame, Dict[str, int]]:
+    """
+    Abbina sulle chiavi secondarie i post vendita e i TI senza match IMEI.
+    
+    Ogni chiave, nell'ordine configurato, è un hash join (indice sulle chiavi
+    post vendita) tra le sole righe ancora non abbinate. Le righe con IMEI
+    scartato dal validatore partecipano al join se passate in pv_rejected /
+    ti_rejected: abbinate a una riga con IMEI valido ne assumono l'IMEI,
+    altrimenti restano escluse (due righe entrambe senza IMEI non si
+    abbinano). Le righe TI abbinate assumono l'IMEI del post vendita (quello
+    originale resta in _IMEI_TI): il matching IMEI, seriale o partizionato,
+    le unisce senza altri passaggi.
+    
+    Args:
+        post_vendita_df: Dati post vendita (una riga per IMEI_CLEAN)
+        ti_df: Dati TI (una riga per IMEI_CLEAN)
+        keys: Chiavi (nome, colonna post vendita, colonna TI) (default Config.MATCH_SECONDARY_KEYS)
+        pv_rejected: Righe post vendita con IMEI scartato (IMEI_CLEAN mancante)
+        ti_rejected: Righe TI con IMEI scartato (IMEI_CLEAN mancante)
+        
+    Returns:
+        Tuple con (post vendita, TI con IMEI_CLEAN riassegnati, IMEI TI
+        originale in _IMEI_TI e chiave di abbinamento in _CHIAVE_MATCH,
+        righe abbinate per chiave secondaria)
+    """
+    keys = Config.MATCH_SECONDARY_KEYS if keys is None else keys
+    matches = {}
+    
+    # Righe con IMEI scartato in coda, sempre da abbinare
+    if pv_rejected is not None and not pv_rejected.empty:
+        post_vendita_df = concat_categorical([post_vendita_df, pv_rejected])
+    if ti_rejected is not None and not ti_rejected.empty:
+        ti_df = concat_categorical([ti_df, ti_rejected])
+    
+    pv_imeis = post_vendita_df['IMEI_CLEAN']
+    ti_imeis = ti_df['IMEI_CLEAN']
+    pv_valid = pv_imeis.notna().to_numpy()
+    ti_valid = ti_imeis.notna().to_numpy()
+    pv_open = _missing_from(pv_imeis, ti_imeis) | ~pv_valid
+    ti_open = _missing_from(ti_imeis, pv_imeis) | ~ti_valid
+    pv_assigned = pv_imeis.to_numpy(dtype=object).copy()
+    ti_assigned = ti_imeis.to_numpy(dtype=object).copy()
+    key_used = np.full(len(ti_df), PRIMARY_KEY, dtype=object)
+    
+    for name, pv_column, ti_column in keys:
+        if pv_column not in post_vendita_df.columns or ti_column not in ti_df.columns:
+            logger.debug(f"Chiave {name}: colonne '{pv_column}' / '{ti_column}' non presenti, ignorata")
+            continue
+        if not pv_open.any() or not ti_open.any():
+            break
+        
+        pv_keys, pv_positions = _open_keys(post_vendita_df[pv_column], pv_open)
+        ti_keys, ti_positions = _open_keys(ti_df[ti_column], ti_open)
+        lookup = pd.Index(pv_keys).get_indexer(ti_keys)
+        hit = lookup >= 0
+        # Almeno un lato deve avere un IMEI valido da assegnare al record
+        hit[hit] = pv_valid[pv_positions[lookup[hit]]] | ti_valid[ti_positions[hit]]
+        
+        pv_matched, ti_matched = pv_positions[lookup[hit]], ti_positions[hit]
+        imeis = np.where(pv_valid[pv_matched], pv_assigned[pv_matched], ti_assigned[ti_matched])
+        pv_assigned[pv_matched] = imeis
+        ti_assigned[ti_matched] = imeis
+        key_used[ti_matched] = name
+        pv_open[pv_matched] = False
+        ti_open[ti_matched] = False
+        matches[name] = int(hit.sum())
+    
+    # Righe scartate non abbinate escluse come prima del matching
+    pv_keep = pv_valid | ~pv_open
+    ti_keep = ti_valid | ~ti_open
+    recovered = int((~pv_valid & pv_keep).sum() + (~ti_valid & ti_keep).sum())
+    
+    ti_original = ti_imeis.where(ti_imeis.notna(), ti_df['IMEI'].astype(str))
+    ti_df = ti_df.assign(**{MATCH_KEY_COLUMN: key_used, ORIGINAL_IMEI_COLUMN: ti_original.to_numpy()})
+    if any(matches.values()):
+        post_vendita_df = post_vendita_df.assign(
+            IMEI_CLEAN=pd.Series(pv_assigned, index=post_vendita_df.index, dtype=pv_imeis.dtype))
+        ti_df['IMEI_CLEAN'] = pd.Series(ti_assigned, index=ti_df.index, dtype=ti_imeis.dtype)
+        logger.info("Match su chiavi secondarie: "
+                    + ", ".join(f"{name} {count:,}" for name, count in matches.items())
+                    + (f" (di cui {recovered:,} righe con IMEI scartato)" if recovered else ""))
+    post_vendita_df = post_vendita_df[pv_keep].reset_index(drop=True)
+    ti_df = ti_df[ti_keep].reset_index(drop=True)
+    return post_vendita_df, ti_df, matches
+
+
+def rejected_key_rows(df: pd.DataFrame, source: str) -> pd.DataFrame:
+    """
+    Righe con IMEI scartato e almeno una chiave secondaria (candidate al match su chiavi).
+    
+    Args:
+        df: Righe del file con IMEI_CLEAN (NaN se scartato)
+        source: Sorgente ('post_vendita' o 'ti')
+        
+    Returns:
+        Copia delle righe candidate
+    """
+    rejected = df[df['IMEI_CLEAN'].isna()]
+    has_key = np.zeros(len(rejected), dtype=bool)
+    for column in key_columns(source):
+        if column in rejected.columns:
+            has_key |= pd.notna(_key_values(rejected[column]))
+    return rejected[has_key].copy()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Governo del budget di memoria per VAR Processor
+"""
+
+import os
+import gc
+import pickle
+import shutil
+import logging
+import tempfile
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from config import Config
+from utils.profiler import get_current_rss_mb
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBudgetExceeded(MemoryError):
+    """Budget di memoria superato: elaborazione interrotta prima dell'OOM."""
+
+
+def get_total_memory_mb() -> Optional[float]:
+    """
+    Restituisce la memoria disponibile al processo in MB.
+    
+    Considera il limite cgroup (container/VM batch) se inferiore alla RAM fisica.
+    
+    Returns:
+        Memoria in MB o None se non determinabile
+    """
+    total = None
+    try:
+        total = os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        try:
+            import psutil
+            total = psutil.virtual_memory().total / (1024 * 1024)
+        except Exception:
+            total = None
+    
+    # Limite cgroup v2 / v1
+    for limit_file in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(limit_file, 'r') as f:
+                value = f.read().strip()
+            if value.isdigit():
+                limit = int(value) / (1024 * 1024)
+                if total is None or limit < total:
+                    total = limit
+            break
+        except OSError:
+            continue
+    
+    return total
+
+
+class SpilledFrame:
+    """DataFrame scaricato su disco, ricaricabile su richiesta."""
+    
+    def __init__(self, path: Path, rows: int, name: str):
+        self.path = path
+        self.rows = rows
+        self.name = name
+    
+    def load(self):
+        """Ricarica il DataFrame e rimuove il file temporaneo."""
+        with open(self.path, 'rb') as f:
+            df = pickle.load(f)
+        self.path.unlink(missing_ok=True)
+        logger.info(f"Memoria: ricaricato {self.name} da disco ({self.rows:,} righe)")
+        return df
+    
+    def __len__(self) -> int:
+        return self.rows
+    
+    @staticmethod
+    def resolve(frame):
+        """Restituisce il DataFrame, ricaricandolo se scaricato su disco."""
+        return frame.load() if isinstance(frame, SpilledFrame) else frame
+
+
+class MemoryGovernor:
+    """
+    Controlla l'uso di memoria (RSS) rispetto a un budget configurato.
+    
+    Sotto la soglia soft attiva strategie a basso consumo (lettura a blocchi,
+    spill su disco dei DataFrame intermedi, rilascio cache); oltre la soglia
+    hard interrompe l'elaborazione con MemoryBudgetExceeded.
+    """
+    
+    def __init__(self, budget_mb: Optional[float] = None, enabled: bool = None):
+        """
+        Inizializza il governor.
+        
+        Args:
+            budget_mb: Budget in MB (default Config.MEMORY_BUDGET_MB o quota RAM)
+            enabled: Se attivo (default Config.ENABLE_MEMORY_GOVERNOR)
+        """
+        self.enabled = Config.ENABLE_MEMORY_GOVERNOR if enabled is None else enabled
+        self.budget_mb = budget_mb or Config.MEMORY_BUDGET_MB
+        if not self.budget_mb:
+            total = get_total_memory_mb()
+            self.budget_mb = total * Config.MEMORY_BUDGET_RATIO if total else None
+        
+        self.soft_limit_mb = self.budget_mb * Config.MEMORY_SOFT_RATIO if self.budget_mb else None
+        self.low_memory = False
+        self.peak_rss_mb = 0.0
+        self.decisions: List[Dict] = []
+        self._cache_droppers: List[Callable[[], None]] = []
+        self._spill_dir: Optional[Path] = None
+        
+        if self.enabled and self.budget_mb and get_current_rss_mb() is None:
+            logger.warning("Memoria: RSS non misurabile su questa piattaforma, governor disattivato")
+            self.enabled = False
+        
+        if self.enabled and self.budget_mb:
+            logger.info(f"Memoria: budget {self.budget_mb:,.0f} MB (soglia riduzione {self.soft_limit_mb:,.0f} MB)")
+    
+    def sample(self) -> float:
+        """Campiona la RSS corrente (MB) e aggiorna il picco."""
+        rss = get_current_rss_mb() or 0.0
+        if rss > self.peak_rss_mb:
+            self.peak_rss_mb = rss
+        return rss
+    
+    def check(self, context: str) -> bool:
+        """
+        Verifica la pressione di memoria e applica le contromisure.
+        
+        Args:
+            context: Descrizione del punto di controllo (per log)
+            
+        Returns:
+            True se la memoria è sotto pressione (strategie a basso consumo)
+            
+        Raises:
+            MemoryBudgetExceeded: Se la RSS supera il budget dopo il rilascio cache
+        """
+        if not self.enabled or not self.budget_mb:
+            return False
+        
+        rss = self.sample()
+        if rss < self.soft_limit_mb:
+            return self.low_memory
+        
+        if not self.low_memory:
+            self.low_memory = True
+            self.record_decision(context, 'low_memory_mode', rss,
+                                 "attivate strategie a basso consumo (lettura a blocchi, spill su disco)")
+            self.drop_caches(context)
+            rss = self.sample()
+        elif rss >= self.budget_mb:
+            # Ultimo tentativo prima di interrompere
+            self.drop_caches(context)
+            rss = self.sample()
+        
+        if rss >= self.budget_mb:
+            self.record_decision(context, 'abort', rss, "budget superato, elaborazione interrotta")
+            raise MemoryBudgetExceeded(
+                f"Budget memoria superato durante '{context}': RSS {rss:,.0f} MB oltre il limite "
+                f"di {self.budget_mb:,.0f} MB. Aumentare il budget (--memory-budget) o ridurre "
+                f"Config.CHUNK_SIZE"
+            )
+        return True
+    
+    def should_chunk(self, estimated_rows: Optional[int]) -> bool:
+        """
+        Indica se un file deve essere letto a blocchi.
+        
+        Legge a blocchi in modalità basso consumo, oltre Config.MAX_MEMORY_ROWS
+        (se impostato) o quando la stima del caricamento completo porterebbe
+        la RSS oltre la soglia soft del budget.
+        
+        Args:
+            estimated_rows: Righe stimate del file (None se ignote)
+            
+        Returns:
+            True se il file va letto a blocchi
+        """
+        if self.low_memory:
+            return True
+        if estimated_rows is None:
+            return False
+        if Config.MAX_MEMORY_ROWS is not None and estimated_rows > Config.MAX_MEMORY_ROWS:
+            return True
+        if not self.enabled or not self.budget_mb:
+            return False
+        return self.sample() + self.estimate_load_mb(estimated_rows) >= self.soft_limit_mb
+    
+    @staticmethod
+    def estimate_load_mb(estimated_rows: int) -> float:
+        """Stima la memoria (MB) del caricamento completo di un file .xlsx."""
+        return estimated_rows * Config.EXCEL_LOAD_MB_PER_ROW
+    
+    def maybe_spill(self, df, name: str):
+        """
+        Scarica un DataFrame su disco se la memoria è sotto pressione.
+        
+        Args:
+            df: DataFrame da scaricare
+            name: Nome descrittivo
+            
+        Returns:
+            SpilledFrame se scaricato, altrimenti il DataFrame originale
+        """
+        if not self.check(f"spill {name}"):
+            return df
+        
+        if self._spill_dir is None:
+            self._spill_dir = Path(tempfile.mkdtemp(prefix="var_spill_", dir=Config.SPILL_DIR))
+        
+        path = self._spill_dir / f"{name}.pkl"
+        with open(path, 'wb') as f:
+            pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+        
+        spilled = SpilledFrame(path, len(df), name)
+        self.record_decision(f"spill {name}", 'spill', self.sample(), f"{len(df):,} righe scaricate su {path}")
+        return spilled
+    
+    def register_cache(self, dropper: Callable[[], None]) -> None:
+        """Registra una funzione che libera cache non indispensabili."""
+        self._cache_droppers.append(dropper)
+    
+    def drop_caches(self, context: str) -> None:
+        """Libera le cache registrate ed esegue la garbage collection."""
+        for dropper in self._cache_droppers:
+            try:
+                dropper()
+            except Exception as e:
+                logger.debug(f"Memoria: errore rilascio cache: {e}")
+        collected = gc.collect()
+        self.record_decision(context, 'drop_caches', self.sample(),
+                             f"cache rilasciate, {collected} oggetti raccolti", level=logging.DEBUG)
+    
+    def cleanup(self) -> None:
+        """Rimuove i file di spill residui."""
+        if self._spill_dir is not None:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
+    
+    def record_decision(self, context: str, action: str, rss: Optional[float], message: str,
+                        level: int = logging.WARNING) -> None:
+        """
+        Registra e logga una decisione del governor.
+        
+        Args:
+            context: Punto di controllo
+            action: Codice decisione (chunked_read, spill, drop_caches, ...)
+            rss: RSS corrente in MB (None se non campionata)
+            message: Descrizione leggibile
+            level: Livello di log
+        """
+        rss = self.sample() if rss is None else rss
+        self.decisions.append({'context': context, 'action': action, 'rss_mb': round(rss, 1)})
+        budget = f"{self.budget_mb:,.0f}" if self.budget_mb else "n/d"
+        logger.log(level, f"Memoria [{context}]: RSS {rss:,.0f}/{budget} MB - {message}")
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Esportazione metriche Prometheus (textfile collector) per VAR Processor
+"""
+
+import os
+import time
+import logging
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_RECORD_TYPES = {
+    'matched': 'matched',
+    'post_vendita_only': 'post_vendita_only',
+    'ti_only': 'ti_only'
+}
+
+
+def _escape_label(value) -> str:
+    """Escape dei valori label secondo il formato testo Prometheus."""
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value) -> str:
+    """Formatta un valore numerico per il formato testo Prometheus."""
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class PrometheusTextfileExporter:
+    """
+    Scrive un file .prom per il textfile collector di node_exporter.
+    
+    Il file viene scritto in modo atomico (file temporaneo nella stessa
+    directory + rename) così il collector non legge mai un file parziale.
+    """
+    
+    def __init__(self, output_path, job: str = None):
+        """
+        Inizializza l'exporter.
+        
+        Args:
+            output_path: Path del file .prom
+            job: Valore della label job (default Config.PROMETHEUS_JOB)
+        """
+        self.output_path = Path(output_path)
+        self.job = job or Config.PROMETHEUS_JOB
+        self._families: Dict[str, Dict] = {}
+    
+    def add(self, name: str, value, help_text: str, metric_type: str = 'gauge',
+            labels: Optional[Dict[str, str]] = None) -> None:
+        """
+        Aggiunge un campione a una famiglia di metriche.
+        
+        Args:
+            name: Nome metrica (senza prefisso)
+            value: Valore numerico (None = campione ignorato)
+            help_text: Descrizione HELP
+            metric_type: Tipo Prometheus (gauge, counter)
+            labels: Label aggiuntive
+        """
+        if value is None:
+            return
+        
+        full_name = f"{Config.PROMETHEUS_PREFIX}_{name}"
+        family = self._families.setdefault(full_name, {'help': help_text, 'type': metric_type, 'samples': []})
+        family['samples'].append(({'job': self.job, **(labels or {})}, value))
+    
+    def render(self) -> str:
+        """Restituisce il contenuto del file in formato testo Prometheus."""
+        lines: List[str] = []
+        for name, family in self._families.items():
+            lines.append(f"# HELP {name} {family['help']}")
+            lines.append(f"# TYPE {name} {family['type']}")
+            for labels, value in family['samples']:
+                label_text = ','.join(f'{key}="{_escape_label(val)}"' for key, val in labels.items())
+                lines.append(f"{name}{{{label_text}}} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+    
+    def write(self) -> Path:
+        """
+        Scrive il file .prom in modo atomico.
+        
+        Returns:
+            Path del file scritto
+        """
+        directory = self.output_path.parent
+        directory.mkdir(parents=True, exist_ok=True)
+        
+        fd, tmp_name = tempfile.mkstemp(prefix=f".{self.output_path.name}.", suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(self.render())
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp_name, 0o644)
+            os.replace(tmp_name, self.output_path)
+        except Exception:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+        
+        logger.info(f"Metriche Prometheus salvate: {self.output_path}")
+        return self.output_path
+    
+    def collect_run(self, success: bool, stats: Optional[Dict] = None,
+                    source_stats: Optional[Dict] = None, profiler=None,
+                    memory_governor=None) -> 'PrometheusTextfileExporter':
+        """
+        Raccoglie le metriche di un'esecuzione.
+        
+        Args:
+            success: Esito dell'elaborazione
+            stats: Riepilogo statistiche (formato print_summary)
+            source_stats: Statistiche per sorgente (righe, IMEI validi/invalidi)
+            profiler: StageProfiler con durate e memoria per fase
+            memory_governor: MemoryGovernor (picco RSS e decisioni)
+            
+        Returns:
+            L'exporter stesso
+        """
+        self.add('last_run_timestamp_seconds', time.time(), 'Timestamp fine ultima esecuzione')
+        self.add('last_run_success', success, 'Esito ultima esecuzione (1 = successo)')
+        
+        for source, data in (source_stats or {}).items():
+            labels = {'source': source}
+            self.add('source_files', data.get('files'), 'File letti per sorgente', labels=labels)
+            self.add('source_rows', data.get('rows'), 'Righe lette per sorgente', labels=labels)
+            self.add('imei_valid', data.get('valid_imei'), 'IMEI validi per sorgente', labels=labels)
+            self.add('imei_invalid', data.get('invalid_imei'), 'IMEI non validi per sorgente', labels=labels)
+            self.add('imei_duplicate', data.get('duplicate_imei'), 'IMEI duplicati per sorgente', labels=labels)
+            self.add('imei_duplicate_rows', data.get('duplicate_rows'), 'Righe duplicate aggregate per sorgente',
+                     labels=labels)
+        
+        if stats:
+            for key, tipo in _RECORD_TYPES.items():
+                self.add('records', stats.get(key), 'Record di output per tipo di match', labels={'tipo': tipo})
+            self.add('records_total', stats.get('total_records'), 'Record di output totali')
+            self.add('difference_total_eur', stats.get('total_difference'), 'Somma colonna Differenza (EUR)')
+            self.add('difference_min_eur', stats.get('min_difference'), 'Differenza minima (EUR)')
+            self.add('difference_max_eur', stats.get('max_difference'), 'Differenza massima (EUR)')
+            for rule_name, count in (stats.get('rule_hits') or {}).items():
+                self.add('difference_rule_hits', count, 'Record per regola differenza applicata',
+                         labels={'rule': rule_name})
+        
+        if profiler is not None and profiler.enabled:
+            for record in profiler.records:
+                labels = {'stage': record.name}
+                self.add('stage_duration_seconds', record.wall_seconds, 'Durata wall per fase', labels=labels)
+                self.add('stage_cpu_seconds', record.cpu_seconds, 'Tempo CPU per fase', labels=labels)
+                if record.peak_rss_mb is not None:
+                    self.add('stage_peak_rss_bytes', int(record.peak_rss_mb * 1024 * 1024),
+                             'Picco RSS durante la fase (campionato)', labels=labels)
+                if record.rows is not None:
+                    self.add('stage_rows', record.rows, 'Righe elaborate per fase', labels=labels)
+            peak = profiler.to_dict()['peak_rss_mb']
+            if peak is not None:
+                self.add('peak_rss_bytes', int(peak * 1024 * 1024), "Picco RSS dell'intero run")
+        
+        if memory_governor is not None:
+            if memory_governor.budget_mb:
+                self.add('memory_budget_bytes', int(memory_governor.budget_mb * 1024 * 1024), 'Budget memoria configurato')
+            self.add('memory_low_memory_mode', memory_governor.low_memory, 'Modalità basso consumo attivata')
+            self.add('memory_decisions', len(memory_governor.decisions), 'Decisioni del governor memoria')
+        
+        return self
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Recupero near-match per IMEI malformati o non abbinati per VAR Processor
+"""
+
+import logging
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+IMEI_LENGTH = 15
+
+# Tipo di errore -> confidenza di base del candidato
+ERROR_SCORES = {
+    'CIFRA_CONTROLLO_MANCANTE': 0.95,  # 14 cifre = IMEI senza check digit
+    'CIFRE_INVERTITE': 0.85,           # Due cifre adiacenti scambiate
+    'CIFRA_ERRATA': 0.8,               # Una cifra sostituita
+    'CIFRA_MANCANTE': 0.75,            # 14 cifre, manca una cifra interna
+    'CIFRA_IN_PIU': 0.7,               # 16 cifre, una cifra in più
+    'PREFISSO_SERIALE': 0.6            # IMEI dentro un seriale più lungo
+}
+
+RESULT_COLUMNS = [
+    'ORIGINE', 'STATO', 'IMEI_ORIGINALE', 'RIFERIMENTO', 'IMEI_CANDIDATO',
+    'SORGENTE_CANDIDATO', 'TIPO_ERRORE', 'CONFIDENZA', 'CANDIDATO_ABBINATO'
+]
+
+
+def extract_digits(values: pd.Series) -> pd.Series:
+    """Estrae le cifre dai valori IMEI grezzi (numeri Excel senza il '.0' finale)."""
+    text = values.astype(str).str.strip().str.replace(r'\.0$', '', regex=True)
+    return text.str.replace(r'\D', '', regex=True)
+
+
+def _digit_matrix(imeis: pd.Series) -> np.ndarray:
+    """Matrice (IMEI x 15) delle cifre di IMEI da 15 cifre."""
+    digits = np.frombuffer(''.join(imeis.tolist()).encode('ascii'), dtype=np.uint8)
+    return digits.reshape(-1, IMEI_LENGTH).astype(np.int64) - 48
+
+
+def luhn_valid(imeis: pd.Series) -> np.ndarray:
+    """
+    Verifica vettoriale della cifra di controllo Luhn su IMEI di 15 cifre.
+    
+    Args:
+        imeis: IMEI di 15 cifre
+        
+    Returns:
+        Maschera booleana (True = check digit corretto)
+    """
+    if imeis.empty:
+        return np.zeros(0, dtype=bool)
+    digits = _digit_matrix(imeis)
+    doubled = digits[:, 1::2] * 2
+    total = digits[:, 0::2].sum(axis=1) + (doubled // 10 + doubled % 10).sum(axis=1)
+    return total % 10 == 0
+
+
+def _deletions(values: pd.Series, width: int) -> pd.DataFrame:
+    """Vicinato di cancellazione: una riga per (valore, posizione cancellata)."""
+    frames = [
+        pd.DataFrame({
+            'key': values.str.slice(0, position) + values.str.slice(position + 1),
+            'pos': position,
+            'row': values.index
+        })
+        for position in range(width)
+    ]
+    return pd.concat(frames, ignore_index=True)
+
+
+class IMEINearMatchIndex:
+    """
+    Indice degli IMEI validi di una sorgente per la ricerca di near-match.
+    
+    Contiene gli IMEI esatti e il vicinato di cancellazione (15 varianti da
+    14 cifre per IMEI, che include il prefisso senza check digit): ogni
+    query diventa un join sulle chiavi invece di un confronto a coppie.
+    """
+    
+    def __init__(self, imeis: pd.Series):
+        """
+        Costruisce l'indice.
+        
+        Args:
+            imeis: IMEI validi (15 cifre) della sorgente
+        """
+        self.imeis = pd.Series(pd.unique(imeis.astype(str)), dtype=object)
+        self.deletions = _deletions(self.imeis, IMEI_LENGTH)
+        self.deletions['candidate'] = self.imeis.to_numpy()[self.deletions['row'].to_numpy()]
+        self.deletions = self.deletions.drop(columns='row')
+    
+    def __len__(self) -> int:
+        return len(self.imeis)
+    
+    def candidates(self, digits: pd.Series) -> pd.DataFrame:
+        """
+        Propone candidati per le cifre estratte dalle righe da recuperare.
+        
+        Args:
+            digits: Cifre della query (indice = identificativo della query)
+            
+        Returns:
+            DataFrame con colonne query, IMEI_CANDIDATO, TIPO_ERRORE
+        """
+        lengths = digits.str.len()
+        found = [
+            self._missing_digit(digits[lengths == IMEI_LENGTH - 1]),
+            self._changed_digits(digits[lengths == IMEI_LENGTH]),
+            self._extra_digit(digits[lengths == IMEI_LENGTH + 1]),
+            self._serial_windows(digits[lengths > IMEI_LENGTH + 1])
+        ]
+        found = [frame for frame in found if not frame.empty]
+        if not found:
+            return pd.DataFrame(columns=['query', 'IMEI_CANDIDATO', 'TIPO_ERRORE'])
+        return pd.concat(found, ignore_index=True)
+    
+    def _missing_digit(self, queries: pd.Series) -> pd.DataFrame:
+        """14 cifre: la query coincide con una cancellazione dell'IMEI candidato."""
+        if queries.empty:
+            return pd.DataFrame()
+        joined = pd.DataFrame({'key': queries.to_numpy(), 'query': queries.index}).merge(self.deletions, on='key')
+        joined['TIPO_ERRORE'] = np.where(joined['pos'] == IMEI_LENGTH - 1, 'CIFRA_CONTROLLO_MANCANTE', 'CIFRA_MANCANTE')
+        return joined.rename(columns={'candidate': 'IMEI_CANDIDATO'})[['query', 'IMEI_CANDIDATO', 'TIPO_ERRORE']]
+    
+    def _changed_digits(self, queries: pd.Series) -> pd.DataFrame:
+        """15 cifre: cancellazioni condivise (cifra errata, cifre invertite)."""
+        if queries.empty:
+            return pd.DataFrame()
+        query_deletions = _deletions(queries, IMEI_LENGTH).rename(columns={'row': 'query'})
+        joined = query_deletions.merge(self.deletions, on='key', suffixes=('_query', '_candidate'))
+        joined['value'] = queries.loc[joined['query']].to_numpy()
+        joined = joined[joined['value'] != joined['candidate']]
+        if joined.empty:
+            return pd.DataFrame()
+        
+        # Cancellazioni in posizioni adiacenti: inversione se le due cifre sono scambiate
+        same_position = (joined['pos_query'] == joined['pos_candidate']).to_numpy()
+        adjacent = ((joined['pos_query'] - joined['pos_candidate']).abs() == 1).to_numpy()
+        first = np.minimum(joined['pos_query'], joined['pos_candidate']).to_numpy()
+        second = np.minimum(first + 1, IMEI_LENGTH - 1)
+        query_digits = _digit_matrix(joined['value'])
+        candidate_digits = _digit_matrix(joined['candidate'])
+        rows = np.arange(len(joined))
+        swapped = (adjacent
+                   & (query_digits[rows, first] == candidate_digits[rows, second])
+                   & (query_digits[rows, second] == candidate_digits[rows, first]))
+        joined['TIPO_ERRORE'] = np.select([same_position, swapped], ['CIFRA_ERRATA', 'CIFRE_INVERTITE'], '')
+        
+        # Due modifiche distinte (cancellazioni non allineate né invertite): troppo rumorose
+        joined = joined[joined['TIPO_ERRORE'] != '']
+        return joined.rename(columns={'candidate': 'IMEI_CANDIDATO'})[['query', 'IMEI_CANDIDATO', 'TIPO_ERRORE']]
+    
+    def _extra_digit(self, queries: pd.Series) -> pd.DataFrame:
+        """16 cifre: una cancellazione della query coincide con l'IMEI candidato."""
+        if queries.empty:
+            return pd.DataFrame()
+        query_deletions = _deletions(queries, IMEI_LENGTH + 1)
+        joined = query_deletions.merge(self.imeis.rename('key').to_frame(), on='key')
+        joined = joined.rename(columns={'row': 'query', 'key': 'IMEI_CANDIDATO'})
+        joined['TIPO_ERRORE'] = 'CIFRA_IN_PIU'
+        return joined[['query', 'IMEI_CANDIDATO', 'TIPO_ERRORE']]
+    
+    def _serial_windows(self, queries: pd.Series) -> pd.DataFrame:
+        """Seriali più lunghi: finestre di 15 cifre consecutive."""
+        if queries.empty:
+            return pd.DataFrame()
+        max_start = int(queries.str.len().max()) - IMEI_LENGTH
+        windows = pd.concat([
+            pd.DataFrame({'key': queries.str.slice(start, start + IMEI_LENGTH), 'query': queries.index})
+            for start in range(max_start + 1)
+        ], ignore_index=True)
+        windows = windows[windows['key'].str.len() == IMEI_LENGTH]
+        joined = windows.merge(self.imeis.rename('key').to_frame(), on='key')
+        joined = joined.rename(columns={'key': 'IMEI_CANDIDATO'})
+        joined['TIPO_ERRORE'] = 'PREFISSO_SERIALE'
+        return joined[['query', 'IMEI_CANDIDATO', 'TIPO_ERRORE']]
+
+
+def recover_near_matches(queries: pd.DataFrame, indexes: Dict[str, IMEINearMatchIndex],
+                         matched_imeis: Optional[pd.Series] = None) -> pd.DataFrame:
+    """
+    Propone gli IMEI candidati per le righe scartate o non abbinate.
+    
+    La confidenza parte dal tipo di errore ed è ridotta del 10% se il
+    candidato non ha un check digit Luhn valido, dimezzata se il candidato
+    è già abbinato o se la query di 15 cifre ha già un check digit valido
+    (Luhn rileva ogni cifra errata: un refuso è improbabile), infine
+    ripartita tra i candidati della stessa riga.
+    
+    Args:
+        queries: Righe da recuperare con colonne ORIGINE, STATO, IMEI_ORIGINALE,
+                 RIFERIMENTO e CERCA_IN (sorgente in cui cercare)
+        indexes: Indici per sorgente
+        matched_imeis: IMEI già abbinati (segnalati in CANDIDATO_ABBINATO)
+        
+    Returns:
+        DataFrame RESULT_COLUMNS ordinato per confidenza decrescente
+    """
+    if queries.empty:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+    
+    queries = queries.reset_index(drop=True)
+    digits = extract_digits(queries['IMEI_ORIGINALE'])
+    
+    found = []
+    for source, index in indexes.items():
+        mask = (queries['CERCA_IN'] == source).to_numpy()
+        if not mask.any() or not len(index):
+            continue
+        candidates = index.candidates(digits[mask])
+        if not candidates.empty:
+            candidates['SORGENTE_CANDIDATO'] = source
+            found.append(candidates)
+    
+    if not found:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+    
+    candidates = pd.concat(found, ignore_index=True)
+    candidates['CONFIDENZA'] = candidates['TIPO_ERRORE'].map(ERROR_SCORES)
+    candidates = (candidates.sort_values('CONFIDENZA', ascending=False, kind='stable')
+                  .drop_duplicates(['query', 'IMEI_CANDIDATO']))
+    
+    # Check digit, candidati già abbinati e ripartizione tra i candidati della stessa riga
+    matched = matched_imeis if matched_imeis is not None else pd.Series([], dtype=object)
+    candidates['CANDIDATO_ABBINATO'] = candidates['IMEI_CANDIDATO'].isin(matched).to_numpy()
+    query_digits = digits.loc[candidates['query']].reset_index(drop=True)
+    query_luhn = np.zeros(len(candidates), dtype=bool)
+    full_length = (query_digits.str.len() == IMEI_LENGTH).to_numpy()
+    query_luhn[full_length] = luhn_valid(query_digits[full_length])
+    
+    luhn = luhn_valid(candidates['IMEI_CANDIDATO'].astype(str))
+    per_query = candidates.groupby('query')['IMEI_CANDIDATO'].transform('size')
+    factor = (np.where(luhn, 1.0, 0.9)
+              * np.where(candidates['CANDIDATO_ABBINATO'], 0.5, 1.0)
+              * np.where(query_luhn, 0.5, 1.0))
+    candidates['CONFIDENZA'] = (candidates['CONFIDENZA'] * factor / per_query).round(3)
+    candidates = candidates[candidates['CONFIDENZA'] >= Config.NEAR_MATCH_MIN_CONFIDENCE]
+    candidates = (candidates.sort_values(['query', 'CONFIDENZA'], ascending=[True, False], kind='stable')
+                  .groupby('query').head(Config.NEAR_MATCH_MAX_CANDIDATES))
+    
+    result = queries.loc[candidates['query'].to_numpy(), ['ORIGINE', 'STATO', 'IMEI_ORIGINALE', 'RIFERIMENTO']]
+    result = result.reset_index(drop=True)
+    for col in ('IMEI_CANDIDATO', 'SORGENTE_CANDIDATO', 'TIPO_ERRORE', 'CONFIDENZA', 'CANDIDATO_ABBINATO'):
+        result[col] = candidates[col].to_numpy()
+    result['IMEI_ORIGINALE'] = result['IMEI_ORIGINALE'].astype(str)
+    
+    return result.sort_values('CONFIDENZA', ascending=False, kind='stable').reset_index(drop=True)[RESULT_COLUMNS]
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Stima preventiva di tempi, memoria e strategia di elaborazione (--plan)
+
+Le righe dei file .xlsx sono lette dall'attributo <dimension> del foglio
+(nessuna cella letta): il piano si calcola in pochi millisecondi anche su
+file molto grandi.
+"""
+
+import os
+import json
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from config import Config
+from utils.preflight import discover_input_files
+from utils.excel_reader import count_excel_rows
+
+logger = logging.getLogger(__name__)
+
+SOURCES = ('post_vendita', 'ti', 'data')
+
+# Fasi di VARProcessor.run e righe che ne determinano il costo ('total' = post vendita + TI)
+STAGE_DRIVERS = {
+    'load_post_vendita': 'post_vendita',
+    'load_ti': 'ti',
+    'load_financial': 'data',
+    'matching': 'total',
+    'near_match': 'total',
+    'anomalies': 'total',
+    'statistics': 'total',
+    'excel_output': 'total'
+}
+
+STRATEGY_IN_MEMORY = 'in-memory'
+STRATEGY_CHUNKED = 'chunked'
+STRATEGY_OUT_OF_CORE = 'out-of-core'
+
+
+def inspect_inputs(input_dir: Path) -> Dict[str, Dict]:
+    """
+    Rileva file, dimensioni e righe delle sorgenti senza leggere le celle.
+    
+    Args:
+        input_dir: Directory di input
+        
+    Returns:
+        Dict sorgente -> {'files', 'bytes', 'rows', 'unknown_bytes'}; le righe
+        dei file senza metadati (.xls, HTML) sono escluse da 'rows' e il loro
+        peso è in 'unknown_bytes'
+    """
+    files = discover_input_files(Path(input_dir))
+    inputs = {}
+    for source in SOURCES:
+        info = {'files': len(files[source]), 'bytes': 0, 'rows': 0, 'unknown_bytes': 0}
+        for path in files[source]:
+            size = os.path.getsize(path)
+            rows = count_excel_rows(path)
+            info['bytes'] += size
+            if rows is None:
+                info['unknown_bytes'] += size
+            else:
+                info['rows'] += rows
+        inputs[source] = info
+    return inputs
+
+
+def driver_rows(rows: Dict[str, int], driver: str) -> int:
+    """Righe che determinano il costo di una fase."""
+    if driver == 'total':
+        return rows.get('post_vendita', 0) + rows.get('ti', 0)
+    return rows.get(driver, 0)
+
+
+def _fit_line(x: List[float], y: List[float]) -> List[float]:
+    """Retta ai minimi quadrati [costo fisso, costo per riga] con coefficienti non negativi."""
+    import numpy as np
+    
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    if len(x) < 2 or np.ptp(x) == 0:
+        return [float(y.mean()) if len(y) else 0.0, 0.0]
+    
+    slope, intercept = np.polyfit(x, y, 1)
+    if intercept < 0:
+        intercept, slope = 0.0, float((x * y).sum() / (x * x).sum())
+    if slope < 0:
+        intercept, slope = float(y.mean()), 0.0
+    return [round(float(intercept), 6), float(f"{slope:.6g}")]
+
+
+class CostModel:
+    """
+    Modello lineare di costo per fase: costo fisso + costo per riga.
+    
+    I coefficienti di tempo (secondi) e memoria (RSS in MB a fine fase e
+    picco del run) sono stimati da un benchmark di calibrazione
+    (benchmarks/run_benchmarks.py --calibrate) sulla macchina di riferimento.
+    """
+    
+    def __init__(self, data: Dict, source: str):
+        """
+        Inizializza il modello.
+        
+        Args:
+            data: Coefficienti (formato fit)
+            source: Provenienza (file di calibrazione o modello predefinito)
+        """
+        self.data = data
+        self.source = source
+    
+    @property
+    def calibrated(self) -> bool:
+        """True se il modello proviene da una calibrazione."""
+        return bool(self.data.get('calibrated'))
+    
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> 'CostModel':
+        """
+        Carica il modello di calibrazione (predefinito se assente).
+        
+        Args:
+            path: File JSON di calibrazione (default Config.PLAN_CALIBRATION_FILE)
+            
+        Returns:
+            Modello di costo
+        """
+        path = Path(path or Config.PLAN_CALIBRATION_FILE)
+        if path.exists():
+            with open(path, 'r', encoding='utf-8') as f:
+                return cls(json.load(f), str(path))
+        logger.warning(f"Calibrazione {path} non trovata: stima con modello predefinito")
+        return cls(Config.PLAN_DEFAULT_MODEL, 'modello predefinito')
+    
+    @staticmethod
+    def fit(samples: List[Dict]) -> Dict:
+        """
+        Stima i coefficienti dai run di calibrazione.
+        
+        Args:
+            samples: Run misurati con chiavi 'rows', 'bytes' (per sorgente),
+                'stages' (fase -> {'seconds', 'rss_mb'}) e 'peak_rss_mb'
+                
+        Returns:
+            Coefficienti serializzabili in JSON
+        """
+        stages = {}
+        for stage, driver in STAGE_DRIVERS.items():
+            measured = [s for s in samples if stage in s['stages']]
+            if not measured:
+                continue
+            x = [driver_rows(s['rows'], driver) for s in measured]
+            totals = [driver_rows(s['rows'], 'total') for s in measured]
+            stages[stage] = {
+                'seconds': _fit_line(x, [s['stages'][stage]['seconds'] for s in measured]),
+                'rss_mb': _fit_line(totals, [s['stages'][stage]['rss_mb'] for s in measured])
+            }
+        
+        bytes_per_row = {}
+        for source in SOURCES:
+            rows = sum(s['rows'].get(source, 0) for s in samples)
+            size = sum(s['bytes'].get(source, 0) for s in samples)
+            if rows:
+                bytes_per_row[source] = round(size / rows, 2)
+        
+        return {
+            'calibrated': True,
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'cpu_count': os.cpu_count(),
+            'scales': sorted(driver_rows(s['rows'], 'total') for s in samples),
+            'stages': stages,
+            'peak_rss_mb': _fit_line([driver_rows(s['rows'], 'total') for s in samples],
+                                     [s['peak_rss_mb'] for s in samples]),
+            'bytes_per_row': bytes_per_row
+        }
+    
+    @staticmethod
+    def save(data: Dict, path: Optional[str] = None) -> Path:
+        """Salva i coefficienti di calibrazione in JSON."""
+        path = Path(path or Config.PLAN_CALIBRATION_FILE)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+        return path
+    
+    def estimate_rows(self, source: str, size_bytes: int) -> int:
+        """Stima le righe di un file senza metadati dalla dimensione."""
+        bytes_per_row = self.data.get('bytes_per_row', {}).get(source)
+        return int(size_bytes / bytes_per_row) if bytes_per_row else 0
+    
+    def predict(self, rows: Dict[str, int]) -> Dict:
+        """
+        Prevede tempo e memoria per fase.
+        
+        Args:
+            rows: Righe per sorgente
+            
+        Returns:
+            Dict con 'stages' (fase -> {'rows', 'seconds', 'rss_mb'}),
+            'total_seconds' e 'peak_rss_mb'
+        """
+        total = driver_rows(rows, 'total')
+        stages = {}
+        for stage, driver in STAGE_DRIVERS.items():
+            coefficients = self.data['stages'].get(stage)
+            if coefficients is None:
+                continue
+            stage_rows = driver_rows(rows, driver)
+            seconds = coefficients['seconds'][0] + coefficients['seconds'][1] * stage_rows
+            rss = coefficients['rss_mb'][0] + coefficients['rss_mb'][1] * total
+            stages[stage] = {'rows': stage_rows, 'seconds': seconds, 'rss_mb': rss}
+        
+        peak = self.data['peak_rss_mb'][0] + self.data['peak_rss_mb'][1] * total
+        peak = max([peak] + [stage['rss_mb'] for stage in stages.values()])
+        return {
+            'stages': stages,
+            'total_seconds': sum(stage['seconds'] for stage in stages.values()),
+            'peak_rss_mb': peak
+        }
+
+
+def recommend_strategy(peak_mb: float, budget_mb: Optional[float]) -> Tuple[str, str]:
+    """
+    Sceglie la strategia di elaborazione dal picco di memoria previsto.
+    
+    Args:
+        peak_mb: Picco RSS previsto
+        budget_mb: Budget memoria (None = non determinabile)
+        
+    Returns:
+        Tuple con (strategia, motivazione)
+    """
+    if not budget_mb:
+        return STRATEGY_IN_MEMORY, "budget memoria non determinabile: verificare la RAM della VM"
+    
+    soft_limit = budget_mb * Config.MEMORY_SOFT_RATIO
+    if peak_mb <= soft_limit:
+        return STRATEGY_IN_MEMORY, (f"picco previsto {peak_mb:,.0f} MB entro la soglia "
+                                    f"{soft_limit:,.0f} MB del budget")
+    if peak_mb <= budget_mb:
+        return STRATEGY_CHUNKED, (f"picco previsto {peak_mb:,.0f} MB oltre la soglia {soft_limit:,.0f} MB: "
+                                  f"lettura a blocchi e spill dei DataFrame intermedi")
+    return STRATEGY_OUT_OF_CORE, (f"picco previsto {peak_mb:,.0f} MB oltre il budget {budget_mb:,.0f} MB: "
+                                  f"spill su disco (SPILL_DIR) e VM con più memoria")
+
+
+def build_plan(input_dir: Path, budget_mb: Optional[float] = None,
+               model: Optional[CostModel] = None) -> Dict:
+    """
+    Calcola il piano di esecuzione per una directory di input.
+    
+    Args:
+        input_dir: Directory di input
+        budget_mb: Budget memoria (None = come MemoryGovernor: Config o quota RAM)
+        model: Modello di costo (default CostModel.load())
+        
+    Returns:
+        Dict con input, previsioni per fase, strategia e RAM consigliata
+    """
+    from utils.memory import get_total_memory_mb
+    
+    model = model or CostModel.load()
+    inputs = inspect_inputs(input_dir)
+    
+    rows = {}
+    for source, info in inputs.items():
+        info['estimated_rows'] = model.estimate_rows(source, info['unknown_bytes']) if info['unknown_bytes'] else 0
+        rows[source] = info['rows'] + info['estimated_rows']
+    
+    prediction = model.predict(rows)
+    
+    total_memory = get_total_memory_mb()
+    if budget_mb is None:
+        budget_mb = Config.MEMORY_BUDGET_MB or (total_memory * Config.MEMORY_BUDGET_RATIO if total_memory else None)
+    strategy, reason = recommend_strategy(prediction['peak_rss_mb'], budget_mb)
+    
+    # RAM della VM perché il picco resti sotto la soglia a basso consumo del governor
+    recommended_ram = prediction['peak_rss_mb'] / (Config.MEMORY_BUDGET_RATIO * Config.MEMORY_SOFT_RATIO)
+    
+    workers = None
+    cpu_count = os.cpu_count() or 1
+    matching = prediction['stages'].get('matching')
+    if (cpu_count > 1 and matching and matching['rows'] >= Config.PARALLEL_MATCHING_MIN_ROWS):
+        workers = min(cpu_count, 8)
+    
+    return {
+        'input_dir': str(input_dir),
+        'inputs': inputs,
+        'rows': rows,
+        'model': model.source,
+        'calibrated': model.calibrated,
+        'stages': prediction['stages'],
+        'total_seconds': prediction['total_seconds'],
+        'peak_rss_mb': prediction['peak_rss_mb'],
+        'budget_mb': budget_mb,
+        'total_memory_mb': total_memory,
+        'strategy': strategy,
+        'reason': reason,
+        'recommended_ram_mb': recommended_ram,
+        'recommended_workers': workers
+    }
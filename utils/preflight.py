@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Validazione pre-flight leggera dei file di input per VAR Processor
+
+Usa solo la libreria standard (più utils.excel_reader, che importa pandas
+solo per i file .xls): la validazione deve partire in pochi millisecondi.
+"""
+
+import os
+import fnmatch
+import logging
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def discover_input_files(input_dir: Path) -> Dict[str, List[Path]]:
+    """
+    Individua i file di input con un solo listing della directory.
+    
+    Rispetta la priorità dei pattern di Config (primo pattern con match vince
+    per post vendita e dati finanziari).
+    
+    Args:
+        input_dir: Directory di input
+        
+    Returns:
+        Dict con chiavi 'post_vendita', 'ti', 'data' e liste di Path
+    """
+    names = [entry.name for entry in os.scandir(input_dir) if entry.is_file()]
+    
+    def first_match(patterns: List[str]) -> List[Path]:
+        for pattern in patterns:
+            matches = fnmatch.filter(names, pattern)
+            if matches:
+                return [input_dir / matches[0]]
+        return []
+    
+    return {
+        'post_vendita': first_match(Config.POST_VENDITA_PATTERNS),
+        'ti': [input_dir / name for name in fnmatch.filter(names, Config.TI_PATTERN)],
+        'data': first_match(Config.DATA_PATTERNS)
+    }
+
+
+def _check_file_header(file_path: Path, required_columns: List[str]) -> Dict:
+    """Legge l'intestazione di un file e verifica le colonne richieste."""
+    from utils.excel_reader import read_excel_header
+    
+    try:
+        header = read_excel_header(file_path)
+    except Exception as e:
+        return {'file': file_path.name, 'error': str(e), 'missing': []}
+    
+    present = set(header)
+    missing = [col for col in required_columns if col not in present]
+    return {'file': file_path.name, 'error': None, 'missing': missing}
+
+
+def validate_input_headers(files: Dict[str, List[Path]], workers: Optional[int] = None) -> List[Dict]:
+    """
+    Verifica in parallelo le colonne richieste leggendo solo le intestazioni.
+    
+    Args:
+        files: File di input (output di discover_input_files)
+        workers: Thread paralleli (default Config.VALIDATION_WORKERS)
+        
+    Returns:
+        Lista di esiti per file con chiavi 'file', 'error', 'missing'
+    """
+    required = {
+        'post_vendita': Config.POST_VENDITA_REQUIRED_COLUMNS,
+        'ti': Config.TI_REQUIRED_COLUMNS,
+        'data': Config.DATA_REQUIRED_COLUMNS
+    }
+    jobs = [(path, required[source]) for source, paths in files.items() for path in paths]
+    if not jobs:
+        return []
+    
+    workers = max(1, min(workers or Config.VALIDATION_WORKERS, len(jobs)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda job: _check_file_header(*job), jobs))
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Profiler per fasi di elaborazione VAR Processor
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import tracemalloc
+from pathlib import Path
+from datetime import datetime
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def get_current_rss_mb() -> Optional[float]:
+    """
+    Restituisce la memoria residente (RSS) corrente del processo in MB.
+    
+    Returns:
+        RSS in MB o None se non determinabile
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, AttributeError, IndexError):
+        pass
+    
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except Exception:
+        return None
+
+
+def get_peak_rss_mb() -> Optional[float]:
+    """
+    Restituisce il picco di memoria residente dall'avvio del processo in MB.
+    
+    È il massimo dell'intero run (ru_maxrss non si azzera): per il picco di
+    una singola fase si usa RSSSampler.
+    
+    Returns:
+        Picco RSS in MB o None se non determinabile
+    """
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux riporta KB, macOS byte
+        divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+        return peak / divisor
+    
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / (1024 * 1024)
+    except Exception:
+        return None
+
+
+class RSSSampler:
+    """
+    Campiona la RSS corrente in un thread di background per misurare il picco di una fase.
+    
+    Una lettura di /proc/self/statm ogni `interval` secondi: il picco è il
+    massimo tra i campioni e le letture a inizio e fine fase.
+    """
+    
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.peak_mb = None
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def _sample(self) -> None:
+        rss = get_current_rss_mb()
+        if rss is not None and (self.peak_mb is None or rss > self.peak_mb):
+            self.peak_mb = rss
+    
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+    
+    def start(self) -> 'RSSSampler':
+        """Avvia il campionamento."""
+        self._sample()
+        self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self) -> Optional[float]:
+        """Ferma il campionamento e restituisce il picco in MB."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._sample()
+        return self.peak_mb
+
+
+class StageRecord:
+    """Misure di una singola fase."""
+    
+    __slots__ = ('name', 'rows', 'wall_seconds', 'cpu_seconds',
+                 'rss_mb', 'peak_rss_mb', 'tracemalloc_peak_mb', 'extra')
+    
+    def __init__(self, name: str):
+        self.name = name
+        self.rows = None
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.rss_mb = None
+        self.peak_rss_mb = None
+        self.tracemalloc_peak_mb = None
+        self.extra = {}
+    
+    def to_dict(self) -> Dict:
+        """Restituisce le misure come dict serializzabile."""
+        data = {
+            'name': self.name,
+            'rows': self.rows,
+            'wall_seconds': round(self.wall_seconds, 4),
+            'cpu_seconds': round(self.cpu_seconds, 4),
+            'rss_mb': _round_or_none(self.rss_mb),
+            'peak_rss_mb': _round_or_none(self.peak_rss_mb),
+            'tracemalloc_peak_mb': _round_or_none(self.tracemalloc_peak_mb)
+        }
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+
+class _NullStage:
+    """Fase no-op usata quando il profiling è disabilitato."""
+    
+    __slots__ = ()
+    rows = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+    
+    def __setattr__(self, name, value):
+        # Ignora rows/extra senza costi
+        pass
+    
+    @property
+    def extra(self) -> Dict:
+        return {}
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _ActiveStage:
+    """Context manager che misura una fase del profiler."""
+    
+    def __init__(self, profiler: 'StageProfiler', record: StageRecord):
+        self._profiler = profiler
+        self._record = record
+        self._wall_start = 0.0
+        self._cpu_start = 0.0
+        self._sampler = None
+    
+    @property
+    def rows(self):
+        return self._record.rows
+    
+    @rows.setter
+    def rows(self, value):
+        self._record.rows = int(value) if value is not None else None
+    
+    @property
+    def extra(self) -> Dict:
+        return self._record.extra
+    
+    def __enter__(self):
+        if self._profiler.trace_memory and tracemalloc.is_tracing() and hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        self._sampler = RSSSampler(self._profiler.rss_interval).start()
+        self._cpu_start = time.process_time()
+        self._wall_start = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        record = self._record
+        record.wall_seconds = time.perf_counter() - self._wall_start
+        record.cpu_seconds = time.process_time() - self._cpu_start
+        record.peak_rss_mb = self._sampler.stop()
+        record.rss_mb = get_current_rss_mb()
+        
+        if self._profiler.trace_memory and tracemalloc.is_tracing():
+            record.tracemalloc_peak_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        
+        if exc_type is not None:
+            record.extra['failed'] = True
+        
+        self._profiler.records.append(record)
+        logger.debug(f"Fase {record.name}: {record.wall_seconds:.3f}s wall, "
+                     f"{record.cpu_seconds:.3f}s CPU, righe={record.rows}")
+        return False
+
+
+class StageProfiler:
+    """
+    Profiler a fasi per il workflow VAR.
+    
+    Misura tempo wall, tempo CPU, memoria RSS (a fine fase e picco della
+    fase, campionato), picco tracemalloc (opzionale) e righe elaborate per
+    ogni fase; il picco dell'intero run è in to_dict()['peak_rss_mb']. Se
+    disabilitato ogni fase è un context manager no-op condiviso.
+    """
+    
+    def __init__(self, enabled: bool = False, trace_memory: bool = False,
+                 rss_interval: Optional[float] = None):
+        """
+        Inizializza il profiler.
+        
+        Args:
+            enabled: Se attivare le misure
+            trace_memory: Se attivare tracemalloc (overhead significativo)
+            rss_interval: Secondi tra i campioni RSS di fase (default Config.PROFILE_RSS_SAMPLE_SECONDS)
+        """
+        if rss_interval is None:
+            from config import Config
+            rss_interval = Config.PROFILE_RSS_SAMPLE_SECONDS
+        self.enabled = enabled
+        self.trace_memory = enabled and trace_memory
+        self.rss_interval = rss_interval
+        self.records: List[StageRecord] = []
+        self.started_at = datetime.now()
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+    
+    def stage(self, name: str):
+        """
+        Restituisce un context manager che misura la fase indicata.
+        
+        Args:
+            name: Nome della fase
+            
+        Returns:
+            Context manager con attributi `rows` ed `extra` impostabili
+        """
+        if not self.enabled:
+            return _NULL_STAGE
+        return _ActiveStage(self, StageRecord(name))
+    
+    def get_stage(self, name: str) -> Optional[StageRecord]:
+        """Restituisce l'ultima misura registrata per una fase."""
+        for record in reversed(self.records):
+            if record.name == name:
+                return record
+        return None
+    
+    def to_dict(self) -> Dict:
+        """Restituisce tutte le misure come dict serializzabile."""
+        return {
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'total_wall_seconds': round(time.perf_counter() - self._wall_start, 4),
+            'total_cpu_seconds': round(time.process_time() - self._cpu_start, 4),
+            'peak_rss_mb': _round_or_none(get_peak_rss_mb()),
+            'stages': [record.to_dict() for record in self.records]
+        }
+    
+    def write_json(self, output_path: Path) -> Optional[Path]:
+        """
+        Scrive le metriche in formato JSON.
+        
+        Args:
+            output_path: Path del file JSON
+            
+        Returns:
+            Path del file scritto o None se profiling disabilitato
+        """
+        if not self.enabled:
+            return None
+        
+        output_path = Path(output_path)
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2, ensure_ascii=False)
+        
+        logger.info(f"Metriche fasi salvate: {output_path}")
+        return output_path
+    
+    def stop(self) -> None:
+        """Ferma tracemalloc se avviato dal profiler."""
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+    
+    @staticmethod
+    def metrics_path_for(report_path) -> Path:
+        """Restituisce il path del file metriche associato a un report."""
+        from config import Config
+        report_path = Path(report_path)
+        return report_path.with_name(f"{report_path.stem}{Config.METRICS_SUFFIX}")
+
+
+def _round_or_none(value: Optional[float], decimals: int = 2) -> Optional[float]:
+    """Arrotonda valori opzionali."""
+    return round(value, decimals) if value is not None else None
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Confronto tra due report VAR (comando diff)
+
+Ogni riga è ridotta a un hash vettoriale (pd.util.hash_pandas_object) e le
+righe sono allineate per IMEI con codici interi: il confronto è lineare e
+le differenze colonna per colonna sono calcolate solo sugli IMEI con hash
+diverso. Gli snapshot Parquet dei report Excel conservano l'hash delle righe.
+"""
+
+import logging
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from config import Config
+from utils.archive import ReportArchive, PERIOD_COLUMN, RUN_COLUMN
+from utils.columnar import write_table, read_table, PARQUET_SUFFIX, CSV_SUFFIX, HAS_PYARROW
+
+logger = logging.getLogger(__name__)
+
+try:
+    import python_calamine  # noqa: F401 - lettore xlsx in Rust usato da pandas (engine 'calamine')
+    EXCEL_ENGINE = 'calamine'
+except ImportError:
+    EXCEL_ENGINE = None
+
+HASH_COLUMN = '_HASH_RIGA'
+OCCURRENCE_COLUMN = '_OCCORRENZA'
+CHANGE_COLUMNS = ['Colonna', 'Valore A', 'Valore B', 'Delta']
+COLUMNAR_SUFFIXES = (PARQUET_SUFFIX, CSV_SUFFIX)
+
+
+def cache_path_for(report_path) -> Path:
+    """
+    Restituisce lo snapshot colonnare di un report Excel.
+    
+    Il nome contiene l'impronta del file (nome, dimensione, data di modifica):
+    un report riscritto non riusa lo snapshot precedente.
+    
+    Args:
+        report_path: Path del report .xlsx
+        
+    Returns:
+        Path dello snapshot Parquet
+    """
+    path = Path(report_path)
+    cache_dir = Path(Config.DIFF_CACHE_DIR) if Config.DIFF_CACHE_DIR else path.parent / Config.DIFF_CACHE_DEFAULT_DIR
+    return cache_dir / f"{path.stem}_{ReportArchive.run_fingerprint([path])}{PARQUET_SUFFIX}"
+
+
+def normalize_report(df: pd.DataFrame, key: str) -> pd.DataFrame:
+    """Rende uniformi i tipi (testo misto, NaN) per hash e snapshot colonnare."""
+    df = df.copy()
+    for col in df.columns:
+        series = df[col]
+        if (isinstance(series.dtype, pd.CategoricalDtype) or pd.api.types.is_object_dtype(series.dtype)
+                or pd.api.types.is_string_dtype(series.dtype)):
+            # 'nan' è il testo di un valore mancante convertito con str()
+            df[col] = series.astype(object).where(series.notna(), '').astype(str).replace('nan', '')
+        elif len(series) and series.isna().all():
+            # Colonna vuota letta da Excel come float: testo vuoto come negli altri formati
+            df[col] = ''
+    df[key] = df[key].astype(str).str.strip()
+    return df
+
+
+def value_columns(df: pd.DataFrame, key: str) -> List[str]:
+    """Colonne confrontate (tutte tranne chiave e hash)."""
+    return [col for col in df.columns if col not in (key, HASH_COLUMN)]
+
+
+def row_hashes(df: pd.DataFrame, columns: List[str]) -> np.ndarray:
+    """Hash vettoriale di ogni riga sulle colonne indicate."""
+    return pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+
+
+def load_report(path, key: str = 'IMEI', use_cache: bool = True) -> pd.DataFrame:
+    """
+    Carica le righe di un report per il confronto.
+    
+    File colonnari (partizioni dell'archivio, export .parquet/.csv) sono letti
+    direttamente. Un report .xlsx è letto una sola volta (foglio principale)
+    e salvato come snapshot Parquet con l'hash delle righe: i confronti
+    successivi leggono lo snapshot.
+    
+    Args:
+        path: Report .xlsx o file colonnare
+        key: Colonna chiave
+        use_cache: Usa e crea gli snapshot dei report Excel
+        
+    Returns:
+        DataFrame normalizzato (con HASH_COLUMN se letto da uno snapshot)
+        
+    Raises:
+        ValueError: Se la colonna chiave manca
+    """
+    path = Path(path)
+    cache_path = None
+    
+    if path.suffix.lower() in COLUMNAR_SUFFIXES:
+        # Le partizioni dell'archivio hanno periodo e run: non sono dati del report
+        df = read_table(path).drop(columns=[PERIOD_COLUMN, RUN_COLUMN], errors='ignore')
+    else:
+        if use_cache and HAS_PYARROW:
+            cache_path = cache_path_for(path)
+            if cache_path.exists():
+                logger.info(f"Diff: {path.name} letto dallo snapshot {cache_path.name}")
+                return read_table(cache_path)
+        
+        df = pd.read_excel(path, sheet_name=Config.EXCEL_SHEET_NAME, dtype={key: str}, engine=EXCEL_ENGINE)
+    
+    if key not in df.columns:
+        raise ValueError(f"Colonna chiave '{key}' assente in {path.name}")
+    df = normalize_report(df, key)
+    
+    if cache_path is not None:
+        df[HASH_COLUMN] = row_hashes(df, value_columns(df, key))
+        try:
+            write_table(df, cache_path)
+            logger.info(f"Diff: snapshot {cache_path} creato")
+        except Exception as e:
+            # Lo snapshot è solo un'ottimizzazione: il confronto prosegue
+            cache_path.unlink(missing_ok=True)
+            logger.warning(f"Impossibile salvare lo snapshot di {path.name}: {e}")
+    return df
+
+
+def _occurrences(codes: np.ndarray) -> np.ndarray:
+    """Numero di occorrenza di ogni chiave (0 per la prima, 1 per la seconda, ...)."""
+    if len(pd.unique(codes)) == len(codes):
+        return np.zeros(len(codes), dtype=np.int64)
+    return pd.Series(codes).groupby(codes, sort=False).cumcount().to_numpy()
+
+
+def _align(old_keys: pd.Series, new_keys: pd.Series):
+    """
+    Allinea le righe dei due report per (chiave, occorrenza).
+    
+    Returns:
+        Tuple con (posizione in B di ogni riga di A o -1, maschera righe di
+        B assenti in A, occorrenza di ogni riga di A)
+    """
+    codes, uniques = pd.factorize(pd.concat([old_keys, new_keys], ignore_index=True))
+    old_codes, new_codes = codes[:len(old_keys)], codes[len(old_keys):]
+    old_occurrences, new_occurrences = _occurrences(old_codes), _occurrences(new_codes)
+    
+    # Identificativo intero unico per (chiave, occorrenza): nessun indice pandas
+    stride = int(max(old_occurrences.max(initial=0), new_occurrences.max(initial=0))) + 1
+    old_ids = old_codes.astype(np.int64) * stride + old_occurrences
+    new_ids = new_codes.astype(np.int64) * stride + new_occurrences
+    
+    new_positions = np.full(len(uniques) * stride, -1, dtype=np.int64)
+    new_positions[new_ids] = np.arange(len(new_ids))
+    in_old = np.zeros(len(uniques) * stride, dtype=bool)
+    in_old[old_ids] = True
+    return new_positions[old_ids], ~in_old[new_ids], old_occurrences
+
+
+def _harmonize_types(old: pd.DataFrame, new: pd.DataFrame, columns: List[str]):
+    """
+    Rende confrontabili le colonne numeriche in un report e testuali nell'altro.
+    
+    Succede confrontando formati diversi (es. report Excel e partizione
+    dell'archivio, dove le colonne miste sono testo): la colonna testuale è
+    convertita in numero se tutti i valori non vuoti sono numerici,
+    altrimenti quella numerica diventa testo.
+    
+    Returns:
+        Tuple con (report A, report B, colonne convertite)
+    """
+    converted = []
+    for col in columns:
+        old_numeric = pd.api.types.is_numeric_dtype(old[col].dtype)
+        if old_numeric == pd.api.types.is_numeric_dtype(new[col].dtype):
+            continue
+        if not converted:
+            old, new = old.copy(), new.copy()
+        converted.append(col)
+        
+        text_frame = new if old_numeric else old
+        values = text_frame[col].replace('', np.nan)
+        numbers = pd.to_numeric(values, errors='coerce')
+        if numbers.notna().sum() == values.notna().sum():
+            text_frame[col] = numbers
+        else:
+            number_frame = old if old_numeric else new
+            number_frame[col] = number_frame[col].astype(object).where(number_frame[col].notna(), '').astype(str)
+    return old, new, converted
+
+
+def _values_differ(before: np.ndarray, after: np.ndarray) -> np.ndarray:
+    """Maschera dei valori diversi (due valori mancanti sono uguali)."""
+    before, after = pd.Series(before), pd.Series(after)
+    equal = (before == after).fillna(False).to_numpy(dtype=bool)
+    missing = (before.isna() & after.isna()).to_numpy(dtype=bool)
+    return ~(equal | missing)
+
+
+def diff_reports(old: pd.DataFrame, new: pd.DataFrame, key: str = 'IMEI') -> Dict:
+    """
+    Confronta due report per chiave.
+    
+    Args:
+        old: Report di riferimento (A)
+        new: Report aggiornato (B)
+        key: Colonna chiave
+        
+    Returns:
+        Dict con 'added' e 'removed' (righe presenti solo in B o solo in A),
+        'changed' (una riga per IMEI e colonna modificata con valore A,
+        valore B e delta numerico), 'changed_keys' e le colonne presenti in
+        un solo report ('columns_added', 'columns_removed')
+    """
+    old_columns, new_columns = value_columns(old, key), value_columns(new, key)
+    columns = [col for col in old_columns if col in new_columns]
+    
+    matches, added_mask, occurrences = _align(old[key], new[key])
+    removed = old.loc[matches < 0, [key] + old_columns].reset_index(drop=True)
+    added = new.loc[added_mask, [key] + new_columns].reset_index(drop=True)
+    
+    old_rows = np.flatnonzero(matches >= 0)
+    new_rows = matches[old_rows]
+    
+    old, new, converted = _harmonize_types(old, new, columns)
+    
+    # Hash dello snapshot riusati solo se calcolati sulle stesse colonne e tipi
+    if (HASH_COLUMN in old.columns and HASH_COLUMN in new.columns
+            and old_columns == new_columns and not converted):
+        old_hashes, new_hashes = old[HASH_COLUMN].to_numpy(), new[HASH_COLUMN].to_numpy()
+    else:
+        old_hashes, new_hashes = row_hashes(old, columns), row_hashes(new, columns)
+    changed_mask = old_hashes[old_rows] != new_hashes[new_rows]
+    old_rows, new_rows = old_rows[changed_mask], new_rows[changed_mask]
+    
+    changed_keys = old[key].iloc[old_rows].to_numpy()
+    changed_occurrences = occurrences[old_rows]
+    
+    changes = []
+    for col in columns:
+        before = old[col].iloc[old_rows].to_numpy()
+        after = new[col].iloc[new_rows].to_numpy()
+        differs = _values_differ(before, after)
+        if not differs.any():
+            continue
+        
+        delta = None
+        if (pd.api.types.is_numeric_dtype(old[col].dtype)
+                and pd.api.types.is_numeric_dtype(new[col].dtype)):
+            delta = (after[differs] - before[differs]).round(2)
+        
+        changes.append(pd.DataFrame({
+            key: changed_keys[differs],
+            OCCURRENCE_COLUMN: changed_occurrences[differs],
+            'Colonna': col,
+            'Valore A': before[differs].astype(object),
+            'Valore B': after[differs].astype(object),
+            'Delta': delta
+        }))
+    
+    if changes:
+        changed = pd.concat(changes, ignore_index=True)
+        changed = changed.sort_values([key, OCCURRENCE_COLUMN], kind='stable').reset_index(drop=True)
+    else:
+        changed = pd.DataFrame(columns=[key, OCCURRENCE_COLUMN] + CHANGE_COLUMNS)
+    
+    # Hash diversi con valori uguali (es. int e float) non contano come modifiche
+    changed_count = len(changed[[key, OCCURRENCE_COLUMN]].drop_duplicates())
+    if not (changed[OCCURRENCE_COLUMN] > 0).any():
+        changed = changed.drop(columns=[OCCURRENCE_COLUMN])
+    
+    return {
+        'added': added,
+        'removed': removed,
+        'changed': changed,
+        'changed_keys': changed_count,
+        'columns_added': [col for col in new_columns if col not in old_columns],
+        'columns_removed': [col for col in old_columns if col not in new_columns]
+    }
+
+
+def write_diff(result: Dict, output_path) -> Path:
+    """
+    Salva le differenze.
+    
+    Args:
+        result: Risultato di diff_reports
+        output_path: .xlsx (un foglio per sezione) o file colonnare; per
+            .parquet/.csv ogni sezione è un file con suffisso _aggiunti,
+            _rimossi, _modificati
+            
+    Returns:
+        Path scritto (per i file colonnari quello delle modifiche)
+    """
+    output_path = Path(output_path)
+    sections = {
+        Config.DIFF_SHEET_NAMES['added']: result['added'],
+        Config.DIFF_SHEET_NAMES['removed']: result['removed'],
+        Config.DIFF_SHEET_NAMES['changed']: result['changed']
+    }
+    
+    if output_path.suffix.lower() == '.xlsx':
+        with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
+            for sheet_name, frame in sections.items():
+                frame.to_excel(writer, sheet_name=sheet_name, index=False)
+                writer.sheets[sheet_name].freeze_panes = "A2"
+        return output_path
+    
+    written = None
+    for sheet_name, frame in sections.items():
+        section_path = output_path.with_name(f"{output_path.stem}_{sheet_name.lower()}{output_path.suffix}")
+        written = write_table(normalize_report(frame, frame.columns[0]), section_path)
+    return written
@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+"""
+Motore regole differenza configurabile (tabella YAML) per VAR Processor
+
+Le regole sono valutate in ordine: la prima con tutte le condizioni vere
+determina la formula. Ogni formula è una combinazione lineare degli importi
+(in centesimi), compilata una sola volta e valutata su colonne intere.
+
+numpy e pandas sono importati solo per la valutazione: caricamento e
+validazione della tabella (--validate-only --deep) restano leggeri.
+
+Formato file:
+
+    rules:
+      - name: FINANZIARIA_FINDOMESTIC
+        when:
+          finanziaria: [FINDOMESTIC]
+        formula: importo_finanziato_wind - importo_finanziato_post
+      - name: DEFAULT
+        formula: importo_originale - importo_credito
+"""
+
+import ast
+import hashlib
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Campi condizione -> colonna del DataFrame di output
+CONDITION_FIELDS = {
+    'finanziaria': 'FINANZIARIA',
+    'causale': 'Causale',
+    'tipo': '_TIPO'
+}
+
+# Variabili formula -> colonna importo (centesimi) del DataFrame di output
+AMOUNT_FIELDS = {
+    'importo_originale': 'W-Importo Originale',
+    'importo_credito': 'B-IMPORTO CREDITO',
+    'importo_ndc': 'B-IMPORTO NDC',
+    'importo_finanziato_wind': 'W-Finanziato Wind',
+    'importo_finanziato_post': 'B-IMPORTO FINANZIATO'
+}
+
+_RULE_KEYS = {'name', 'when', 'formula', 'description'}
+
+
+class RuleValidationError(ValueError):
+    """Tabella regole non valida (errore rilevato al caricamento)."""
+
+
+class CompiledFormula:
+    """
+    Formula lineare compilata: somma di coefficiente * importo + costante.
+    
+    La costante è espressa in euro nel file e convertita in centesimi.
+    """
+    
+    def __init__(self, expression: str, terms: Dict[str, float], constant: float):
+        self.expression = expression
+        self.terms = {name: coef for name, coef in terms.items() if coef != 0}
+        self.constant_cents = constant * 100
+        self.exact = (all(float(coef).is_integer() for coef in self.terms.values())
+                      and float(self.constant_cents).is_integer())
+    
+    @classmethod
+    def compile(cls, expression: str) -> 'CompiledFormula':
+        """
+        Compila un'espressione (solo importi noti, numeri, + - * /).
+        
+        Raises:
+            RuleValidationError: Se l'espressione non è una combinazione lineare valida
+        """
+        try:
+            tree = ast.parse(str(expression), mode='eval')
+        except SyntaxError as e:
+            raise RuleValidationError(f"formula non valida '{expression}': {e.msg}")
+        terms, constant = cls._linear(tree.body, expression)
+        return cls(expression, terms, constant)
+    
+    @classmethod
+    def _linear(cls, node, expression: str) -> Tuple[Dict[str, float], float]:
+        """Riduce un nodo AST a (coefficienti per importo, costante)."""
+        if isinstance(node, ast.Name):
+            if node.id not in AMOUNT_FIELDS:
+                raise RuleValidationError(
+                    f"formula '{expression}': importo sconosciuto '{node.id}' "
+                    f"(ammessi: {', '.join(AMOUNT_FIELDS)})"
+                )
+            return {node.id: 1}, 0
+        
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) \
+                and not isinstance(node.value, bool):
+            return {}, node.value
+        
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            terms, constant = cls._linear(node.operand, expression)
+            sign = -1 if isinstance(node.op, ast.USub) else 1
+            return {name: sign * coef for name, coef in terms.items()}, sign * constant
+        
+        if isinstance(node, ast.BinOp):
+            left_terms, left_const = cls._linear(node.left, expression)
+            right_terms, right_const = cls._linear(node.right, expression)
+            
+            if isinstance(node.op, (ast.Add, ast.Sub)):
+                sign = 1 if isinstance(node.op, ast.Add) else -1
+                terms = dict(left_terms)
+                for name, coef in right_terms.items():
+                    terms[name] = terms.get(name, 0) + sign * coef
+                return terms, left_const + sign * right_const
+            
+            if isinstance(node.op, ast.Mult):
+                if left_terms and right_terms:
+                    raise RuleValidationError(f"formula '{expression}': prodotto tra importi non ammesso")
+                terms, factor = (right_terms, left_const) if not left_terms else (left_terms, right_const)
+                constant = left_const * right_const
+                return {name: coef * factor for name, coef in terms.items()}, constant
+            
+            if isinstance(node.op, ast.Div):
+                if right_terms or right_const == 0:
+                    raise RuleValidationError(f"formula '{expression}': divisione ammessa solo per costante non nulla")
+                return {name: coef / right_const for name, coef in left_terms.items()}, left_const / right_const
+        
+        raise RuleValidationError(
+            f"formula '{expression}': operazione non ammessa ({type(node).__name__})"
+        )
+    
+    def evaluate(self, amounts: Dict[str, 'np.ndarray'], mask: Optional['np.ndarray'] = None) -> 'np.ndarray':
+        """
+        Valuta la formula su colonne di importi in centesimi.
+        
+        Args:
+            amounts: Importi (centesimi int64) per variabile formula
+            mask: Righe da valutare (None = tutte)
+            
+        Returns:
+            Differenze in centesimi (int64)
+        """
+        import numpy as np
+        
+        size = len(next(iter(amounts.values()))) if mask is None else int(mask.sum())
+        result = np.full(size, self.constant_cents, dtype=np.int64 if self.exact else np.float64)
+        for name, coef in self.terms.items():
+            values = amounts[name] if mask is None else amounts[name][mask]
+            result = result + (int(coef) if self.exact else coef) * values
+        return result if self.exact else np.rint(result).astype(np.int64)
+    
+    def evaluate_scalar(self, amounts: Dict[str, float], in_cents: bool = False) -> float:
+        """
+        Valuta la formula su singoli valori.
+        
+        Args:
+            amounts: Importi per variabile formula
+            in_cents: True se gli importi sono in centesimi (altrimenti euro)
+            
+        Returns:
+            Differenza nella stessa unità degli importi
+        """
+        constant = self.constant_cents if in_cents else self.constant_cents / 100
+        result = sum(coef * amounts.get(name, 0) for name, coef in self.terms.items()) + constant
+        if in_cents:
+            return int(round(result))
+        return result
+
+
+class DifferenceRule:
+    """Regola compilata: condizioni di uguaglianza + formula."""
+    
+    def __init__(self, name: str, conditions: Dict[str, List[str]], formula: CompiledFormula,
+                 description: str = ''):
+        self.name = name
+        self.conditions = conditions
+        self.formula = formula
+        self.description = description
+        self._condition_sets = {field: frozenset(values) for field, values in conditions.items()}
+    
+    @property
+    def is_default(self) -> bool:
+        """True se la regola non ha condizioni (si applica sempre)."""
+        return not self.conditions
+    
+    def mask(self, frame: 'pd.DataFrame') -> 'np.ndarray':
+        """Restituisce la maschera booleana delle righe che soddisfano le condizioni."""
+        import numpy as np
+        
+        result = np.ones(len(frame), dtype=bool)
+        for field, values in self.conditions.items():
+            column = CONDITION_FIELDS[field]
+            if column in frame.columns:
+                result &= frame[column].isin(values).to_numpy(dtype=bool)
+            else:
+                result &= '' in self._condition_sets[field]
+        return result
+    
+    def matches(self, values: Dict[str, str]) -> bool:
+        """Verifica le condizioni su singoli valori."""
+        return all(values.get(field, '') in allowed for field, allowed in self._condition_sets.items())
+    
+    def covers(self, other: 'DifferenceRule') -> bool:
+        """
+        Indica se ogni riga di other soddisfa anche questa regola.
+        
+        Vero se per ogni campo di questa regola other ha una condizione sullo
+        stesso campo con valori contenuti nei suoi: valutata prima, questa
+        regola rende other non raggiungibile.
+        """
+        return all(field in other._condition_sets and other._condition_sets[field] <= allowed
+                   for field, allowed in self._condition_sets.items())
+
+
+class DifferenceRuleSet:
+    """
+    Tabella regole differenza compilata e validata.
+    
+    Le maschere delle condizioni sono calcolate con isin sulle colonne
+    (codici interi se categoriche) e ogni formula è valutata solo sulle
+    righe non ancora assegnate.
+    """
+    
+    def __init__(self, rules: List[DifferenceRule], source: str = 'built-in'):
+        self.rules = rules
+        self.source = source
+        self.rule_names = [rule.name for rule in rules]
+    
+    @classmethod
+    def from_dict(cls, data, source: str = 'dict') -> 'DifferenceRuleSet':
+        """
+        Valida e compila una tabella regole.
+        
+        Args:
+            data: Contenuto del file (dict con chiave 'rules')
+            source: Origine (per messaggi di errore)
+            
+        Returns:
+            Tabella compilata
+            
+        Raises:
+            RuleValidationError: Con l'elenco di tutti i problemi rilevati
+        """
+        errors = []
+        if not isinstance(data, dict) or not isinstance(data.get('rules'), list) or not data['rules']:
+            raise RuleValidationError(f"{source}: atteso un elenco non vuoto 'rules'")
+        
+        rules: List[DifferenceRule] = []
+        names = set()
+        for position, raw in enumerate(data['rules'], start=1):
+            label = f"regola {position}"
+            if not isinstance(raw, dict):
+                errors.append(f"{label}: attesa una mappa name/when/formula")
+                continue
+            
+            name = raw.get('name')
+            if not isinstance(name, str) or not name.strip():
+                errors.append(f"{label}: 'name' mancante")
+                name = label
+            else:
+                label = f"regola {position} ({name})"
+            if name in names:
+                errors.append(f"{label}: nome duplicato")
+            names.add(name)
+            
+            unknown = set(raw) - _RULE_KEYS
+            if unknown:
+                errors.append(f"{label}: chiavi sconosciute {sorted(unknown)}")
+            
+            conditions = {}
+            when = raw.get('when') or {}
+            if not isinstance(when, dict):
+                errors.append(f"{label}: 'when' deve essere una mappa campo -> valori")
+                when = {}
+            for field, values in when.items():
+                if field not in CONDITION_FIELDS:
+                    errors.append(f"{label}: campo condizione sconosciuto '{field}' "
+                                  f"(ammessi: {', '.join(CONDITION_FIELDS)})")
+                    continue
+                values = [values] if isinstance(values, str) else values
+                if not isinstance(values, list) or not values or \
+                        not all(isinstance(value, (str, int)) for value in values):
+                    errors.append(f"{label}: valori non validi per '{field}'")
+                    continue
+                conditions[field] = [str(value) for value in values]
+            
+            if 'formula' not in raw:
+                errors.append(f"{label}: 'formula' mancante")
+                continue
+            try:
+                formula = CompiledFormula.compile(raw['formula'])
+            except RuleValidationError as e:
+                errors.append(f"{label}: {e}")
+                continue
+            
+            rule = DifferenceRule(name, conditions, formula, str(raw.get('description', '')))
+            shadow = next((earlier for earlier in rules if earlier.covers(rule)), None)
+            if shadow is not None:
+                errors.append(f"{label}: non raggiungibile, coperta dalla regola precedente '{shadow.name}'")
+            rules.append(rule)
+        
+        if rules and not rules[-1].is_default:
+            errors.append("l'ultima regola deve essere senza condizioni (default)")
+        
+        if errors:
+            raise RuleValidationError(f"{source}: tabella regole non valida:\n  - " + "\n  - ".join(errors))
+        
+        return cls(rules, source)
+    
+    @property
+    def digest(self) -> str:
+        """Impronta del contenuto compilato (ordine, condizioni e formule), indipendente dal path."""
+        canonical = [
+            (rule.name, sorted((field, sorted(values)) for field, values in rule.conditions.items()),
+             sorted(rule.formula.terms.items()), rule.formula.constant_cents)
+            for rule in self.rules
+        ]
+        return hashlib.sha256(repr(canonical).encode('utf-8')).hexdigest()[:12]
+    
+    @classmethod
+    def built_in(cls) -> 'DifferenceRuleSet':
+        """Regole predefinite (logica storica basata su Config)."""
+        rules = [
+            {'name': f"FINANZIARIA_{finanziaria}", 'when': {'finanziaria': [finanziaria]},
+             'formula': 'importo_finanziato_wind - importo_finanziato_post'}
+            for finanziaria in Config.FINANZIARIE_PRIORITY
+        ]
+        rules += [
+            {'name': 'CAUSALE_TEL_INCLUSO', 'when': {'causale': [Config.CAUSALE_TEL_INCLUSO]},
+             'formula': 'importo_originale - importo_credito'},
+            {'name': 'CAUSALE_PROMOCASH', 'when': {'causale': [Config.CAUSALE_PROMOCASH]},
+             'formula': 'importo_originale - importo_ndc'},
+            {'name': 'DEFAULT', 'formula': 'importo_originale - importo_credito'}
+        ]
+        return cls.from_dict({'rules': rules}, source='built-in')
+    
+    @classmethod
+    def load(cls, path=None) -> 'DifferenceRuleSet':
+        """
+        Carica la tabella regole da YAML.
+        
+        Args:
+            path: File YAML (default Config.DIFFERENCE_RULES_FILE); se assente
+                  vengono usate le regole predefinite
+                  
+        Returns:
+            Tabella compilata
+            
+        Raises:
+            RuleValidationError: Se il file non è valido
+        """
+        path = path or Config.DIFFERENCE_RULES_FILE
+        if not path or not Path(path).exists():
+            if path:
+                logger.warning(f"File regole {path} non trovato: uso regole predefinite")
+            return cls.built_in()
+        
+        try:
+            import yaml
+        except ImportError:
+            logger.warning("pyyaml non installato: uso regole differenza predefinite")
+            return cls.built_in()
+        
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = yaml.safe_load(f)
+        except yaml.YAMLError as e:
+            raise RuleValidationError(f"{path}: YAML non valido: {e}")
+        
+        rule_set = cls.from_dict(data, source=str(path))
+        logger.info(f"Regole differenza caricate da {Path(path).name}: {len(rule_set.rules)} regole")
+        return rule_set
+    
+    def evaluate(self, frame: 'pd.DataFrame') -> Tuple['np.ndarray', 'np.ndarray']:
+        """
+        Applica le regole a tutte le righe di un DataFrame di output.
+        
+        Args:
+            frame: DataFrame con colonne condizione e importi in centesimi
+            
+        Returns:
+            Tuple con (differenze in centesimi int64, indice regola applicata int16)
+        """
+        import numpy as np
+        
+        size = len(frame)
+        amounts = {
+            name: frame[column].to_numpy(dtype=np.int64) if column in frame.columns
+            else np.zeros(size, dtype=np.int64)
+            for name, column in AMOUNT_FIELDS.items()
+        }
+        differences = np.zeros(size, dtype=np.int64)
+        rule_index = np.full(size, -1, dtype=np.int16)
+        remaining = np.ones(size, dtype=bool)
+        
+        for index, rule in enumerate(self.rules):
+            mask = remaining if rule.is_default else remaining & rule.mask(frame)
+            if not mask.any():
+                continue
+            differences[mask] = rule.formula.evaluate(amounts, mask)
+            rule_index[mask] = index
+            remaining &= ~mask
+            if not remaining.any():
+                break
+        
+        return differences, rule_index
+    
+    def hit_counts(self, rule_index: 'np.ndarray') -> Dict[str, int]:
+        """Restituisce il numero di righe per regola (tutte le regole, anche a zero)."""
+        import numpy as np
+        
+        counts = np.bincount(rule_index[rule_index >= 0], minlength=len(self.rules))
+        return {name: int(count) for name, count in zip(self.rule_names, counts)}
+    
+    def method_labels(self, rule_index: 'np.ndarray') -> 'pd.Categorical':
+        """Restituisce il nome regola per riga come categorical."""
+        import numpy as np
+        import pandas as pd
+        
+        return pd.Categorical.from_codes(rule_index.astype(np.int64), categories=self.rule_names)
+    
+    def match(self, finanziaria: str, causale: str, tipo: str = '') -> DifferenceRule:
+        """Restituisce la prima regola applicabile a singoli valori."""
+        values = {'finanziaria': finanziaria, 'causale': causale, 'tipo': tipo}
+        for rule in self.rules:
+            if rule.matches(values):
+                return rule
+        return self.rules[-1]
+
+
+_default_rule_set: Optional[DifferenceRuleSet] = None
+
+
+def get_rule_set() -> DifferenceRuleSet:
+    """Restituisce la tabella regole configurata (caricata e compilata una sola volta)."""
+    global _default_rule_set
+    if _default_rule_set is None:
+        _default_rule_set = DifferenceRuleSet.load()
+    return _default_rule_set
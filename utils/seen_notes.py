@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Registro persistente delle note credito già riconciliate (Bloom filter + archivio esatto)
+"""
+
+import os
+import math
+import logging
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import Config
+from utils.columnar import write_table, read_table, default_suffix
+
+logger = logging.getLogger(__name__)
+
+KEY_COLUMN = 'CHIAVE'
+KEY_TYPE_COLUMN = 'TIPO_CHIAVE'
+PERIOD_COLUMN = 'PERIODO'
+KEY_TYPE_NOTE = 'NOTA'
+KEY_TYPE_PAIR = 'IMEI_NOTA'
+
+# Chiavi di hash distinte (16 byte) per il double hashing del Bloom filter
+_HASH_KEYS = ('var_bloom_key__1', 'var_bloom_key__2')
+
+
+class BloomFilter:
+    """
+    Bloom filter su array numpy con hashing vettoriale.
+    
+    Le k posizioni di ogni chiave sono calcolate con double hashing
+    (h1 + i * h2) sugli hash pandas: nessun ciclo Python per chiave.
+    """
+    
+    def __init__(self, capacity: int, error_rate: float):
+        """
+        Dimensiona il filtro.
+        
+        Args:
+            capacity: Numero atteso di chiavi
+            error_rate: Probabilità di falso positivo alla capacità
+        """
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        self.size = max(8, int(math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hash_count = max(1, int(round(self.size / self.capacity * math.log(2))))
+        self.bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        self.count = 0
+    
+    def _positions(self, keys: np.ndarray) -> np.ndarray:
+        """Restituisce la matrice (chiavi x k) delle posizioni dei bit."""
+        h1 = pd.util.hash_array(keys, hash_key=_HASH_KEYS[0], categorize=False)
+        h2 = pd.util.hash_array(keys, hash_key=_HASH_KEYS[1], categorize=False) | np.uint64(1)
+        steps = np.arange(self.hash_count, dtype=np.uint64)
+        return (h1[:, None] + steps[None, :] * h2[:, None]) % np.uint64(self.size)
+    
+    def add(self, keys: np.ndarray) -> None:
+        """Aggiunge le chiavi al filtro."""
+        if len(keys) == 0:
+            return
+        positions = self._positions(keys).ravel()
+        np.bitwise_or.at(self.bits, positions >> np.uint64(3),
+                         (np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8)))
+        self.count += len(keys)
+    
+    def might_contain(self, keys: np.ndarray) -> np.ndarray:
+        """Maschera delle chiavi forse presenti (False = sicuramente assenti)."""
+        if len(keys) == 0:
+            return np.zeros(0, dtype=bool)
+        positions = self._positions(keys)
+        hits = (self.bits[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+        return hits.all(axis=1)
+    
+    def save(self, path: Path) -> None:
+        """Salva il filtro (scrittura atomica)."""
+        tmp_path = path.with_name(f"{path.stem}.tmp.npz")
+        np.savez_compressed(tmp_path, bits=self.bits,
+                            meta=np.array([self.capacity, self.size, self.hash_count, self.count], dtype=np.int64),
+                            error_rate=np.array([self.error_rate]))
+        os.replace(tmp_path, path)
+    
+    @classmethod
+    def load(cls, path: Path) -> 'BloomFilter':
+        """Carica un filtro salvato con save()."""
+        with np.load(path) as data:
+            capacity, size, hash_count, count = (int(value) for value in data['meta'])
+            bloom = cls(capacity, float(data['error_rate'][0]))
+            bloom.size, bloom.hash_count, bloom.count = size, hash_count, count
+            bloom.bits = data['bits'].copy()
+        return bloom
+
+
+class CreditNoteRegistry:
+    """
+    Insieme persistente delle note credito viste nei run precedenti.
+    
+    Due livelli: un Bloom filter compatto (bloom.npz) scarta in memoria le
+    chiavi mai viste; solo i positivi sono verificati sull'archivio esatto
+    (chiavi.parquet, ordinato per chiave), che registra anche il periodo di
+    competenza di origine. Una chiave conta come ripetuta solo se registrata
+    per un periodo diverso: rielaborare lo stesso periodo (file riesportati,
+    altre regole, correzioni a monte) non segnala nulla.
+    """
+    
+    def __init__(self, root, capacity: Optional[int] = None, error_rate: Optional[float] = None):
+        """
+        Apre (o prepara) il registro.
+        
+        Args:
+            root: Directory del registro (creata alla prima scrittura)
+            capacity: Chiavi attese (default Config.SEEN_NOTES_CAPACITY)
+            error_rate: Falsi positivi ammessi (default Config.SEEN_NOTES_ERROR_RATE)
+        """
+        self.root = Path(root)
+        self.bloom_path = self.root / 'bloom.npz'
+        self.keys_path = self.root / f"chiavi{default_suffix()}"
+        self.capacity = capacity or Config.SEEN_NOTES_CAPACITY
+        self.error_rate = error_rate or Config.SEEN_NOTES_ERROR_RATE
+        
+        if self.bloom_path.exists():
+            self.bloom = BloomFilter.load(self.bloom_path)
+        else:
+            self.bloom = BloomFilter(self.capacity, self.error_rate)
+    
+    @staticmethod
+    def build_keys(imeis: pd.Series, notes: pd.Series) -> Tuple[pd.Series, pd.Series]:
+        """
+        Costruisce le chiavi nota e (IMEI, nota) normalizzate.
+        
+        Args:
+            imeis: IMEI puliti
+            notes: Numeri nota credito
+            
+        Returns:
+            Tuple (chiavi nota, chiavi IMEI|nota); NaN dove la nota è vuota
+        """
+        note_keys = notes.astype(str).str.strip().str.upper()
+        note_keys = note_keys.where(notes.notna() & (note_keys != '') & (note_keys != 'NAN'))
+        pair_keys = imeis.astype(str) + '|' + note_keys
+        return note_keys, pair_keys.where(note_keys.notna())
+    
+    def find_repeats(self, note_keys: pd.Series, pair_keys: pd.Series, period: str) -> pd.Series:
+        """
+        Individua le righe con nota già vista in un altro periodo.
+        
+        Args:
+            note_keys: Chiavi nota (build_keys)
+            pair_keys: Chiavi IMEI|nota (build_keys)
+            period: Periodo di competenza del run corrente (YYYY-MM)
+            
+        Returns:
+            Serie con KEY_TYPE_PAIR (stesso IMEI e nota), KEY_TYPE_NOTE (stessa
+            nota su altro IMEI) o stringa vuota
+        """
+        result = pd.Series('', index=note_keys.index, dtype=object)
+        pair_seen = self._seen_elsewhere(pair_keys, KEY_TYPE_PAIR, period)
+        note_seen = self._seen_elsewhere(note_keys, KEY_TYPE_NOTE, period)
+        result[note_seen] = KEY_TYPE_NOTE
+        result[pair_seen] = KEY_TYPE_PAIR
+        return result
+    
+    def _seen_elsewhere(self, keys: pd.Series, key_type: str, period: str) -> np.ndarray:
+        """Maschera delle chiavi presenti nell'archivio esatto con un periodo diverso."""
+        seen = np.zeros(len(keys), dtype=bool)
+        valid = keys.notna().to_numpy()
+        if not valid.any() or not self.keys_path.exists():
+            return seen
+        
+        values = keys.to_numpy(dtype=object)
+        candidates = valid.copy()
+        candidates[valid] = self.bloom.might_contain(values[valid])
+        if not candidates.any():
+            return seen
+        
+        # Verifica esatta solo dei positivi del Bloom filter
+        unique_candidates = pd.unique(values[candidates])
+        stored = read_table(self.keys_path, columns=[KEY_COLUMN, KEY_TYPE_COLUMN, PERIOD_COLUMN],
+                            filters={KEY_COLUMN: list(unique_candidates)})
+        stored = stored[(stored[KEY_TYPE_COLUMN] == key_type) & (stored[PERIOD_COLUMN] != period)]
+        seen[candidates] = pd.Series(values[candidates]).isin(stored[KEY_COLUMN]).to_numpy()
+        return seen
+    
+    def register(self, note_keys: pd.Series, pair_keys: pd.Series, period: str) -> int:
+        """
+        Registra le chiavi di un run (le chiavi già presenti restano al periodo di origine).
+        
+        L'archivio esatto è riscritto per intero a ogni run con nuove chiavi.
+        Il Bloom filter è salvato per primo: un'interruzione tra le due
+        scritture lascia al più chiavi in eccesso nel filtro (falsi positivi,
+        verificati sull'archivio), mai chiavi mancanti.
+        
+        Args:
+            note_keys: Chiavi nota (build_keys)
+            pair_keys: Chiavi IMEI|nota (build_keys)
+            period: Periodo di competenza del run (YYYY-MM)
+            
+        Returns:
+            Nuove chiavi registrate
+        """
+        new = pd.concat([
+            pd.DataFrame({KEY_COLUMN: note_keys.dropna().unique(), KEY_TYPE_COLUMN: KEY_TYPE_NOTE}),
+            pd.DataFrame({KEY_COLUMN: pair_keys.dropna().unique(), KEY_TYPE_COLUMN: KEY_TYPE_PAIR})
+        ], ignore_index=True)
+        new[PERIOD_COLUMN] = period
+        
+        stored = None
+        if self.keys_path.exists():
+            stored = read_table(self.keys_path, columns=[KEY_COLUMN, KEY_TYPE_COLUMN, PERIOD_COLUMN]).astype(str)
+            known = stored[KEY_COLUMN] + '\x00' + stored[KEY_TYPE_COLUMN]
+            new = new[~(new[KEY_COLUMN] + '\x00' + new[KEY_TYPE_COLUMN]).isin(known)]
+        if new.empty:
+            return 0
+        
+        combined = new if stored is None else pd.concat([stored, new], ignore_index=True)
+        combined = combined.sort_values(KEY_COLUMN, kind='stable').reset_index(drop=True)
+        
+        # Filtro ridimensionato (capacità doppia) se le chiavi superano la capacità
+        if len(combined) > self.bloom.capacity:
+            capacity = max(self.bloom.capacity * 2, len(combined))
+            logger.info(f"Registro note credito: Bloom filter ridimensionato a {capacity:,} chiavi")
+            self.bloom = BloomFilter(capacity, self.error_rate)
+            self.bloom.add(combined[KEY_COLUMN].to_numpy(dtype=object))
+        else:
+            self.bloom.add(new[KEY_COLUMN].to_numpy(dtype=object))
+        
+        # Prima il filtro (temporaneo + replace), poi l'archivio esatto
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.bloom.save(self.bloom_path)
+        tmp_path = self.keys_path.with_name(f"{self.keys_path.stem}.tmp{self.keys_path.suffix}")
+        write_table(combined, tmp_path, row_group_size=Config.ARCHIVE_ROW_GROUP_SIZE)
+        os.replace(tmp_path, self.keys_path)
+        
+        logger.info(f"Registro note credito: {len(new):,} nuove chiavi ({len(combined):,} totali)")
+        return len(new)
+    
+    def statistics(self) -> Dict:
+        """Restituisce dimensione e riempimento del Bloom filter."""
+        return {
+            'keys': self.bloom.count,
+            'capacity': self.bloom.capacity,
+            'bloom_bytes': int(self.bloom.bits.nbytes)
+        }
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Passaggio zero-copy dei DataFrame tra processi (file Arrow IPC mappati in memoria)
+"""
+
+import os
+import uuid
+import shutil
+import logging
+import tempfile
+from pathlib import Path
+from typing import List, Optional
+
+import pandas as pd
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    HAS_PYARROW = True
+except ImportError:
+    pa = None
+    HAS_PYARROW = False
+
+SHARED_SUFFIX = '.arrow'
+
+
+def create_shared_directory() -> Optional[Path]:
+    """
+    Crea la directory di scambio di un'elaborazione parallela.
+    
+    Predefinita /dev/shm (file in RAM condivisa) se presente, altrimenti la
+    directory temporanea di sistema.
+    
+    Returns:
+        Path della directory o None se il passaggio zero-copy non è disponibile
+    """
+    if not Config.ENABLE_SHARED_FRAMES or not HAS_PYARROW:
+        return None
+    
+    base = Config.SHARED_FRAMES_DIR
+    if base is None and os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        base = '/dev/shm'
+    return Path(tempfile.mkdtemp(prefix='var_frames_', dir=base))
+
+
+def remove_shared_directory(directory: Optional[Path]) -> None:
+    """Rimuove la directory di scambio (le tabelle già mappate restano valide su POSIX)."""
+    if directory is not None:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class SharedFrame:
+    """
+    Riferimento a un DataFrame pubblicato come file Arrow IPC.
+    
+    Il worker scrive il file e restituisce solo questo oggetto (pochi byte
+    serializzati); il processo principale mappa il file in memoria senza
+    copiarlo né deserializzarlo.
+    """
+    
+    def __init__(self, path: Path, rows: int, name: str):
+        self.path = path
+        self.rows = rows
+        self.name = name
+    
+    def __len__(self) -> int:
+        return self.rows
+    
+    @staticmethod
+    def publish(df: pd.DataFrame, directory: Optional[Path], name: str):
+        """
+        Pubblica un DataFrame nella directory di scambio.
+        
+        Args:
+            df: DataFrame da pubblicare
+            directory: Directory di scambio (None = nessuna pubblicazione)
+            name: Nome descrittivo (per file e log)
+            
+        Returns:
+            SharedFrame, oppure il DataFrame stesso se non convertibile in Arrow
+            (es. colonne con tipi misti) o senza directory di scambio
+        """
+        if directory is None or not HAS_PYARROW:
+            return df
+        
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+            logger.debug(f"Frame {name} non convertibile in Arrow ({e}): restituito serializzato")
+            return df
+        
+        path = Path(directory) / f"{name}_{os.getpid()}_{uuid.uuid4().hex[:8]}{SHARED_SUFFIX}"
+        with pa.OSFile(str(path), 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        return SharedFrame(path, len(df), name)
+    
+    def table(self):
+        """Mappa il file in memoria come tabella Arrow (nessuna copia dei dati)."""
+        with pa.memory_map(str(self.path), 'r') as source:
+            return pa.ipc.open_file(source).read_all()
+    
+    def load(self) -> pd.DataFrame:
+        """Converte la tabella mappata in DataFrame."""
+        return self.table().to_pandas(split_blocks=True)
+    
+    @staticmethod
+    def resolve(frame) -> pd.DataFrame:
+        """Restituisce il DataFrame, mappandolo se pubblicato come SharedFrame."""
+        return frame.load() if isinstance(frame, SharedFrame) else frame
+    
+    @staticmethod
+    def combine(frames: List) -> pd.DataFrame:
+        """
+        Unisce DataFrame e SharedFrame nell'ordine dato.
+        
+        Se tutti i frame sono pubblicati le tabelle mappate sono concatenate
+        senza copia (blocchi Arrow affiancati) e convertite una sola volta.
+        
+        Args:
+            frames: DataFrame o SharedFrame
+            
+        Returns:
+            DataFrame unito (indice 0..n-1)
+        """
+        if frames and all(isinstance(frame, SharedFrame) for frame in frames):
+            try:
+                tables = [frame.table() for frame in frames]
+                return pa.concat_tables(tables, promote_options='default').to_pandas(split_blocks=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+                logger.debug(f"Schemi Arrow incompatibili ({e}): unione con pandas")
+        
+        return pd.concat([SharedFrame.resolve(frame) for frame in frames], ignore_index=True)
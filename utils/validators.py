@@ -4,12 +4,15 @@ Utilities per validazioni VAR Processor
 """
 
 import re
+import numpy as np
 import pandas as pd
 from typing import Optional, List, Dict, Tuple
 import logging
 
 logger = logging.getLogger(__name__)
 
+IMEI_LENGTH = 15
+
 class IMEIValidator:
     """Validatore per codici IMEI."""
     
@@ -36,10 +39,15 @@ class IMEIValidator:
         
         return None
     
+    @staticmethod
+    def extract_digits(imei_series: pd.Series) -> pd.Series:
+        """Cifre di ogni valore (stessa pulizia di validate, vettoriale; NaN se mancante)."""
+        return imei_series.astype(str).str.replace(r'\D', '', regex=True)
+    
     @staticmethod
     def validate_batch(imei_series: pd.Series) -> Tuple[pd.Series, Dict[str, int]]:
         """
-        Valida una serie di IMEI in batch.
+        Valida una serie di IMEI in batch (vettoriale, stesso esito di validate).
         
         Args:
             imei_series: Serie pandas con IMEI
@@ -47,7 +55,8 @@ class IMEIValidator:
         Returns:
             Tuple con (serie IMEI puliti, statistiche)
         """
-        cleaned_series = imei_series.apply(IMEIValidator.validate)
+        digits = IMEIValidator.extract_digits(imei_series)
+        cleaned_series = digits.where(digits.str.len() == IMEI_LENGTH)
         
         stats = {
             'total': len(imei_series),
@@ -59,6 +68,26 @@ class IMEIValidator:
             logger.warning(f"IMEI validation: {stats['valid']}/{stats['total']} validi, {stats['invalid']} invalidi")
         
         return cleaned_series, stats
+    
+    @staticmethod
+    def rejection_reasons(imei_series: pd.Series) -> pd.Series:
+        """
+        Classifica il motivo di scarto di IMEI non validi.
+        
+        Args:
+            imei_series: IMEI grezzi scartati da validate_batch
+            
+        Returns:
+            Serie con IMEI_MANCANTE, IMEI_SENZA_CIFRE, IMEI_CORTO o IMEI_LUNGO
+        """
+        digits = IMEIValidator.extract_digits(imei_series).str.len().fillna(0).to_numpy()
+        missing = (imei_series.isna() | (imei_series.astype(str).str.strip() == '')).to_numpy()
+        reasons = np.select(
+            [missing, digits == 0, digits < IMEI_LENGTH],
+            ['IMEI_MANCANTE', 'IMEI_SENZA_CIFRE', 'IMEI_CORTO'],
+            default='IMEI_LUNGO'
+        )
+        return pd.Series(reasons, index=imei_series.index, dtype=object)
 
 
 class DataFrameValidator:
@@ -193,19 +222,29 @@ class BusinessValidator:
     """Validatore per regole business specifiche."""
     
     @staticmethod
-    def validate_imei_uniqueness(imei_map: Dict, source_name: str) -> bool:
+    def validate_imei_uniqueness(imeis, source_name: str) -> bool:
         """
-        Valida unicità IMEI in una mappa.
+        Valida unicità IMEI.
         
         Args:
-            imei_map: Dict con IMEI come chiavi
+            imeis: Serie di IMEI (vettoriale con duplicated) o Dict con IMEI come chiavi
             source_name: Nome sorgente per logging
             
         Returns:
             True se tutti gli IMEI sono unici
         """
-        total_imei = len(imei_map)
-        logger.info(f"{source_name}: {total_imei} IMEI unici processati")
+        if isinstance(imeis, dict):
+            logger.info(f"{source_name}: {len(imeis)} IMEI unici processati")
+            return True
+        
+        duplicated = imeis.duplicated(keep=False)
+        duplicate_count = int(imeis[duplicated].nunique())
+        if duplicate_count:
+            logger.warning(f"{source_name}: {duplicate_count} IMEI duplicati "
+                           f"({int(duplicated.sum())} righe coinvolte)")
+            return False
+        
+        logger.info(f"{source_name}: {len(imeis)} IMEI unici")
         return True
     
     @staticmethod
@@ -214,7 +253,7 @@ class BusinessValidator:
         Valida consistenza dati finanziari.
         
         Args:
-            data_record: Record dati finanziari
+            data_record: Record dati finanziari (importo in centesimi)
             
         Returns:
             Lista messaggi di warning
@@ -229,14 +268,14 @@ class BusinessValidator:
             warnings.append(f"Finanziaria {finanziaria} ma importo 0")
         
         if not finanziaria and importo > 0:
-            warnings.append(f"Importo {importo} ma finanziaria vuota")
+            warnings.append(f"Importo {importo / 100:.2f} ma finanziaria vuota")
         
         return warnings
     
     @staticmethod
     def validate_difference_calculation(original: float, credit: float, 
                                       ndc: float, difference: float,
-                                      causale: str) -> bool:
+                                      causale: str, rule_set=None) -> bool:
         """
         Valida correttezza calcolo differenza.
         
@@ -246,18 +285,15 @@ class BusinessValidator:
             ndc: Importo NDC
             difference: Differenza calcolata
             causale: Causale per logica
+            rule_set: Tabella regole del calcolo (default get_rule_set(); VARProcessor.rules con --rules)
             
         Returns:
             True se il calcolo è corretto
         """
-        expected = None
+        from utils.calculators import DifferenceCalculator
         
-        if causale == 'TEL_INCLUSO':
-            expected = original - credit
-        elif causale == 'PROMOCASH':
-            expected = original - ndc
-        else:
-            expected = original - credit
+        # Stessa tabella regole del calcolo (solo logica causale: nessuna finanziaria)
+        expected = DifferenceCalculator.calculate(causale, '', original, credit, ndc, 0.0, 0.0, rule_set)
         
         # Tolleranza per arrotondamenti float
         tolerance = 0.01